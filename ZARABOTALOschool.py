@@ -1,21 +1,156 @@
+import time
+STARTUP_STARTED = time.perf_counter()   # отсчёт для --startup-timing, до всех остальных импортов
+
 import tkinter as tk
 from tkinter import ttk, messagebox
-import pyodbc
 import random
-from PIL import Image, ImageTk
+from PIL import Image
 import customtkinter as ctk
+import base64
+import hashlib
+import hmac
+import json
+import mmap
 import os
+import queue
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 # Конфигурация базы данных школы для SQL Server
 DB_CONFIG = {
+    'backend': os.environ.get('SCHOOL_DB_BACKEND', 'sqlserver'),  # 'sqlserver' или 'sqlite'
+    'sqlite_path': os.environ.get('SCHOOL_DB_PATH', 'school_db.sqlite3'),
     'driver': '{ODBC Driver 17 for SQL Server}',
     'server': '(localdb)\\MSSQLLocalDB',
     'database': 'school_db',
     'trusted_connection': 'yes'
 }
 
+# Настройки пула соединений с базой данных
+POOL_CONFIG = {
+    'max_size': 8,              # максимум одновременно открытых соединений
+    'idle_timeout': 300,        # через сколько секунд простоя соединение закрывается
+    'checkout_timeout': 10,     # сколько секунд ждать свободное соединение
+    'health_check_after': 30    # проверять соединение, если оно простаивало дольше (0 - всегда)
+}
+
+# Картинки капчи: папка с исходниками и кэш уже уменьшенной картинки
+CAPTCHA_CONFIG = {
+    'asset_dir': os.environ.get('SCHOOL_CAPTCHA_DIR', r"C:\Users\Eduard\Downloads\Эд"),
+    'cache_dir': os.environ.get('SCHOOL_CAPTCHA_CACHE', str(Path.home() / '.school_captcha')),
+    'source_image': 'captcha.png',   # одна картинка для нарезки; без неё собирается из 1.png-4.png
+    'image_size': 300,               # сторона подготовленной картинки в кэше, пикселей
+    'grid_size': max(2, int(os.environ.get('SCHOOL_CAPTCHA_GRID', 2))),  # пазл N×N, не меньше 2×2
+    'display_size': 200,             # сторона собранного пазла на экране, пикселей
+    'pregenerate': 3                 # сколько готовых пазлов держать про запас (0 - создавать по требованию)
+}
+
+# Сколько неверных паролей подряд блокирует аккаунт
+MAX_LOGIN_ATTEMPTS = 3
+
+# Хэширование паролей; стоимость подбирается командой --calibrate-password <мс>
+PASSWORD_CONFIG = {
+    'algorithm': 'scrypt',   # 'scrypt' или 'pbkdf2_sha256' (если OpenSSL собран без scrypt)
+    'scrypt_n': int(os.environ.get('SCHOOL_SCRYPT_N', 2 ** 14)),
+    'scrypt_r': 8,
+    'scrypt_p': 1,
+    'pbkdf2_iterations': int(os.environ.get('SCHOOL_PBKDF2_ITERATIONS', 600000)),
+    'salt_bytes': 16
+}
+
+# Сколько пользователей админка подгружает за раз при прокрутке списка
+USERS_PAGE_SIZE = 200
+
+# Сколько секунд справочники (классы, предметы, учителя) живут в памяти без перечитывания.
+# Свои изменения сбрасывают кэш сразу; срок нужен для изменений из других запущенных программ
+REFERENCE_CACHE_TTL = 300
+
+# Сколько секунд показатели вкладки «Статистика» берутся из памяти (0 - всегда из базы)
+ADMIN_STATS_TTL = 60
+
+# Пауза после последнего нажатия клавиши в строке поиска перед запросом к базе, мс
+SEARCH_DEBOUNCE_MS = 300
+
+# Через сколько секунд данные открытой ранее вкладки перезагружаются при возврате (None - не перезагружать)
+TAB_STALE_AFTER = None
+
+# Замеры запросов к базе: время выполнения и чтения, гистограммы по каждому виду запроса
+QUERY_STATS_CONFIG = {
+    'enabled': os.environ.get('SCHOOL_QUERY_STATS', '1') != '0',
+    'slow_query_ms': float(os.environ.get('SCHOOL_SLOW_QUERY_MS', 200)),   # медленнее - пишется в журнал
+    'slow_log': os.environ.get('SCHOOL_SLOW_QUERY_LOG', str(Path.home() / '.school_slow_queries.log')),
+    'top': 10    # сколько самых затратных запросов показывать на вкладке статистики
+}
+
+# Синтетическая школа для --generate-data и --benchmark; любое значение меняется аргументом ключ=число
+BENCHMARK_CONFIG = {
+    'seed': 42,
+    'classes': 200,
+    'students': 6000,
+    'teachers': 300,
+    'subjects': 20,
+    'years': 5,                 # за сколько учебных лет создаются оценки, задания и посещаемость
+    'lessons_per_day': 6,
+    'grades_per_lesson': 3,     # сколько учеников класса получают оценку на каждом уроке
+    'batch_size': 10000,        # строк в одном executemany при загрузке
+    'iterations': 50            # сколько раз --benchmark выполняет каждый запрос
+}
+
+
+class StartupTimer:
+    """Замеры запуска по фазам: с --startup-timing печатает, куда уходят миллисекунды.
+    
+    Время отсчитывается от первой строки модуля; фазы из фоновых потоков идут
+    вперемешку с фазами потока Tk, поэтому у каждой записан поток.
+    """
+    
+    enabled = "--startup-timing" in sys.argv or os.environ.get('SCHOOL_STARTUP_TIMING') == '1'
+    _phases = []   # (начало, длительность, поток, название), секунды от STARTUP_STARTED
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def record(name, started, finished=None):
+        finished = time.perf_counter() if finished is None else finished
+        with StartupTimer._lock:
+            StartupTimer._phases.append((started - STARTUP_STARTED, finished - started,
+                                         threading.current_thread().name, name))
+    
+    @staticmethod
+    @contextmanager
+    def phase(name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            StartupTimer.record(name, started)
+    
+    @staticmethod
+    def mark(name):
+        """Момент без длительности, например первая отрисовка окна"""
+        StartupTimer.record(name, time.perf_counter())
+    
+    @staticmethod
+    def report():
+        if not StartupTimer.enabled:
+            return
+        with StartupTimer._lock:
+            phases = sorted(StartupTimer._phases)
+        print(f"{'начало, мс':>11} {'длит., мс':>10}  {'поток':<12} фаза")
+        for started, duration, thread, name in phases:
+            print(f"{started * 1000:>11.1f} {duration * 1000:>10.1f}  {thread:<12} {name}")
+
+
+StartupTimer.record("Импорт модулей", STARTUP_STARTED)
+
 # Настройка темы
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
@@ -40,51 +175,1899 @@ COLORS = {
     'text_dark': '#1a202c'
 }
 
-# Стили для виджетов
-FONTS = {
-    'title': ("Segoe UI", 28, "bold"),
-    'subtitle': ("Segoe UI", 18, "bold"),
-    'heading': ("Segoe UI", 14, "bold"),
-    'body': ("Segoe UI", 12),
-    'small': ("Segoe UI", 10),
-    'button': ("Segoe UI", 12, "bold")
-}
+# Стили для виджетов
+FONTS = {
+    'title': ("Segoe UI", 28, "bold"),
+    'subtitle': ("Segoe UI", 18, "bold"),
+    'heading': ("Segoe UI", 14, "bold"),
+    'body': ("Segoe UI", 12),
+    'small': ("Segoe UI", 10),
+    'button': ("Segoe UI", 12, "bold")
+}
+
+class PasswordHasher:
+    """Солёные хэши паролей в виде строк 'алгоритм$параметры$соль$хэш'.
+    
+    Строки без известного префикса - старые пароли открытым текстом; они ещё
+    принимаются при входе и сразу перехэшируются (needs_rehash).
+    """
+    
+    @staticmethod
+    def algorithm():
+        if PASSWORD_CONFIG['algorithm'] == 'scrypt' and hasattr(hashlib, 'scrypt'):
+            return 'scrypt'
+        return 'pbkdf2_sha256'
+    
+    @staticmethod
+    def params():
+        if PasswordHasher.algorithm() == 'scrypt':
+            return (PASSWORD_CONFIG['scrypt_n'], PASSWORD_CONFIG['scrypt_r'], PASSWORD_CONFIG['scrypt_p'])
+        return (PASSWORD_CONFIG['pbkdf2_iterations'],)
+    
+    @staticmethod
+    def hash(password):
+        algorithm, params = PasswordHasher.algorithm(), PasswordHasher.params()
+        salt = os.urandom(PASSWORD_CONFIG['salt_bytes'])
+        return PasswordHasher._format(algorithm, params, salt, PasswordHasher._derive(algorithm, params, password, salt))
+    
+    @staticmethod
+    def verify(password, stored):
+        parsed = PasswordHasher._parse(stored)
+        if parsed is None:
+            return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        algorithm, params, salt, expected = parsed
+        return hmac.compare_digest(PasswordHasher._derive(algorithm, params, password, salt), expected)
+    
+    @staticmethod
+    def needs_rehash(stored):
+        """Пароль открытым текстом или хэш с другими параметрами, чем в PASSWORD_CONFIG"""
+        parsed = PasswordHasher._parse(stored)
+        if parsed is None:
+            return True
+        algorithm, params, _, _ = parsed
+        return (algorithm, params) != (PasswordHasher.algorithm(), PasswordHasher.params())
+    
+    @staticmethod
+    def calibrate(target_ms):
+        """Подбирает стоимость текущего алгоритма под время проверки target_ms на этой машине.
+        
+        Возвращает (имя параметра, значение, измеренное время в мс).
+        """
+        def measure(algorithm, params):
+            started = time.perf_counter()
+            PasswordHasher._derive(algorithm, params, 'calibration', b'0' * PASSWORD_CONFIG['salt_bytes'])
+            return (time.perf_counter() - started) * 1000
+        
+        if PasswordHasher.algorithm() == 'scrypt':
+            # Стоимость scrypt растёт вдвое с каждым шагом N; берём шаг, ближайший к цели
+            r, p = PASSWORD_CONFIG['scrypt_r'], PASSWORD_CONFIG['scrypt_p']
+            best = None
+            n = 2 ** 10
+            while n <= 2 ** 20:
+                elapsed = measure('scrypt', (n, r, p))
+                if best is None or abs(elapsed - target_ms) < abs(best[1] - target_ms):
+                    best = (n, elapsed)
+                if elapsed > target_ms:
+                    break
+                n *= 2
+            return 'scrypt_n', best[0], best[1]
+        
+        sample = 20000
+        iterations = max(1000, int(round(sample * target_ms / measure('pbkdf2_sha256', (sample,)), -3)))
+        return 'pbkdf2_iterations', iterations, measure('pbkdf2_sha256', (iterations,))
+    
+    @staticmethod
+    def _derive(algorithm, params, password, salt):
+        if algorithm == 'scrypt':
+            n, r, p = params
+            return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                                  maxmem=256 * n * r + 1024 * 1024, dklen=32)
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, params[0])
+    
+    @staticmethod
+    def _format(algorithm, params, salt, digest):
+        encode = lambda data: base64.b64encode(data).decode('ascii')
+        return '$'.join([algorithm, *map(str, params), encode(salt), encode(digest)])
+    
+    @staticmethod
+    def _parse(stored):
+        parts = stored.split('$')
+        param_count = {'scrypt': 3, 'pbkdf2_sha256': 1}.get(parts[0])
+        if param_count is None or len(parts) != param_count + 3:
+            return None
+        try:
+            params = tuple(int(value) for value in parts[1:1 + param_count])
+            return parts[0], params, base64.b64decode(parts[-2]), base64.b64decode(parts[-1])
+        except ValueError:
+            return None
+
+
+class PoolTimeoutError(Exception):
+    """Все соединения пула заняты и ни одно не освободилось вовремя"""
+
+
+class DatabaseUnavailableError(Exception):
+    """Не удалось получить соединение с базой (в отличие от ошибки в самом запросе)"""
+
+
+class SchemaOutdatedError(Exception):
+    """Схема базы старее, чем нужно программе: не применены миграции (--migrate)"""
+
+
+class ScheduleConflictError(Exception):
+    """Урок попадает на время, когда учитель, класс или кабинет уже заняты"""
+
+
+# Правила приведения запроса к отпечатку: (шаблон, замена), применяются по порядку.
+# Запросы, отличающиеся только литералами и длиной списков параметров, попадают в одну строку статистики
+QUERY_FINGERPRINT_RULES = [
+    (re.compile(r"--[^\n]*"), ""),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),
+    (re.compile(r"(\(\?, \.\.\.\))(?:\s*,\s*\(\?, \.\.\.\))+"), r"\1, ..."),
+]
+
+
+class QueryStats:
+    """Статистика запросов к базе по отпечаткам, общая для всей программы.
+    
+    Для каждого отпечатка хранится число вызовов, суммарное время выполнения и чтения,
+    число строк и гистограмма длительностей с границами BUCKETS_MS. Запросы дольше
+    slow_query_ms дописываются в журнал медленных запросов.
+    """
+    
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+    
+    _entries = {}   # отпечаток -> словарь счётчиков
+    _lock = threading.Lock()
+    _log_lock = threading.Lock()
+    
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def fingerprint(sql):
+        for pattern, replacement in QUERY_FINGERPRINT_RULES:
+            sql = pattern.sub(replacement, sql)
+        return sql.strip()
+    
+    @staticmethod
+    def record(sql, param_count, execute_time, fetch_time, rows, error=None):
+        """Учитывает один запрос; время в секундах"""
+        fingerprint = QueryStats.fingerprint(sql)
+        total_ms = (execute_time + fetch_time) * 1000
+        bucket = next(i for i, bound in enumerate(QueryStats.BUCKETS_MS) if total_ms <= bound)
+        
+        with QueryStats._lock:
+            entry = QueryStats._entries.get(fingerprint)
+            if entry is None:
+                entry = QueryStats._entries[fingerprint] = {
+                    'fingerprint': fingerprint,
+                    'calls': 0,
+                    'errors': 0,
+                    'execute_ms': 0.0,
+                    'fetch_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'params': 0,
+                    'histogram': [0] * len(QueryStats.BUCKETS_MS)
+                }
+            entry['calls'] += 1
+            entry['errors'] += error is not None
+            entry['execute_ms'] += execute_time * 1000
+            entry['fetch_ms'] += fetch_time * 1000
+            entry['max_ms'] = max(entry['max_ms'], total_ms)
+            entry['rows'] += rows
+            entry['params'] = param_count
+            entry['histogram'][bucket] += 1
+        
+        if total_ms >= QUERY_STATS_CONFIG['slow_query_ms']:
+            QueryStats.log_slow(fingerprint, param_count, execute_time, fetch_time, rows, error)
+    
+    @staticmethod
+    def log_slow(fingerprint, param_count, execute_time, fetch_time, rows, error):
+        line = (f"{datetime.now().isoformat(timespec='seconds')}\t"
+                f"{(execute_time + fetch_time) * 1000:.1f} ms\t"
+                f"execute={execute_time * 1000:.1f} fetch={fetch_time * 1000:.1f} "
+                f"rows={rows} params={param_count}"
+                f"{' error=' + type(error).__name__ if error is not None else ''}\t"
+                f"{fingerprint}\n")
+        try:
+            with QueryStats._log_lock, open(QUERY_STATS_CONFIG['slow_log'], 'a', encoding='utf-8') as log:
+                log.write(line)
+        except OSError:
+            pass   # журнал - вспомогательный; недоступный файл не должен ломать запрос
+    
+    @staticmethod
+    def percentile(histogram, fraction):
+        """Верхняя граница корзины, в которую попадает заданная доля вызовов"""
+        threshold = sum(histogram) * fraction
+        seen = 0
+        for bound, count in zip(QueryStats.BUCKETS_MS, histogram):
+            seen += count
+            if count and seen >= threshold:
+                return bound
+        return 0
+    
+    @staticmethod
+    def snapshot():
+        """Копия счётчиков по всем отпечаткам"""
+        with QueryStats._lock:
+            return [dict(entry, histogram=list(entry['histogram'])) for entry in QueryStats._entries.values()]
+    
+    @staticmethod
+    def top(limit=None):
+        """Отпечатки с наибольшим суммарным временем - самые затратные запросы"""
+        entries = sorted(QueryStats.snapshot(), key=lambda e: e['execute_ms'] + e['fetch_ms'], reverse=True)
+        return entries[:limit or QUERY_STATS_CONFIG['top']]
+    
+    @staticmethod
+    def reset():
+        with QueryStats._lock:
+            QueryStats._entries.clear()
+
+
+class Cursor:
+    """Курсор, который переводит запросы на диалект текущей базы перед выполнением.
+    
+    Если включена QueryStats, замеряет выполнение и чтение результатов; чтение
+    относится к последнему выполненному запросу и учитывается при следующем
+    execute() или закрытии курсора.
+    """
+    
+    def __init__(self, raw, translate):
+        self._raw = raw
+        self._translate = translate
+        self._query = None   # [sql, число параметров, время выполнения, время чтения, строк]
+    
+    @staticmethod
+    def _param_count(params):
+        # pyodbc принимает и execute(sql, (a, b)), и execute(sql, a, b)
+        if len(params) == 1 and isinstance(params[0], (tuple, list)):
+            return len(params[0])
+        return len(params)
+    
+    def _measure(self, sql, param_count, call):
+        self._finish_query()
+        if not QUERY_STATS_CONFIG['enabled']:
+            call()
+            return
+        
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception as e:
+            QueryStats.record(sql, param_count, time.perf_counter() - started, 0.0, 0, e)
+            raise
+        self._query = [sql, param_count, time.perf_counter() - started, 0.0, 0]
+    
+    def _fetched(self, started, rows):
+        if self._query is not None:
+            self._query[3] += time.perf_counter() - started
+            self._query[4] += rows
+    
+    def _finish_query(self):
+        if self._query is not None:
+            query, self._query = self._query, None
+            QueryStats.record(*query)
+    
+    def execute(self, sql, *params):
+        self._measure(sql, self._param_count(params), lambda: self._raw.execute(self._translate(sql), *params))
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        param_count = sum(len(params) for params in seq_of_params)
+        self._measure(sql, param_count, lambda: self._raw.executemany(self._translate(sql), seq_of_params))
+        return self
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._raw.fetchone()
+        self._fetched(started, row is not None)
+        return row
+    
+    def fetchmany(self, *size):
+        started = time.perf_counter()
+        rows = self._raw.fetchmany(*size)
+        self._fetched(started, len(rows))
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._raw.fetchall()
+        self._fetched(started, len(rows))
+        return rows
+    
+    def nextset(self):
+        # Следующие наборы пакетного запроса считаются чтением того же запроса
+        started = time.perf_counter()
+        result = self._raw.nextset()
+        self._fetched(started, 0)
+        return result
+    
+    def close(self):
+        self._finish_query()
+        self._raw.close()
+    
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+    
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+    
+    def __setattr__(self, name, value):
+        # Настройки вроде fast_executemany должны попасть в настоящий курсор
+        if name.startswith('_'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self._raw, name, value)
+
+
+class PooledConnection:
+    """Соединение, взятое из пула. close() возвращает его в пул, а не закрывает"""
+    
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._cursors = []
+    
+    def cursor(self):
+        cursor = Cursor(self._raw.cursor(), self._pool.translate)
+        self._cursors.append(cursor)
+        return cursor
+    
+    def commit(self):
+        self._raw.commit()
+    
+    def rollback(self):
+        self._raw.rollback()
+    
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        
+        # Незакрытые курсоры с непрочитанными результатами мешают следующему владельцу
+        for cursor in self._cursors:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._cursors = []
+        self._pool.release(raw)
+    
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._raw is not None:
+            try:
+                self._raw.rollback()
+            except Exception:
+                pass
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений: переиспользует открытые соединения вместо нового подключения"""
+    
+    def __init__(self, connect, translate=None, max_size=8, idle_timeout=300, checkout_timeout=10,
+                 health_check_after=30):
+        self._connect = connect
+        self.translate = translate or (lambda sql: sql)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        
+        self._idle = []  # стек (соединение, время возврата): последнее вернувшееся выдаётся первым
+        self._size = 0   # всего открыто соединений: свободные + выданные
+        self._closed = False
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        
+        while True:
+            raw, last_used, expired = self._checkout(deadline)
+            self._close_quietly(expired)
+            
+            if raw is None:
+                # Свободных нет, но лимит позволяет открыть новое соединение
+                try:
+                    raw = self._connect()
+                except Exception:
+                    self._forget(1)
+                    raise
+                return PooledConnection(self, raw)
+            
+            idle_for = time.monotonic() - last_used
+            if idle_for < self.health_check_after or self._is_alive(raw):
+                return PooledConnection(self, raw)
+            
+            # Соединение умерло, пока лежало в пуле - выбрасываем и пробуем снова
+            self._close_quietly([raw])
+            self._forget(1)
+    
+    def _checkout(self, deadline):
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Пул соединений закрыт")
+                
+                expired = self._evict_idle()
+                if self._idle:
+                    raw, last_used = self._idle.pop()
+                    return raw, last_used, expired
+                
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None, expired
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений: все {self.max_size} заняты дольше {self.checkout_timeout} с")
+                self._condition.wait(remaining)
+    
+    def _evict_idle(self):
+        """Убирает из пула соединения, простоявшие дольше idle_timeout (вызывать под блокировкой)"""
+        now = time.monotonic()
+        alive = [(raw, used) for raw, used in self._idle if now - used < self.idle_timeout]
+        expired = [raw for raw, used in self._idle if now - used >= self.idle_timeout]
+        self._idle = alive
+        self._size -= len(expired)
+        return expired
+    
+    def release(self, raw):
+        # Отменяем то, что владелец начал, но не закоммитил
+        try:
+            raw.rollback()
+        except Exception:
+            self._close_quietly([raw])
+            self._forget(1)
+            return
+        
+        with self._condition:
+            if not self._closed:
+                self._idle.append((raw, time.monotonic()))
+                self._condition.notify()
+                return
+        
+        self._close_quietly([raw])
+        self._forget(1)
+    
+    def close_all(self):
+        with self._condition:
+            self._closed = True
+            idle = [raw for raw, _ in self._idle]
+            self._idle = []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        self._close_quietly(idle)
+    
+    def _forget(self, count):
+        with self._condition:
+            self._size -= count
+            self._condition.notify()
+    
+    @staticmethod
+    def _is_alive(raw):
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+    
+    @staticmethod
+    def _close_quietly(connections):
+        for raw in connections:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+
+class DatabaseBackend:
+    """Общий интерфейс СУБД: подключение, перевод диалекта SQL и создание схемы"""
+    
+    name = None
+    auto_bootstrap = False   # применять миграции автоматически при первом подключении
+    connection_hint = ""
+    SCHEMA = []
+    SCHEMA_VERSION_TABLE = ""
+    SUMMARY_SCHEMA = []
+    
+    # Пересчёт сводных таблиц по исходным данным: заполняет их при миграции и чинит расхождения
+    SUMMARY_REBUILD = [
+        "DELETE FROM student_subject_summary",
+        """
+        INSERT INTO student_subject_summary (student_id, subject_id, grade_count, grade_sum, last_grade_date)
+        SELECT student_id, subject_id, COUNT(*), SUM(grade), MAX(grade_date)
+        FROM grades
+        GROUP BY student_id, subject_id
+        """,
+        "DELETE FROM class_subject_summary",
+        """
+        INSERT INTO class_subject_summary (class_id, subject_id, grade_count, grade_sum, last_grade_date)
+        SELECT u.class_id, g.subject_id, COUNT(*), SUM(g.grade), MAX(g.grade_date)
+        FROM grades g
+        JOIN users u ON g.student_id = u.user_id
+        WHERE u.class_id IS NOT NULL
+        GROUP BY u.class_id, g.subject_id
+        """,
+        "DELETE FROM student_attendance_summary",
+        """
+        INSERT INTO student_attendance_summary (student_id, present_count, total_count, last_attendance_date)
+        SELECT student_id, SUM(CASE WHEN status = 'присутствовал' THEN 1 ELSE 0 END), COUNT(*), MAX(attendance_date)
+        FROM attendance
+        GROUP BY student_id
+        """,
+        "DELETE FROM class_attendance_summary",
+        """
+        INSERT INTO class_attendance_summary (class_id, present_count, total_count, last_attendance_date)
+        SELECT class_id, SUM(CASE WHEN status = 'присутствовал' THEN 1 ELSE 0 END), COUNT(*), MAX(attendance_date)
+        FROM attendance
+        GROUP BY class_id
+        """
+    ]
+    
+    # Индексы под постраничный список и поиск в админке: (имя, таблица и столбцы)
+    INDEXES = [
+        ('ix_users_role_name', 'users (role, full_name, user_id)'),
+        ('ix_users_blocked', 'users (is_blocked, role, full_name, user_id)'),
+        ('ix_users_full_name', 'users (full_name)'),
+        ('ix_users_class', 'users (class_id, role)'),
+        ('ix_classes_name', 'classes (class_name)'),
+        ('ix_classes_teacher', 'classes (class_teacher_id)'),
+        ('ix_subjects_name', 'subjects (subject_name)'),
+        ('ix_schedule_class', 'schedule (class_id)'),
+        ('ix_schedule_teacher', 'schedule (teacher_id)'),
+        # Вход в систему читает пользователя целиком из индекса, не обращаясь к таблице
+        ('ix_users_login', 'users (username) INCLUDE (password, full_name, role, class_id, is_blocked, failed_attempts)')
+    ]
+    
+    # Покрывающие индексы под основные запросы окон ученика, учителя и администратора
+    HOT_PATH_INDEXES = [
+        # Оценки ученика по дате и его статистика читаются из индекса целиком
+        ('ix_grades_student_date',
+         'grades (student_id, grade_date DESC) INCLUDE (subject_id, teacher_id, grade, lesson_type, comment)'),
+        # Посещаемость ученика; тот же ключ ищет запись при сохранении отметок за день
+        ('ix_attendance_student_date', 'attendance (student_id, attendance_date DESC) INCLUDE (status, reason)'),
+        ('ix_attendance_date', 'attendance (attendance_date) INCLUDE (status)'),
+        ('ix_homework_class_due', 'homework (class_id, due_date) INCLUDE (homework_date, subject_id, teacher_id)'),
+        ('ix_homework_due', 'homework (due_date)'),
+        # Расписание класса и учителя по урокам; заменяют одностолбцовые индексы версии 2
+        ('ix_schedule_class_slot', 'schedule (class_id, day_of_week, lesson_number) INCLUDE (subject_id, teacher_id, room)'),
+        ('ix_schedule_teacher_slot', 'schedule (teacher_id, day_of_week, lesson_number) INCLUDE (class_id, subject_id, room)'),
+        ('ix_users_class_name', 'users (class_id, role, full_name, user_id)')
+    ]
+    
+    # Один урок в одно время у учителя, у класса и в кабинете; урок без кабинета кабинет не занимает
+    SCHEDULE_SLOT_INDEXES = [
+        ('ux_schedule_teacher_slot', 'schedule (teacher_id, day_of_week, lesson_number)'),
+        ('ux_schedule_class_slot', 'schedule (class_id, day_of_week, lesson_number)'),
+        ('ux_schedule_room_slot', 'schedule (room, day_of_week, lesson_number) WHERE room IS NOT NULL')
+    ]
+    
+    def migrations(self):
+        """Версии схемы по порядку: (номер, описание, операции).
+        
+        Операция - текст SQL этой СУБД, ('index', имя, определение),
+        ('unique_index', имя, определение) или ('drop_index', имя, таблица). Все операции повторяемы: база, созданная
+        до появления миграций, проходит их без ошибок.
+        """
+        return [
+            (1, "Таблицы школы", list(self.SCHEMA)),
+            (2, "Индексы списков и поиска в админке", [('index', name, definition) for name, definition in self.INDEXES]),
+            (3, "Индексы основных запросов окон", [('index', name, definition) for name, definition in self.HOT_PATH_INDEXES] + [
+                ('drop_index', 'ix_schedule_class', 'schedule'),
+                ('drop_index', 'ix_schedule_teacher', 'schedule'),
+                ('drop_index', 'ix_users_class', 'users')
+            ]),
+            # Статистика окон читает счётчики из сводных таблиц; средний балл по школе не сканирует оценки
+            (4, "Сводные таблицы оценок и посещаемости", list(self.SUMMARY_SCHEMA) + list(self.SUMMARY_REBUILD)),
+            # База не даст занять учителя, класс или кабинет дважды на одном уроке.
+            # Если такие уроки уже есть, миграция остановится на индексе - их нужно развести вручную
+            (5, "Уникальность уроков учителя, класса и кабинета",
+             # Кабинеты приводятся к виду ScheduleOccupancy.room(), в котором их записывает программа
+             ["UPDATE schedule SET room = NULLIF(UPPER(LTRIM(RTRIM(room))), '') WHERE room IS NOT NULL"] +
+             [('unique_index', name, definition) for name, definition in self.SCHEDULE_SLOT_INDEXES])
+        ]
+    
+    def connect(self):
+        raise NotImplementedError
+    
+    @property
+    def error_types(self):
+        return (Exception,)
+    
+    def translate(self, sql):
+        """Переводит запрос, написанный на T-SQL, на диалект этой СУБД"""
+        return sql
+    
+    def create_index_sql(self, name, definition, unique=False):
+        return f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {definition}"
+    
+    def drop_index_sql(self, name, table):
+        return f"DROP INDEX IF EXISTS {name}"
+    
+    def migration_sql(self, operation):
+        if isinstance(operation, str):
+            return operation
+        kind, name, target = operation
+        if kind in ('index', 'unique_index'):
+            return self.create_index_sql(name, target, unique=kind == 'unique_index')
+        return self.drop_index_sql(name, target)
+    
+    def schema_version(self, connection):
+        """Применённые версии схемы"""
+        cursor = connection.cursor()
+        cursor.execute(self.SCHEMA_VERSION_TABLE)
+        connection.commit()
+        cursor.execute("SELECT version FROM schema_version")
+        return {row[0] for row in cursor.fetchall()}
+    
+    def migrate(self, connection):
+        """Применяет недостающие версии схемы по порядку; возвращает [(номер, описание), ...] применённых.
+        
+        Каждая версия фиксируется отдельно вместе с записью в schema_version,
+        поэтому прерванная миграция продолжится с той же версии.
+        """
+        applied = self.schema_version(connection)
+        cursor = connection.cursor()
+        done = []
+        for version, description, operations in self.migrations():
+            if version in applied:
+                continue
+            for operation in operations:
+                cursor.execute(self.migration_sql(operation))
+            cursor.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now())
+            )
+            connection.commit()
+            done.append((version, description))
+        return done
+    
+    def index_used(self, cursor, index_name, sql, params):
+        """Использует ли запрос индекс index_name"""
+        raise NotImplementedError
+    
+    def fetch_result_sets(self, cursor, statements):
+        """Выполняет несколько SELECT [(sql, params), ...] и возвращает их результаты списками словарей.
+        
+        Встроенная СУБД работает в том же процессе, поэтому запросы просто идут по очереди.
+        """
+        result_sets = []
+        for sql, params in statements:
+            cursor.execute(sql, params)
+            result_sets.append(Database.dict_fetchall(cursor))
+        return result_sets
+    
+    def bulk_insert(self, cursor, table, columns, rows, batch_size=10000):
+        """Вставляет строки из итератора пакетами по batch_size; возвращает их число"""
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        rows = iter(rows)
+        count = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return count
+            cursor.executemany(sql, batch)
+            count += len(batch)
+    
+    def increment_counters(self, cursor, table, keys, counters, latest, rows):
+        """Прибавляет приращения к счётчикам сводной таблицы: rows - [(ключи..., приращения..., дата), ...].
+        
+        Недостающие строки добавляются; столбец latest хранит самую позднюю из дат.
+        """
+        columns = (*keys, *counters, latest)
+        cursor.executemany(f"""
+            INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+            ON CONFLICT ({', '.join(keys)}) DO UPDATE SET
+                {', '.join(f"{column} = {column} + excluded.{column}" for column in counters)},
+                {latest} = CASE WHEN {latest} IS NULL OR excluded.{latest} > {latest}
+                                THEN excluded.{latest} ELSE {latest} END
+        """, rows)
+    
+    def record_failed_login(self, cursor, user_id):
+        """Одной командой увеличивает счётчик неудачных входов и блокирует после MAX_LOGIN_ATTEMPTS.
+        
+        Возвращает новое значение счётчика.
+        """
+        cursor.execute("""
+            UPDATE users
+            SET failed_attempts = failed_attempts + 1,
+                is_blocked = CASE WHEN failed_attempts + 1 >= ? THEN 1 ELSE is_blocked END
+            WHERE user_id = ?
+            RETURNING failed_attempts
+        """, (MAX_LOGIN_ATTEMPTS, user_id))
+        return cursor.fetchone()[0]
+    
+    def upsert_attendance(self, cursor, class_id, attendance_date, rows):
+        """Сохраняет отметки [(student_id, status, reason), ...] за день: обновляет или добавляет"""
+        cursor.executemany("""
+            UPDATE attendance
+            SET status = ?, reason = ?
+            WHERE student_id = ? AND attendance_date = ?
+        """, [(status, reason, student_id, attendance_date) for student_id, status, reason in rows])
+        
+        cursor.executemany("""
+            INSERT INTO attendance (student_id, class_id, attendance_date, status, reason)
+            SELECT ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendance WHERE student_id = ? AND attendance_date = ?
+            )
+        """, [(student_id, class_id, attendance_date, status, reason, student_id, attendance_date)
+              for student_id, status, reason in rows])
+
+
+class SqlServerBackend(DatabaseBackend):
+    name = 'sqlserver'
+    connection_hint = (
+        "1. SQL Server LocalDB установлен\n"
+        "2. База данных school_db создана\n"
+        "3. Драйвер ODBC установлен"
+    )
+    
+    SCHEMA = [
+        """
+        IF OBJECT_ID(N'dbo.users', N'U') IS NULL
+        CREATE TABLE users (
+            user_id INT IDENTITY(1,1) PRIMARY KEY,
+            username NVARCHAR(50) NOT NULL UNIQUE,
+            password NVARCHAR(255) NOT NULL,
+            full_name NVARCHAR(100) NOT NULL,
+            phone NVARCHAR(20) NULL,
+            email NVARCHAR(100) NULL,
+            role NVARCHAR(20) NOT NULL CHECK (role IN ('admin', 'teacher', 'student')),
+            class_id INT NULL,
+            is_blocked BIT NOT NULL DEFAULT 0,
+            failed_attempts INT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.classes', N'U') IS NULL
+        CREATE TABLE classes (
+            class_id INT IDENTITY(1,1) PRIMARY KEY,
+            class_name NVARCHAR(10) NOT NULL,
+            grade INT NOT NULL CHECK (grade BETWEEN 1 AND 11),
+            academic_year NVARCHAR(20) NULL,
+            class_teacher_id INT NULL REFERENCES users(user_id)
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.subjects', N'U') IS NULL
+        CREATE TABLE subjects (
+            subject_id INT IDENTITY(1,1) PRIMARY KEY,
+            subject_name NVARCHAR(100) NOT NULL,
+            description NVARCHAR(MAX) NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.schedule', N'U') IS NULL
+        CREATE TABLE schedule (
+            schedule_id INT IDENTITY(1,1) PRIMARY KEY,
+            class_id INT NOT NULL REFERENCES classes(class_id),
+            subject_id INT NOT NULL REFERENCES subjects(subject_id),
+            teacher_id INT NOT NULL REFERENCES users(user_id),
+            day_of_week NVARCHAR(20) NOT NULL,
+            lesson_number INT NOT NULL CHECK (lesson_number BETWEEN 1 AND 8),
+            room NVARCHAR(20) NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.grades', N'U') IS NULL
+        CREATE TABLE grades (
+            grade_id INT IDENTITY(1,1) PRIMARY KEY,
+            student_id INT NOT NULL REFERENCES users(user_id),
+            subject_id INT NOT NULL REFERENCES subjects(subject_id),
+            teacher_id INT NOT NULL REFERENCES users(user_id),
+            grade INT NOT NULL CHECK (grade BETWEEN 1 AND 5),
+            grade_date DATE NOT NULL,
+            lesson_type NVARCHAR(30) NULL,
+            comment NVARCHAR(500) NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.homework', N'U') IS NULL
+        CREATE TABLE homework (
+            homework_id INT IDENTITY(1,1) PRIMARY KEY,
+            teacher_id INT NOT NULL REFERENCES users(user_id),
+            class_id INT NOT NULL REFERENCES classes(class_id),
+            subject_id INT NOT NULL REFERENCES subjects(subject_id),
+            homework_date DATE NOT NULL,
+            due_date DATE NOT NULL,
+            description NVARCHAR(MAX) NOT NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.attendance', N'U') IS NULL
+        CREATE TABLE attendance (
+            attendance_id INT IDENTITY(1,1) PRIMARY KEY,
+            student_id INT NOT NULL REFERENCES users(user_id),
+            class_id INT NOT NULL REFERENCES classes(class_id),
+            attendance_date DATE NOT NULL,
+            status NVARCHAR(30) NOT NULL,
+            reason NVARCHAR(200) NULL
+        )
+        """
+    ]
+    
+    SUMMARY_SCHEMA = [
+        """
+        IF OBJECT_ID(N'dbo.student_subject_summary', N'U') IS NULL
+        CREATE TABLE student_subject_summary (
+            student_id INT NOT NULL,
+            subject_id INT NOT NULL,
+            grade_count INT NOT NULL,
+            grade_sum INT NOT NULL,
+            last_grade_date DATE NULL,
+            PRIMARY KEY (student_id, subject_id)
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.class_subject_summary', N'U') IS NULL
+        CREATE TABLE class_subject_summary (
+            class_id INT NOT NULL,
+            subject_id INT NOT NULL,
+            grade_count INT NOT NULL,
+            grade_sum INT NOT NULL,
+            last_grade_date DATE NULL,
+            PRIMARY KEY (class_id, subject_id)
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.student_attendance_summary', N'U') IS NULL
+        CREATE TABLE student_attendance_summary (
+            student_id INT PRIMARY KEY,
+            present_count INT NOT NULL,
+            total_count INT NOT NULL,
+            last_attendance_date DATE NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.class_attendance_summary', N'U') IS NULL
+        CREATE TABLE class_attendance_summary (
+            class_id INT PRIMARY KEY,
+            present_count INT NOT NULL,
+            total_count INT NOT NULL,
+            last_attendance_date DATE NULL
+        )
+        """
+    ]
+    
+    SCHEMA_VERSION_TABLE = """
+        IF OBJECT_ID(N'dbo.schema_version', N'U') IS NULL
+        CREATE TABLE schema_version (
+            version INT PRIMARY KEY,
+            description NVARCHAR(200) NOT NULL,
+            applied_at DATETIME2 NOT NULL
+        )
+    """
+    
+    def create_index_sql(self, name, definition, unique=False):
+        return (f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}') "
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {definition}")
+    
+    def drop_index_sql(self, name, table):
+        return f"IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}') DROP INDEX {name} ON {table}"
+    
+    def index_used(self, cursor, index_name, sql, params):
+        # План с параметрами не всегда совпадает с реальным, поэтому запрос выполняется
+        # и проверяется, выросла ли статистика обращений к индексу
+        usage_sql = """
+            SELECT COALESCE(SUM(s.user_seeks + s.user_scans + s.user_lookups), 0)
+            FROM sys.indexes i
+            LEFT JOIN sys.dm_db_index_usage_stats s
+                ON s.object_id = i.object_id AND s.index_id = i.index_id AND s.database_id = DB_ID()
+            WHERE i.name = ?
+        """
+        before = cursor.execute(usage_sql, (index_name,)).fetchone()[0]
+        cursor.execute(sql, params).fetchall()
+        after = cursor.execute(usage_sql, (index_name,)).fetchone()[0]
+        return after > before
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def driver():
+        """Модуль pyodbc или None. Импорт поднимает менеджер драйверов ODBC, поэтому
+        выполняется при первом подключении (обычно в фоновом прогреве), а не при запуске"""
+        try:
+            import pyodbc
+        except ImportError:
+            return None
+        return pyodbc
+    
+    def connect(self):
+        pyodbc = self.driver()
+        if pyodbc is None:
+            raise RuntimeError("Модуль pyodbc не установлен: pip install pyodbc")
+        return pyodbc.connect(
+            f"DRIVER={DB_CONFIG['driver']};"
+            f"SERVER={DB_CONFIG['server']};"
+            f"DATABASE={DB_CONFIG['database']};"
+            f"Trusted_Connection={DB_CONFIG['trusted_connection']};"
+        )
+    
+    @property
+    def error_types(self):
+        pyodbc = self.driver()
+        return (pyodbc.Error, RuntimeError) if pyodbc is not None else (RuntimeError,)
+    
+    def fetch_result_sets(self, cursor, statements):
+        """Отправляет все SELECT одним пакетом и читает результаты через nextset(): один сетевой обмен"""
+        batch = "SET NOCOUNT ON;\n" + ";\n".join(sql for sql, _ in statements)
+        params = tuple(value for _, statement_params in statements for value in statement_params)
+        cursor.execute(batch, params)
+        
+        result_sets = [Database.dict_fetchall(cursor)]
+        while len(result_sets) < len(statements) and cursor.nextset():
+            result_sets.append(Database.dict_fetchall(cursor))
+        return result_sets
+    
+    def record_failed_login(self, cursor, user_id):
+        cursor.execute("""
+            SET NOCOUNT ON;
+            UPDATE users
+            SET failed_attempts = failed_attempts + 1,
+                is_blocked = CASE WHEN failed_attempts + 1 >= ? THEN 1 ELSE is_blocked END
+            OUTPUT inserted.failed_attempts
+            WHERE user_id = ?
+        """, (MAX_LOGIN_ATTEMPTS, user_id))
+        return cursor.fetchone()[0]
+    
+    def bulk_insert(self, cursor, table, columns, rows, batch_size=10000):
+        # Без fast_executemany pyodbc отправляет каждую строку отдельным обменом с сервером
+        cursor.fast_executemany = True
+        return super().bulk_insert(cursor, table, columns, rows, batch_size)
+    
+    def increment_counters(self, cursor, table, keys, counters, latest, rows):
+        columns = (*keys, *counters, latest)
+        cursor.executemany(f"""
+            MERGE {table} WITH (HOLDLOCK) AS target
+            USING (VALUES ({', '.join('?' * len(columns))})) AS source ({', '.join(columns)})
+            ON {' AND '.join(f"target.{column} = source.{column}" for column in keys)}
+            WHEN MATCHED THEN UPDATE SET
+                {', '.join(f"{column} = target.{column} + source.{column}" for column in counters)},
+                {latest} = CASE WHEN target.{latest} IS NULL OR source.{latest} > target.{latest}
+                                THEN source.{latest} ELSE target.{latest} END
+            WHEN NOT MATCHED THEN
+                INSERT ({', '.join(columns)}) VALUES ({', '.join(f"source.{column}" for column in columns)});
+        """, rows)
+    
+    def upsert_attendance(self, cursor, class_id, attendance_date, rows):
+        """Три обмена с сервером на любой размер класса: временная таблица, пакетная вставка, MERGE"""
+        cursor.execute("""
+            IF OBJECT_ID('tempdb..#attendance_stage') IS NOT NULL DROP TABLE #attendance_stage;
+            CREATE TABLE #attendance_stage (
+                student_id INT PRIMARY KEY,
+                status NVARCHAR(30) NOT NULL,
+                reason NVARCHAR(200) NULL
+            )
+        """)
+        
+        cursor.fast_executemany = True
+        cursor.executemany(
+            "INSERT INTO #attendance_stage (student_id, status, reason) VALUES (?, ?, ?)",
+            rows
+        )
+        
+        cursor.execute("""
+            SET NOCOUNT ON;
+            MERGE attendance WITH (HOLDLOCK) AS target
+            USING #attendance_stage AS source
+            ON target.student_id = source.student_id AND target.attendance_date = ?
+            WHEN MATCHED THEN
+                UPDATE SET status = source.status, reason = source.reason
+            WHEN NOT MATCHED THEN
+                INSERT (student_id, class_id, attendance_date, status, reason)
+                VALUES (source.student_id, ?, ?, source.status, source.reason);
+            DROP TABLE #attendance_stage;
+        """, (attendance_date, class_id, attendance_date))
+
+
+# Правила перевода T-SQL в SQLite: (шаблон, замена), применяются по порядку
+SQLITE_DIALECT_RULES = [
+    (re.compile(r"DATEADD\(\s*DAY\s*,\s*(-?\d+)\s*,\s*GETDATE\(\)\s*\)", re.IGNORECASE),
+     r"datetime('now', 'localtime', '\1 days')"),
+    (re.compile(r"GETDATE\(\)", re.IGNORECASE), "datetime('now', 'localtime')"),
+    (re.compile(r"\bAS\s+FLOAT\)", re.IGNORECASE), "AS REAL)"),
+    (re.compile(r"OFFSET\s+0\s+ROWS\s+FETCH\s+NEXT\s+(\?|\d+)\s+ROWS\s+ONLY", re.IGNORECASE), r"LIMIT \1"),
+]
+
+
+class SqliteBackend(DatabaseBackend):
+    """Замена SQL Server для профилирования и тестов: те же запросы, файл на диске"""
+    
+    name = 'sqlite'
+    auto_bootstrap = True
+    connection_hint = "1. Путь SCHOOL_DB_PATH доступен для записи"
+    
+    # Имена сравниваются без учёта регистра, как в SQL Server. NOCASE знает регистр только
+    # латиницы, поэтому поиск LIKE заменён функцией like() ниже, понимающей и кириллицу
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            password TEXT NOT NULL,
+            full_name TEXT NOT NULL COLLATE NOCASE,
+            phone TEXT NULL,
+            email TEXT NULL,
+            role TEXT NOT NULL CHECK (role IN ('admin', 'teacher', 'student')),
+            class_id INTEGER NULL REFERENCES classes(class_id),
+            is_blocked INTEGER NOT NULL DEFAULT 0,
+            failed_attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS classes (
+            class_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            class_name TEXT NOT NULL COLLATE NOCASE,
+            grade INTEGER NOT NULL CHECK (grade BETWEEN 1 AND 11),
+            academic_year TEXT NULL,
+            class_teacher_id INTEGER NULL REFERENCES users(user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS subjects (
+            subject_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject_name TEXT NOT NULL COLLATE NOCASE,
+            description TEXT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS schedule (
+            schedule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            class_id INTEGER NOT NULL REFERENCES classes(class_id),
+            subject_id INTEGER NOT NULL REFERENCES subjects(subject_id),
+            teacher_id INTEGER NOT NULL REFERENCES users(user_id),
+            day_of_week TEXT NOT NULL,
+            lesson_number INTEGER NOT NULL CHECK (lesson_number BETWEEN 1 AND 8),
+            room TEXT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS grades (
+            grade_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES users(user_id),
+            subject_id INTEGER NOT NULL REFERENCES subjects(subject_id),
+            teacher_id INTEGER NOT NULL REFERENCES users(user_id),
+            grade INTEGER NOT NULL CHECK (grade BETWEEN 1 AND 5),
+            grade_date DATE NOT NULL,
+            lesson_type TEXT NULL,
+            comment TEXT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS homework (
+            homework_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            teacher_id INTEGER NOT NULL REFERENCES users(user_id),
+            class_id INTEGER NOT NULL REFERENCES classes(class_id),
+            subject_id INTEGER NOT NULL REFERENCES subjects(subject_id),
+            homework_date DATE NOT NULL,
+            due_date DATE NOT NULL,
+            description TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS attendance (
+            attendance_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES users(user_id),
+            class_id INTEGER NOT NULL REFERENCES classes(class_id),
+            attendance_date DATE NOT NULL,
+            status TEXT NOT NULL,
+            reason TEXT NULL
+        )
+        """
+    ]
+    
+    SUMMARY_SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS student_subject_summary (
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            grade_count INTEGER NOT NULL,
+            grade_sum INTEGER NOT NULL,
+            last_grade_date DATE NULL,
+            PRIMARY KEY (student_id, subject_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS class_subject_summary (
+            class_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            grade_count INTEGER NOT NULL,
+            grade_sum INTEGER NOT NULL,
+            last_grade_date DATE NULL,
+            PRIMARY KEY (class_id, subject_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS student_attendance_summary (
+            student_id INTEGER PRIMARY KEY,
+            present_count INTEGER NOT NULL,
+            total_count INTEGER NOT NULL,
+            last_attendance_date DATE NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS class_attendance_summary (
+            class_id INTEGER PRIMARY KEY,
+            present_count INTEGER NOT NULL,
+            total_count INTEGER NOT NULL,
+            last_attendance_date DATE NULL
+        )
+        """
+    ]
+    
+    SCHEMA_VERSION_TABLE = """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+    """
+    
+    def create_index_sql(self, name, definition, unique=False):
+        # В SQLite нет INCLUDE: включённые столбцы становятся хвостом ключа, и индекс так же покрывает запрос
+        definition = re.sub(r"\)\s*INCLUDE\s*\((.*)\)$", r", \1)", definition)
+        return super().create_index_sql(name, definition, unique)
+    
+    def index_used(self, cursor, index_name, sql, params):
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return any(re.search(rf"\bINDEX {index_name}\b", row[-1]) for row in cursor.fetchall())
+    
+    def connect(self):
+        connection = sqlite3.connect(
+            DB_CONFIG['sqlite_path'],
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,  # пул передаёт соединения между потоками по одному
+            timeout=10
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        # Встроенный LIKE не считает "и" и "И" одной буквой; поиск по ФИО должен их совпадать, как в SQL Server
+        connection.create_function("like", 2, self.like, deterministic=True)
+        connection.create_function("like", 3, self.like, deterministic=True)
+        # То же с UPPER(): встроенный переводит в заглавные только латиницу
+        connection.create_function("upper", 1, lambda text: text.upper() if isinstance(text, str) else text,
+                                   deterministic=True)
+        return connection
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def like_matcher(pattern, escape):
+        """Функция проверки строки по шаблону LIKE (% и _, escape - экранирующий символ) без учёта регистра"""
+        wildcards = {'%': '.*', '_': '.'}
+        parts = []   # (регулярное выражение, буквальный текст или None для % и _)
+        characters = iter(pattern)
+        for character in characters:
+            if character == escape:
+                character = next(characters, '')
+                parts.append((re.escape(character), character))
+            elif character in wildcards:
+                parts.append((wildcards[character], None))
+            else:
+                parts.append((re.escape(character), character))
+        
+        # Поиск программы - всегда "начало%": для него хватает startswith без регулярного выражения
+        if parts and parts[-1] == ('.*', None) and all(text is not None for _, text in parts[:-1]):
+            prefix = ''.join(text for _, text in parts[:-1]).casefold()
+            return lambda value: value.casefold().startswith(prefix)
+        
+        regex = re.compile(''.join(part for part, _ in parts), re.IGNORECASE | re.DOTALL)
+        return lambda value: regex.fullmatch(value) is not None
+    
+    @staticmethod
+    def like(pattern, value, escape=None):
+        """X LIKE Y [ESCAPE Z] - это like(Y, X, Z); NULL в любом аргументе даёт NULL"""
+        if pattern is None or value is None:
+            return None
+        return SqliteBackend.like_matcher(pattern, escape)(str(value))
+    
+    @property
+    def error_types(self):
+        return (sqlite3.Error,)
+    
+    @lru_cache(maxsize=512)
+    def translate(self, sql):
+        for pattern, replacement in SQLITE_DIALECT_RULES:
+            sql = pattern.sub(replacement, sql)
+        return sql
+
+
+# Даты хранятся в SQLite как текст ISO; GETDATE() в столбце DATE даёт ещё и время - отбрасываем его
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()[:10]))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+DATABASE_BACKENDS = {
+    'sqlserver': SqlServerBackend,
+    'sqlite': SqliteBackend
+}
+
+
+class Database:
+    _pool = None
+    _backend = None
+    _pool_lock = threading.Lock()
+    _schema_checked = False
+    
+    @staticmethod
+    def backend():
+        if Database._backend is None:
+            backend_name = DB_CONFIG['backend']
+            if backend_name not in DATABASE_BACKENDS:
+                raise ValueError(f"Неизвестная СУБД '{backend_name}', доступны: {', '.join(DATABASE_BACKENDS)}")
+            Database._backend = DATABASE_BACKENDS[backend_name]()
+        return Database._backend
+    
+    @staticmethod
+    def get_pool():
+        with Database._pool_lock:
+            if Database._pool is None:
+                backend = Database.backend()
+                pool = ConnectionPool(backend.connect, backend.translate, **POOL_CONFIG)
+                if backend.auto_bootstrap:
+                    with pool.acquire() as connection:
+                        backend.migrate(connection)
+                Database._pool = pool
+            return Database._pool
+    
+    @staticmethod
+    def close_pool():
+        with Database._pool_lock:
+            pool, Database._pool = Database._pool, None
+        if pool is not None:
+            pool.close_all()
+    
+    @staticmethod
+    def migrate():
+        """Доводит схему текущей базы до последней версии; возвращает применённые версии"""
+        with Database.connection() as connection:
+            return Database.backend().migrate(connection)
+    
+    @staticmethod
+    def schema_version():
+        with Database.connection() as connection:
+            return max(Database.backend().schema_version(connection), default=0)
+    
+    @staticmethod
+    def check_schema():
+        """Проверяет, что в базе применены все миграции программы; иначе SchemaOutdatedError.
+        
+        SQL Server не обновляется автоматически, и без проверки окна падали бы
+        на первом запросе к новой таблице. Успешная проверка нужна один раз за запуск.
+        """
+        if Database._schema_checked:
+            return
+        latest = max(version for version, _, _ in Database.backend().migrations())
+        current = Database.schema_version()
+        if current < latest:
+            raise SchemaOutdatedError(
+                f"Схема базы данных версии {current}, а программе нужна версия {latest}.\n\n"
+                f"Обновите базу командой:\npython {Path(sys.argv[0]).name} --migrate"
+            )
+        Database._schema_checked = True
+    
+    @staticmethod
+    def connection():
+        """Соединение из пула для конструкции with; ошибки подключения пробрасываются наверх"""
+        return Database.get_pool().acquire()
+    
+    @staticmethod
+    def fetch_result_sets(cursor, statements):
+        return Database.backend().fetch_result_sets(cursor, statements)
+    
+    @staticmethod
+    def upsert_attendance(cursor, class_id, attendance_date, rows):
+        Database.backend().upsert_attendance(cursor, class_id, attendance_date, rows)
+    
+    @staticmethod
+    def bulk_insert(cursor, table, columns, rows, batch_size=10000):
+        return Database.backend().bulk_insert(cursor, table, columns, rows, batch_size)
+    
+    @staticmethod
+    def increment_counters(cursor, table, keys, counters, latest, rows):
+        Database.backend().increment_counters(cursor, table, keys, counters, latest, rows)
+    
+    @staticmethod
+    def record_failed_login(cursor, user_id):
+        return Database.backend().record_failed_login(cursor, user_id)
+    
+    @staticmethod
+    def run(work, commit=False):
+        """Выполняет work(cursor) на соединении из пула и возвращает её результат.
+        
+        С commit=True изменения фиксируются, если work завершилась без ошибки.
+        """
+        try:
+            connection = Database.connection()
+        except Database.backend().error_types + (PoolTimeoutError,) as e:
+            raise DatabaseUnavailableError(str(e)) from e
+        
+        with connection:
+            result = work(connection.cursor())
+            if commit:
+                connection.commit()
+            return result
+    
+    @staticmethod
+    def show_connection_error(e):
+        messagebox.showerror("Ошибка подключения", 
+            f"Не удалось подключиться к базе данных школы.\nОшибка: {str(e)}\n\n"
+            f"Убедитесь, что:\n"
+            f"{Database.backend().connection_hint}")
+    
+    @staticmethod
+    def like_prefix(text):
+        """Шаблон для поиска по началу строки: LIKE ? ESCAPE '\\'"""
+        return re.sub(r"([\\%_\[])", r"\\\1", text) + '%'
+    
+    @staticmethod
+    def dict_fetchall(cursor):
+        """Преобразует результат запроса в список словарей"""
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def dict_fetchone(cursor):
+        """Преобразует одну строку результата в словарь"""
+        columns = [column[0] for column in cursor.description]
+        row = cursor.fetchone()
+        if row:
+            return dict(zip(columns, row))
+        return None
+
+class Summaries:
+    """Сводные таблицы оценок и посещаемости по ученику, классу и предмету.
+    
+    Счётчики меняются в той же транзакции, что и исходные записи, поэтому статистика
+    окон читает несколько строк вместо всех оценок. Оценка относится к классу, в котором
+    ученик учится на момент выставления. Расхождения чинит rebuild() (--rebuild-summaries).
+    """
+    
+    PRESENT = 'присутствовал'
+    GRADE_COUNTERS = (('grade_count', 'grade_sum'), 'last_grade_date')
+    ATTENDANCE_COUNTERS = (('present_count', 'total_count'), 'last_attendance_date')
+    IN_LIST_SIZE = 500   # SQL Server принимает не больше 2100 параметров в запросе
+    
+    @staticmethod
+    def add_grade(cursor, student_id, subject_id, teacher_id, grade, grade_date, lesson_type, comment):
+        """Добавляет оценку и учитывает её в сводках ученика и класса"""
+        cursor.execute("""
+            INSERT INTO grades (student_id, subject_id, teacher_id, grade, 
+                               grade_date, lesson_type, comment)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (student_id, subject_id, teacher_id, grade, grade_date, lesson_type, comment))
+        
+        Database.increment_counters(cursor, 'student_subject_summary', ('student_id', 'subject_id'),
+                                    *Summaries.GRADE_COUNTERS, [(student_id, subject_id, 1, grade, grade_date)])
+        
+        cursor.execute("SELECT class_id FROM users WHERE user_id = ?", (student_id,))
+        row = cursor.fetchone()
+        if row and row[0] is not None:
+            Database.increment_counters(cursor, 'class_subject_summary', ('class_id', 'subject_id'),
+                                        *Summaries.GRADE_COUNTERS, [(row[0], subject_id, 1, grade, grade_date)])
+    
+    @staticmethod
+    def save_attendance(cursor, class_id, attendance_date, rows):
+        """Сохраняет отметки класса за день и меняет сводки на разницу с прежними отметками"""
+        previous = {}
+        student_ids = [student_id for student_id, _, _ in rows]
+        for start in range(0, len(student_ids), Summaries.IN_LIST_SIZE):
+            chunk = student_ids[start:start + Summaries.IN_LIST_SIZE]
+            cursor.execute(f"""
+                SELECT student_id, status FROM attendance
+                WHERE attendance_date = ? AND student_id IN ({', '.join('?' * len(chunk))})
+            """, (attendance_date, *chunk))
+            previous.update((student_id, status) for student_id, status in cursor.fetchall())
+        
+        Database.upsert_attendance(cursor, class_id, attendance_date, rows)
+        
+        deltas = []
+        for student_id, status, _ in rows:
+            present = (status == Summaries.PRESENT) - (previous.get(student_id) == Summaries.PRESENT)
+            total = 0 if student_id in previous else 1
+            if present or total:
+                deltas.append((student_id, present, total, attendance_date))
+        if not deltas:
+            return
+        
+        Database.increment_counters(cursor, 'student_attendance_summary', ('student_id',),
+                                    *Summaries.ATTENDANCE_COUNTERS, deltas)
+        Database.increment_counters(cursor, 'class_attendance_summary', ('class_id',),
+                                    *Summaries.ATTENDANCE_COUNTERS,
+                                    [(class_id, sum(delta[1] for delta in deltas),
+                                      sum(delta[2] for delta in deltas), attendance_date)])
+    
+    @staticmethod
+    def has_history(cursor, student_id=None, class_id=None):
+        """Есть ли у ученика оценки или посещаемость, а у класса - ученики или посещаемость.
+        
+        Такие записи не удаляются: история осталась бы без владельца, и сводки класса
+        разошлись бы с пересчётом. SQL Server запрещает это и внешними ключами,
+        а SQLite их не проверяет.
+        """
+        if student_id is not None:
+            cursor.execute("""
+                SELECT CASE WHEN EXISTS (SELECT 1 FROM grades WHERE student_id = ?)
+                              OR EXISTS (SELECT 1 FROM attendance WHERE student_id = ?)
+                       THEN 1 ELSE 0 END
+            """, (student_id, student_id))
+        else:
+            cursor.execute("""
+                SELECT CASE WHEN EXISTS (SELECT 1 FROM users WHERE class_id = ?)
+                              OR EXISTS (SELECT 1 FROM attendance WHERE class_id = ?)
+                       THEN 1 ELSE 0 END
+            """, (class_id, class_id))
+        return bool(cursor.fetchone()[0])
+    
+    @staticmethod
+    def rebuild(cursor):
+        """Пересчитывает все сводки по таблицам оценок и посещаемости"""
+        for sql in Database.backend().SUMMARY_REBUILD:
+            cursor.execute(sql)
+
+class NameIndex:
+    """Подписи для Combobox и их id в обе стороны.
+    
+    Совпадающие названия (например, два учителя с одинаковым ФИО) получают
+    уточнение "(ID: n)", поэтому каждая подпись однозначно указывает на одну запись.
+    """
+    
+    def __init__(self, rows=(), id_column=None, name_column=None):
+        self.rows = list(rows)
+        self.labels = []
+        self.ids = {}       # подпись -> id
+        self.by_id = {}     # id -> подпись
+        
+        seen = {}
+        for row in self.rows:
+            seen[row[name_column]] = seen.get(row[name_column], 0) + 1
+        
+        for row in self.rows:
+            row_id, name = row[id_column], row[name_column]
+            label = name if seen[name] == 1 else f"{name} (ID: {row_id})"
+            self.labels.append(label)
+            self.ids[label] = row_id
+            self.by_id[row_id] = label
+    
+    def id_of(self, label):
+        """id записи по подписи из Combobox; None, если такой подписи нет"""
+        return self.ids.get(label)
+    
+    def label_of(self, row_id):
+        return self.by_id.get(row_id, "")
+
+class ReferenceCache:
+    """Справочники для выпадающих списков, общие для всех окон программы.
+    
+    У каждой таблицы есть версия; запись в таблицу через invalidate() увеличивает её,
+    и списки, построенные на этой таблице, перечитываются при следующем обращении.
+    Возвращаемые списки и индексы общие - изменять их нельзя.
+    """
+    
+    # имя списка: (таблицы, от которых он зависит, столбцы id и названия, запрос)
+    QUERIES = {
+        'classes': (
+            ('classes',),
+            ('class_id', 'class_name'),
+            "SELECT class_id, class_name FROM classes ORDER BY class_name"
+        ),
+        'subjects': (
+            ('subjects',),
+            ('subject_id', 'subject_name'),
+            "SELECT subject_id, subject_name FROM subjects ORDER BY subject_name"
+        ),
+        'teachers': (
+            ('users',),
+            ('user_id', 'full_name'),
+            "SELECT user_id, full_name FROM users WHERE role = 'teacher' ORDER BY full_name"
+        ),
+        'teacher_classes': (
+            ('schedule', 'classes'),
+            ('class_id', 'class_name'),
+            """
+            SELECT DISTINCT c.class_id, c.class_name
+            FROM schedule s
+            JOIN classes c ON s.class_id = c.class_id
+            WHERE s.teacher_id = ?
+            ORDER BY c.class_name
+            """
+        ),
+        'teacher_subjects': (
+            ('schedule', 'subjects'),
+            ('subject_id', 'subject_name'),
+            """
+            SELECT DISTINCT s.subject_id, s.subject_name
+            FROM schedule sch
+            JOIN subjects s ON sch.subject_id = s.subject_id
+            WHERE sch.teacher_id = ?
+            ORDER BY s.subject_name
+            """
+        )
+    }
+    
+    _versions = {}
+    _entries = {}   # (имя, параметры) -> (версии таблиц, время загрузки, NameIndex)
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def index(name, *params):
+        """Справочник name в виде NameIndex - из памяти или из базы, если таблицы менялись"""
+        tables, (id_column, name_column), sql = ReferenceCache.QUERIES[name]
+        key = (name, params)
+        
+        with ReferenceCache._lock:
+            versions = tuple(ReferenceCache._versions.get(table, 0) for table in tables)
+            entry = ReferenceCache._entries.get(key)
+        
+        if entry is not None:
+            cached_versions, loaded_at, index = entry
+            if cached_versions == versions and time.monotonic() - loaded_at < REFERENCE_CACHE_TTL:
+                return index
+        
+        rows = Database.run(lambda cursor: Database.dict_fetchall(cursor.execute(sql, params)))
+        index = NameIndex(rows, id_column, name_column)
+        
+        # Сохраняем с версиями на момент запроса: если таблицу изменили, пока он шёл, запись сразу устареет
+        with ReferenceCache._lock:
+            ReferenceCache._entries[key] = (versions, time.monotonic(), index)
+        return index
+    
+    @staticmethod
+    def get(name, *params):
+        """Строки справочника name"""
+        return ReferenceCache.index(name, *params).rows
+    
+    @staticmethod
+    def names(name, *params):
+        """Только подписи из справочника - для значений Combobox"""
+        return ReferenceCache.index(name, *params).labels
+    
+    @staticmethod
+    def invalidate(*tables):
+        with ReferenceCache._lock:
+            for table in tables:
+                ReferenceCache._versions[table] = ReferenceCache._versions.get(table, 0) + 1
+
+
+class ScheduleOccupancy:
+    """Занятость учителей, классов и кабинетов по дню недели и номеру урока.
+    
+    Загружается из базы один раз (и заново через REFERENCE_CACHE_TTL, чтобы увидеть
+    правки других администраторов), а дальше обновляется диалогами расписания,
+    поэтому конфликт проверяется поиском в словаре без запроса к серверу.
+    Окончательно занятость гарантируют уникальные индексы SCHEDULE_SLOT_INDEXES.
+    """
+    
+    SQL = """
+        SELECT s.schedule_id, s.class_id, c.class_name, s.teacher_id, u.full_name as teacher_name,
+               s.day_of_week, s.lesson_number, s.room
+        FROM schedule s
+        JOIN classes c ON s.class_id = c.class_id
+        JOIN users u ON s.teacher_id = u.user_id
+    """
+    
+    MESSAGES = {
+        'teacher': "Учитель {teacher_name} уже ведёт урок в классе {class_name}: {day_of_week}, {lesson_number}-й урок",
+        'class': "У класса {class_name} уже есть урок: {day_of_week}, {lesson_number}-й урок (учитель {teacher_name})",
+        'room': "Кабинет {room} уже занят классом {class_name}: {day_of_week}, {lesson_number}-й урок"
+    }
+    
+    _slots = {}      # (учитель/класс/кабинет, id или кабинет, день, урок) -> урок
+    _lessons = {}    # schedule_id -> урок
+    _loaded_at = None
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def room(text):
+        """Кабинет в том виде, в каком он хранится: без пробелов по краям и заглавными буквами.
+        
+        Уникальный индекс сравнивает строки как есть (в SQLite - побайтно), поэтому
+        "101а" и "101А " приводятся к одному значению до записи; пустой кабинет - None.
+        """
+        return (text or '').strip().upper() or None
+    
+    @staticmethod
+    def keys(lesson):
+        day, number = lesson['day_of_week'], lesson['lesson_number']
+        keys = [('teacher', lesson['teacher_id'], day, number), ('class', lesson['class_id'], day, number)]
+        room = ScheduleOccupancy.room(lesson['room'])
+        if room:
+            keys.append(('room', room, day, number))
+        return keys
+    
+    @staticmethod
+    def load(cursor):
+        cursor.execute(ScheduleOccupancy.SQL)
+        lessons = Database.dict_fetchall(cursor)
+        with ScheduleOccupancy._lock:
+            ScheduleOccupancy._lessons = {lesson['schedule_id']: lesson for lesson in lessons}
+            ScheduleOccupancy._slots = {key: lesson for lesson in lessons for key in ScheduleOccupancy.keys(lesson)}
+            ScheduleOccupancy._loaded_at = time.monotonic()
+    
+    @staticmethod
+    def ensure(cursor):
+        """Загружает занятость, если её ещё нет или она устарела"""
+        loaded_at = ScheduleOccupancy._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= REFERENCE_CACHE_TTL:
+            ScheduleOccupancy.load(cursor)
+    
+    @staticmethod
+    def conflict(lesson):
+        """Описание урока, с которым пересекается lesson, или None; сам урок (тот же schedule_id) не мешает"""
+        with ScheduleOccupancy._lock:
+            for key in ScheduleOccupancy.keys(lesson):
+                other = ScheduleOccupancy._slots.get(key)
+                if other is not None and other['schedule_id'] != lesson['schedule_id']:
+                    return ScheduleOccupancy.MESSAGES[key[0]].format(**other)
+        return None
+    
+    @staticmethod
+    def put(lesson):
+        """Учитывает добавленный или изменённый урок"""
+        with ScheduleOccupancy._lock:
+            ScheduleOccupancy._discard(lesson['schedule_id'])
+            ScheduleOccupancy._lessons[lesson['schedule_id']] = lesson
+            for key in ScheduleOccupancy.keys(lesson):
+                ScheduleOccupancy._slots[key] = lesson
+    
+    @staticmethod
+    def remove(schedule_id):
+        with ScheduleOccupancy._lock:
+            ScheduleOccupancy._discard(schedule_id)
+    
+    @staticmethod
+    def _discard(schedule_id):
+        lesson = ScheduleOccupancy._lessons.pop(schedule_id, None)
+        if lesson is not None:
+            for key in ScheduleOccupancy.keys(lesson):
+                if ScheduleOccupancy._slots.get(key) is lesson:
+                    del ScheduleOccupancy._slots[key]
+    
+    @staticmethod
+    def reset():
+        """Забывает занятость: следующая проверка загрузит её заново"""
+        with ScheduleOccupancy._lock:
+            ScheduleOccupancy._slots, ScheduleOccupancy._lessons = {}, {}
+            ScheduleOccupancy._loaded_at = None
+    
+    @staticmethod
+    @contextmanager
+    def guard(cursor, lesson):
+        """Превращает нарушение уникального индекса в ScheduleConflictError с описанием занятого урока.
+        
+        Срабатывает, когда урок успел занять другой администратор после загрузки занятости.
+        """
+        try:
+            yield
+        except Database.backend().error_types:
+            ScheduleOccupancy.load(cursor)
+            conflict = ScheduleOccupancy.conflict(lesson)
+            if conflict:
+                raise ScheduleConflictError(conflict) from None
+            raise
+    
+    @staticmethod
+    def schedule_id(cursor, lesson):
+        """Номер только что сохранённого урока: у класса в это время он единственный"""
+        cursor.execute("""
+            SELECT schedule_id FROM schedule
+            WHERE class_id = ? AND day_of_week = ? AND lesson_number = ?
+        """, (lesson['class_id'], lesson['day_of_week'], lesson['lesson_number']))
+        return cursor.fetchone()[0]
+
+
+class BackgroundTasks:
+    """Выполняет запросы в пуле потоков и передаёт результаты в поток Tk через after()"""
+    
+    POLL_MS = 30
+    _executor = None
+    _executor_lock = threading.Lock()
+    
+    def __init__(self, widget):
+        self.widget = widget
+        self._results = queue.Queue()
+        self._futures = set()
+        self._polling = False
+        self._closed = False
+    
+    @classmethod
+    def executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                # Потоков столько же, сколько соединений в пуле: больше всё равно будут ждать
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=POOL_CONFIG['max_size'],
+                    thread_name_prefix="db"
+                )
+            return cls._executor
+    
+    def submit(self, work, on_done, on_error=None):
+        """Запускает work() в фоне и возвращает Future.
+        
+        on_done(result) или on_error(exc) вызываются в потоке Tk; после cancel_all() - никогда.
+        """
+        future = self.executor().submit(work)
+        self._futures.add(future)
+        future.add_done_callback(lambda f: self._results.put((f, on_done, on_error)))
+        if self._closed:
+            future.cancel()
+        elif not self._polling:
+            self._polling = True
+            self.widget.after(self.POLL_MS, self._poll)
+        return future
+    
+    def cancel_all(self):
+        """Отменяет ещё не начатые задачи; результаты уже идущих будут отброшены"""
+        self._closed = True
+        for future in list(self._futures):
+            future.cancel()
+    
+    def _poll(self):
+        if self._closed or not self.widget.winfo_exists():
+            self._polling = False
+            return
+        
+        while True:
+            try:
+                future, on_done, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            
+            self._futures.discard(future)
+            if future.cancelled():
+                continue
+            try:
+                error = future.exception()
+                if error is None:
+                    on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+            except Exception:
+                self.widget.report_callback_exception(*sys.exc_info())
+        
+        if self._futures:
+            self.widget.after(self.POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+
+def show_loading(tree):
+    """Показывает строку-заглушку в пустой таблице, пока данные грузятся.
+    
+    Уже загруженные строки не трогаем: при обновлении старые данные видны до прихода новых.
+    """
+    if tree.get_children():
+        return
+    columns = tree["columns"]
+    tree.insert("", "end", values=("⏳ Загрузка...",) + ("",) * (len(columns) - 1))
+
+
+def longest_increasing_subsequence(sequence):
+    """Индексы элементов самой длинной возрастающей подпоследовательности"""
+    tails = []        # tails[k] - индекс последнего элемента лучшей цепочки длины k + 1
+    previous = [None] * len(sequence)
+    for i, value in enumerate(sequence):
+        low, high = 0, len(tails)
+        while low < high:
+            middle = (low + high) // 2
+            if sequence[tails[middle]] < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low > 0:
+            previous[i] = tails[low - 1]
+        if low == len(tails):
+            tails.append(i)
+        else:
+            tails[low] = i
+    
+    result = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
 
-class Database:
-    @staticmethod
-    def get_connection():
-        try:
-            conn_str = (
-                f"DRIVER={DB_CONFIG['driver']};"
-                f"SERVER={DB_CONFIG['server']};"
-                f"DATABASE={DB_CONFIG['database']};"
-                f"Trusted_Connection={DB_CONFIG['trusted_connection']};"
-            )
-            connection = pyodbc.connect(conn_str)
-            return connection
-        except pyodbc.Error as e:
-            messagebox.showerror("Ошибка подключения", 
-                f"Не удалось подключиться к базе данных школы.\nОшибка: {str(e)}\n\n"
-                f"Убедитесь, что:\n"
-                f"1. SQL Server LocalDB установлен\n"
-                f"2. База данных school_db создана\n"
-                f"3. Драйвер ODBC установлен")
-            return None
+
+class TreeBinding:
+    """Связывает Treeview с результатом запроса по первичному ключу.
     
-    @staticmethod
-    def dict_fetchall(cursor):
-        """Преобразует результат запроса в список словарей"""
-        columns = [column[0] for column in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    При обновлении вставляет, меняет и удаляет только отличающиеся строки,
+    а не пересоздаёт всю таблицу. Ключ строки становится её iid в Treeview.
+    """
     
-    @staticmethod
-    def dict_fetchone(cursor):
-        """Преобразует одну строку результата в словарь"""
-        columns = [column[0] for column in cursor.description]
-        row = cursor.fetchone()
-        if row:
-            return dict(zip(columns, row))
-        return None
+    def __init__(self, tree, key, render):
+        self.tree = tree
+        self.key = key if callable(key) else (lambda record, column=key: record[column])
+        self.render = render    # запись -> кортеж значений для столбцов
+        self.values = {}        # iid -> показанные значения
+        self.records = {}       # iid -> исходная запись из базы
+    
+    def iid(self, record):
+        return str(self.key(record))
+    
+    def record(self, iid):
+        return self.records.get(iid)
+    
+    def sync(self, records):
+        """Приводит таблицу к списку records в том же порядке"""
+        tree = self.tree
+        order = []
+        new_values = {}
+        new_records = {}
+        for record in records:
+            iid = self.iid(record)
+            order.append(iid)
+            new_values[iid] = self.render(record)
+            new_records[iid] = record
+        
+        # Удаляем пропавшие строки и всё постороннее, например заглушку загрузки
+        current = list(tree.get_children())
+        removed = [iid for iid in current if iid not in new_values or iid not in self.values]
+        if removed:
+            tree.delete(*removed)
+            removed = set(removed)
+            current = [iid for iid in current if iid not in removed]
+        
+        # Строки из самой длинной уже упорядоченной цепочки остаются на месте, двигаем только остальные
+        position = {iid: i for i, iid in enumerate(current)}
+        kept = [iid for iid in order if iid in position]
+        in_place = {kept[i] for i in longest_increasing_subsequence([position[iid] for iid in kept])}
+        
+        previous = None
+        for iid in order:
+            values = new_values[iid]
+            if not current:
+                # Таблица была пустой - просто дописываем в конец
+                tree.insert("", "end", iid=iid, values=values)
+            elif iid not in position:
+                tree.insert("", self._index_after(previous), iid=iid, values=values)
+            else:
+                if iid not in in_place:
+                    tree.detach(iid)
+                    tree.move(iid, "", self._index_after(previous))
+                if self.values[iid] != values:
+                    tree.item(iid, values=values)
+            previous = iid
+        
+        self.values = new_values
+        self.records = new_records
+    
+    def append(self, records):
+        """Дописывает records в конец таблицы (следующая страница), существующие строки обновляет"""
+        tree = self.tree
+        for record in records:
+            iid = self.iid(record)
+            values = self.render(record)
+            if iid in self.values:
+                if self.values[iid] != values:
+                    tree.item(iid, values=values)
+            else:
+                tree.insert("", "end", iid=iid, values=values)
+            self.values[iid] = values
+            self.records[iid] = record
+    
+    def _index_after(self, previous):
+        return 0 if previous is None else self.tree.index(previous) + 1
 
 class ModernButton(ctk.CTkButton):
     def __init__(self, master=None, **kwargs):
@@ -122,133 +2105,225 @@ class CardFrame(ctk.CTkFrame):
             border_color=COLORS['border']
         )
 
+class SearchBar(ctk.CTkFrame):
+    """Строка поиска с фильтрами над таблицей; on_change вызывается после паузы в наборе"""
+    
+    def __init__(self, master, placeholder, on_change, choices=None, **kwargs):
+        super().__init__(master, fg_color="transparent", **kwargs)
+        self.on_change = on_change
+        self.pending = None
+        
+        self.entry = ModernEntry(self, placeholder_text=placeholder, width=320)
+        self.entry.pack(side="left", padx=2)
+        self.entry.bind("<KeyRelease>", lambda e: self.schedule())
+        
+        # choices: {имя фильтра: [(подпись, значение), ...]}, первый вариант выбран по умолчанию
+        self.menus = {}
+        for name, options in (choices or {}).items():
+            values = dict(options)
+            menu = ctk.CTkOptionMenu(
+                self,
+                values=list(values),
+                command=lambda _: self.schedule(),
+                font=FONTS['body'],
+                fg_color=COLORS['sidebar'],
+                button_color=COLORS['primary'],
+                height=40
+            )
+            menu.pack(side="left", padx=2)
+            self.menus[name] = (menu, values)
+        
+        self.applied = self.filters()
+    
+    def filters(self):
+        result = {'text': self.entry.get().strip()}
+        for name, (menu, values) in self.menus.items():
+            result[name] = values[menu.get()]
+        return result
+    
+    def schedule(self):
+        if self.pending is not None:
+            self.after_cancel(self.pending)
+        self.pending = self.after(SEARCH_DEBOUNCE_MS, self.fire)
+    
+    def fire(self):
+        self.pending = None
+        filters = self.filters()
+        # Стрелки и Shift тоже дают KeyRelease, но запрос нужен только при изменении фильтров
+        if filters != self.applied:
+            self.applied = filters
+            self.on_change()
+
+class CaptchaImageCache:
+    """Картинки капчи, уже открытые и уменьшенные, хранятся на диске сырыми RGB-байтами.
+    
+    Файл называется по хэшу содержимого исходников и размера картинки, поэтому
+    он пересобирается только при изменении картинок. manifest.json запоминает размер
+    и время изменения исходников, чтобы при обычном запуске не читать их вовсе.
+    """
+    
+    def __init__(self, cache_dir, image_size):
+        self.cache_dir = Path(cache_dir)
+        self.image_size = image_size
+        self.manifest_path = self.cache_dir / 'manifest.json'
+    
+    def load(self, paths, build):
+        """Картинки для исходников paths; build() декодирует их, если в кэше ничего подходящего нет"""
+        try:
+            sources = [[str(path), os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths]
+            manifest = self.read_manifest()
+            
+            if manifest.get('sources') == sources and manifest.get('image_size') == self.image_size:
+                digest = manifest['digest']
+            else:
+                digest = self.content_hash(paths)
+            
+            images = self.read_images(digest)
+            if images is None:
+                images = build()
+                self.write_images(digest, images)
+            
+            if manifest.get('digest') != digest or manifest.get('sources') != sources:
+                self.write_manifest({'image_size': self.image_size, 'sources': sources, 'digest': digest})
+            return images
+        except OSError as e:
+            # Кэш - только ускорение: без доступа к диску просто декодируем картинки
+            print(f"⚠️ Кэш капчи недоступен: {e}")
+            return build()
+    
+    def content_hash(self, paths):
+        digest = hashlib.sha256(f"{self.image_size}:{len(paths)}".encode())
+        for path in paths:
+            digest.update(Path(path).read_bytes())
+        return digest.hexdigest()[:32]
+    
+    def images_path(self, digest):
+        return self.cache_dir / f"images-{digest}.rgb"
+    
+    def read_images(self, digest):
+        image_bytes = self.image_size * self.image_size * 3
+        try:
+            with open(self.images_path(digest), 'rb') as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    if len(buffer) == 0 or len(buffer) % image_bytes:
+                        return None
+                    view = memoryview(buffer)
+                    try:
+                        return [
+                            Image.frombytes('RGB', (self.image_size, self.image_size), view[offset:offset + image_bytes])
+                            for offset in range(0, len(buffer), image_bytes)
+                        ]
+                    finally:
+                        view.release()
+        except (OSError, ValueError):
+            return None
+    
+    def write_images(self, digest, images):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Картинки от прежних исходников больше не нужны
+        for stale in self.cache_dir.glob('images-*.rgb'):
+            stale.unlink()
+        self.write_atomic(self.images_path(digest), b''.join(image.tobytes() for image in images))
+    
+    def read_manifest(self):
+        try:
+            return json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+    
+    def write_manifest(self, manifest):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.write_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+    
+    @staticmethod
+    def write_atomic(path, data):
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+
+
 class CaptchaPuzzle:
-    def __init__(self):
+    def __init__(self, grid_size=None):
+        self.grid_size = grid_size or CAPTCHA_CONFIG['grid_size']
+        if self.grid_size < 2:
+            # Из одного кусочка нельзя собрать перемешанный пазл
+            raise ValueError(f"Пазл должен быть не меньше 2×2, получено {self.grid_size}")
         self.pieces = []
         self.correct_order = []
         self.current_order = []
-        self.images = []
+        self.source = None
         self.load_real_images()
         
+    # Где искать 1.png-4.png внутри папки с картинками (первый полный вариант побеждает)
+    SOURCE_LAYOUTS = [
+        ["Эд1/1.png", "Эд2/2.png", "Эд3/3.png", "Эд4/4.png"],
+        ["Эддд/Эд1/1.png", "Эддд/Эд2/2.png", "Эддд/Эд3/3.png", "Эддд/Эд4/4.png"],
+        ["1.png", "2.png", "3.png", "4.png"]
+    ]
+    
+    @property
+    def piece_display_size(self):
+        """Сторона одного кусочка на экране"""
+        return CAPTCHA_CONFIG['display_size'] // self.grid_size
+    
     def load_real_images(self):
-        """Загрузка РЕАЛЬНЫХ изображений пользователя"""
-        # ПРОБУЕМ РАЗНЫЕ ВАРИАНТЫ СТРУКТУРЫ ПАПОК
-        base_path = r"C:\Users\Eduard\Downloads\Эд"
-        
-        # Вариант 1: Эд\Эд1, Эд\Эд2, Эд\Эд3, Эд\Эд4
-        image_paths_v1 = [
-            fr"{base_path}\Эд1\1.png",
-            fr"{base_path}\Эд2\2.png", 
-            fr"{base_path}\Эд3\3.png",
-            fr"{base_path}\Эд4\4.png"
-        ]
-        
-        # Вариант 2: Эд\Эддд\Эд3 и возможно другие подобные
-        image_paths_v2 = [
-            fr"{base_path}\Эддд\Эд1\1.png",  # если такая папка есть
-            fr"{base_path}\Эддд\Эд2\2.png",  # если такая папка есть
-            fr"{base_path}\Эддд\Эд3\3.png",  # точно есть по вашим словам
-            fr"{base_path}\Эддд\Эд4\4.png"   # если такая папка есть
-        ]
-        
-        # Вариант 3: файлы напрямую в папке Эд
-        image_paths_v3 = [
-            fr"{base_path}\1.png",
-            fr"{base_path}\2.png",
-            fr"{base_path}\3.png", 
-            fr"{base_path}\4.png"
-        ]
-        
-        print("=" * 60)
-        print("ПОИСК ВАШИХ ИЗОБРАЖЕНИЙ")
-        print("=" * 60)
-        
-        # Сначала проверим, что существует базовая папка
-        if not os.path.exists(base_path):
-            print(f"❌ Базовая папка не найдена: {base_path}")
-            self.create_fallback_images()
+        """Загрузка РЕАЛЬНЫХ изображений пользователя через кэш готовой картинки"""
+        paths = self.find_source_paths(CAPTCHA_CONFIG['asset_dir'])
+        if not paths:
+            print(f"❌ Изображения капчи не найдены в {CAPTCHA_CONFIG['asset_dir']}, используются заглушки")
+            self.source = self.create_fallback_image()
             return
         
-        print(f"✅ Базовая папка существует: {base_path}")
-        
-        # Покажем что есть в папке Эд
-        try:
-            print(f"\nСодержимое папки {base_path}:")
-            for item in os.listdir(base_path):
-                item_path = os.path.join(base_path, item)
-                if os.path.isdir(item_path):
-                    print(f"📁 {item}/")
-                    # Покажем что внутри вложенных папок
-                    try:
-                        for subitem in os.listdir(item_path):
-                            subitem_path = os.path.join(item_path, subitem)
-                            if os.path.isfile(subitem_path):
-                                print(f"    📄 {subitem}")
-                    except:
-                        pass
-                else:
-                    print(f"📄 {item}")
-        except Exception as e:
-            print(f"Ошибка при чтении папки: {e}")
-        
-        print("\n" + "-" * 60)
-        
-        # Пробуем найти изображения
-        all_path_variants = [
-            ("Вариант 1 (Эд1, Эд2...)", image_paths_v1),
-            ("Вариант 2 (Эдлл\\Эд1...)", image_paths_v2),
-            ("Вариант 3 (image1.png...)", image_paths_v3)
-        ]
+        cache = CaptchaImageCache(CAPTCHA_CONFIG['cache_dir'], CAPTCHA_CONFIG['image_size'])
+        self.source = cache.load(paths, lambda: [self.decode_source(paths)])[0]
+    
+    @staticmethod
+    def find_source_paths(base_path):
+        """Одна картинка source_image или до четырёх четвертей 1.png-4.png"""
+        single = os.path.join(base_path, CAPTCHA_CONFIG['source_image'])
+        if os.path.isfile(single):
+            return [single]
         
         found_paths = []
-        
-        for variant_name, paths in all_path_variants:
-            print(f"\nПробуем {variant_name}:")
-            found_in_variant = 0
+        for layout in CaptchaPuzzle.SOURCE_LAYOUTS:
+            found_in_variant = [os.path.join(base_path, *name.split('/')) for name in layout]
+            found_in_variant = [path for path in found_in_variant if os.path.isfile(path)]
+            found_paths.extend(found_in_variant)
+            if len(found_in_variant) == 4:
+                break
+        return found_paths[:4]
+    
+    @staticmethod
+    def open_image(path, size):
+        try:
+            img = Image.open(path)
             
-            for i, path in enumerate(paths, 1):
-                if os.path.exists(path):
-                    print(f"  ✅ Изображение {i}: {path}")
-                    found_paths.append(path)
-                    found_in_variant += 1
-                else:
-                    print(f"  ❌ Не найдено: {path}")
+            # Конвертируем если нужно
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
             
-            if found_in_variant == 4:
-                print(f"✅ Найдены ВСЕ 4 изображения!")
-                break
-            elif found_in_variant > 0:
-                print(f"Найдено {found_in_variant}/4 изображений")
+            # Масштабируем
+            return img.resize((size, size), Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"❌ Ошибка загрузки {path}: {e}")
+            # Добавляем черный квадрат
+            return Image.new('RGB', (size, size), color=(50, 50, 50))
+    
+    @staticmethod
+    def decode_source(paths):
+        """Картинка для нарезки: единственный исходник или мозаика 2×2 из четырёх четвертей"""
+        size = CAPTCHA_CONFIG['image_size']
+        if len(paths) == 1:
+            source = CaptchaPuzzle.open_image(paths[0], size)
+            print("🧩 Подготовлена картинка капчи")
+            return source
         
-        print("\n" + "-" * 60)
+        half = size // 2
+        quarters = [CaptchaPuzzle.open_image(path, half) for path in paths]
         
-        # Если нашли какие-то пути, загружаем их
-        if found_paths:
-            print(f"Загружаем {len(found_paths)} найденных изображений...")
-            for i, path in enumerate(found_paths[:4]):  # берем максимум 4
-                try:
-                    img = Image.open(path)
-                    
-                    # Конвертируем если нужно
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Масштабируем
-                    img = img.resize((150, 150), Image.Resampling.LANCZOS)
-                    self.images.append(img)
-                    print(f"✅ Загружено изображение {i+1}: {os.path.basename(path)}")
-                    
-                except Exception as e:
-                    print(f"❌ Ошибка загрузки {path}: {e}")
-                    # Добавляем черный квадрат
-                    self.images.append(Image.new('RGB', (150, 150), color=(50, 50, 50)))
-        else:
-            print("❌ Не найдено ни одного изображения!")
-            
         # Если изображений меньше 4, добавляем недостающие
-        while len(self.images) < 4:
-            missing_num = len(self.images) + 1
-            img = Image.new('RGB', (150, 150), color=(100, 100, 100))
+        while len(quarters) < 4:
+            img = Image.new('RGB', (half, half), color=(100, 100, 100))
             
             # Добавим текст на черный квадрат
             from PIL import ImageDraw, ImageFont
@@ -259,20 +2334,27 @@ class CaptchaPuzzle:
             except:
                 pass
                 
-            self.images.append(img)
-            print(f"➕ Добавлено изображение-заглушка {missing_num}")
+            quarters.append(img)
         
-        print("=" * 60)
-        print(f"ИТОГО: {len(self.images)} изображений готово к использованию")
-        print("=" * 60)
+        print(f"🧩 Картинка капчи собрана из {len(paths)} изображений")
+        return CaptchaPuzzle.compose(quarters, size)
+    
+    @staticmethod
+    def compose(quarters, size):
+        source = Image.new('RGB', (size, size))
+        half = size // 2
+        for i, quarter in enumerate(quarters):
+            source.paste(quarter, ((i % 2) * half, (i // 2) * half))
+        return source
     
-    def create_fallback_images(self):
-        """Создает изображения если ничего не найдено"""
+    def create_fallback_image(self):
+        """Создает изображение если ничего не найдено"""
         from PIL import ImageDraw, ImageFont
         
-        print("Создаю изображения...")
+        half = CAPTCHA_CONFIG['image_size'] // 2
+        quarters = []
         
-        # Создаем 4 разных изображения
+        # Создаем 4 разных четверти
         for i in range(4):
             # Разные цвета для разных частей
             colors = [
@@ -282,55 +2364,103 @@ class CaptchaPuzzle:
                 (255, 255, 100)   # Желтый
             ]
             
-            img = Image.new('RGB', (150, 150), color=colors[i])
+            img = Image.new('RGB', (half, half), color=colors[i])
             draw = ImageDraw.Draw(img)
             
             try:
                 font = ImageFont.truetype("arial.ttf", 60)
-                draw.text((50, 40), f"{i+1}", fill=(0, 0, 0), font=font)
+                draw.text((half // 3, half // 4), f"{i+1}", fill=(0, 0, 0), font=font)
             except:
                 pass
             
-            self.images.append(img)
-            print(f"Создано изображение {i+1}")
-    
-    def create_puzzle(self):
-        """Создает пазл из загруженных изображений"""
-        self.pieces = self.images[:4]
-        self.correct_order = [0, 1, 2, 3]
-        
-        # Создаем перемешанный порядок
-        self.current_order = self.correct_order.copy()
-        
-        # Перемешиваем до тех пор, пока порядок не изменится
-        while self.current_order == self.correct_order:
-            self.current_order = random.sample(range(4), 4)
-        
-        print(f"\n🧩 СОЗДАН ПАЗЛ")
-        print(f"Правильный порядок: {[i+1 for i in self.correct_order]}")
-        print(f"Перемешанный порядок: {[i+1 for i in self.current_order]}")
+            quarters.append(img)
         
+        return self.compose(quarters, CAPTCHA_CONFIG['image_size'])
+    
+    @staticmethod
+    def shuffled_order(count):
+        """Случайная перестановка, отличная от собранной; решается обменами из любого положения"""
+        order = list(range(count))
+        while count > 1 and order == sorted(order):
+            random.shuffle(order)
+        return order
+    
+    def build_puzzle(self):
+        """Нарезает картинку на N×N кусочков размером для экрана и перемешивает их.
+        
+        Текущий пазл не меняется, поэтому метод можно вызывать из фонового потока.
+        """
+        n = self.grid_size
+        step = self.source.width // n
+        size = self.piece_display_size
+        
+        # Кусочки в правильном порядке: слева направо, сверху вниз
+        pieces = [
+            self.source.crop((col * step, row * step, (col + 1) * step, (row + 1) * step))
+                       .resize((size, size), Image.Resampling.LANCZOS)
+            for row in range(n)
+            for col in range(n)
+        ]
+        return pieces, self.shuffled_order(n * n)
+    
+    def create_puzzle(self, puzzle=None):
+        """Делает текущим готовый пазл из build_puzzle() или создаёт новый"""
+        self.pieces, self.current_order = puzzle or self.build_puzzle()
+        self.correct_order = list(range(len(self.pieces)))
         return self.pieces, self.current_order
     
     def check_solution(self, user_order):
         """Проверяет правильность решения"""
-        is_correct = user_order == self.correct_order
-        
-        print(f"\n🔍 ПРОВЕРКА")
-        print(f"Вы собрали: {[i+1 for i in user_order]}")
-        print(f"Нужно было: {[i+1 for i in self.correct_order]}")
-        print(f"Результат: {'✅ ВЕРНО' if is_correct else '❌ НЕВЕРНО'}")
-        
+        is_correct = list(user_order) == self.correct_order
+        print(f"🔍 Проверка пазла {self.grid_size}×{self.grid_size}: {'✅ ВЕРНО' if is_correct else '❌ НЕВЕРНО'}")
         return is_correct
 
+class CaptchaPregenerator:
+    """Фоновый поток заранее нарезает и перемешивает пазлы, чтобы новый появлялся сразу.
+    
+    Картинки для Tk (CTkImage) по-прежнему создаются в главном потоке - Tk не терпит других.
+    """
+    
+    def __init__(self, captcha, depth):
+        self.captcha = captcha
+        self.ready = queue.Queue(maxsize=max(depth, 1))
+        self.stopped = threading.Event()
+        if depth > 0:
+            threading.Thread(target=self._produce, name="captcha", daemon=True).start()
+    
+    def _produce(self):
+        while not self.stopped.is_set():
+            puzzle = self.captcha.build_puzzle()
+            # Очередь полна - ждём, пока пазл заберут, но не дольше, чем нужно для остановки
+            while not self.stopped.is_set():
+                try:
+                    self.ready.put(puzzle, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+    
+    def next(self):
+        """Готовый пазл из очереди; если она пуста, пазл создаётся на месте"""
+        try:
+            return self.ready.get_nowait()
+        except queue.Empty:
+            return self.captcha.build_puzzle()
+    
+    def stop(self):
+        self.stopped.set()
+
 class LoginWindow(ctk.CTk):
     def __init__(self):
+        started = time.perf_counter()
         super().__init__()
         self.title("🎓 Система управления школой")
         self.geometry("900x900")
         self.resizable(False, False)
         
-        self.captcha = CaptchaPuzzle()
+        # Капча и соединение с базой готовятся в фоне, пока форма уже на экране
+        self.captcha = None
+        self.captcha_pool = None
+        self.tasks = BackgroundTasks(self)
         self.failed_attempts = 0
         self.current_user = None
         self.selected_piece = None
@@ -338,6 +2468,52 @@ class LoginWindow(ctk.CTk):
         self.piece_images = []
         
         self.setup_ui()
+        StartupTimer.record("Окно входа: создание", started)
+        self.after_idle(lambda: StartupTimer.mark("Окно входа: первая отрисовка"))
+        
+        self.tasks.submit(self.prepare_captcha, self.show_first_captcha, self.captcha_error)
+        self.tasks.submit(self.warm_up_database, self.show_schema_error)
+    
+    @staticmethod
+    def prepare_captcha():
+        """Картинки капчи с диска и первый пазл - в фоновом потоке"""
+        with StartupTimer.phase("Капча: картинки"):
+            captcha = CaptchaPuzzle()
+        with StartupTimer.phase("Капча: первый пазл"):
+            puzzle = captcha.build_puzzle()
+        return captcha, puzzle
+    
+    def show_first_captcha(self, prepared):
+        self.captcha, puzzle = prepared
+        self.captcha_pool = CaptchaPregenerator(self.captcha, CAPTCHA_CONFIG['pregenerate'])
+        self.generate_new_captcha(puzzle)
+        StartupTimer.mark("Капча показана")
+        StartupTimer.report()
+    
+    def captcha_error(self, error):
+        self.captcha_placeholder.configure(text=f"❌ Не удалось подготовить пазл: {error}")
+    
+    @staticmethod
+    def warm_up_database():
+        """Загружает драйвер СУБД, открывает первое соединение пула и проверяет версию схемы.
+        
+        Возвращает сообщение об устаревшей схеме или None.
+        """
+        try:
+            with StartupTimer.phase("База: драйвер и первое соединение"):
+                with Database.connection():
+                    pass
+            Database.check_schema()
+        except SchemaOutdatedError as e:
+            return str(e)
+        except Exception as e:
+            # Прогрев только экономит время; об ошибке подключения сообщит сам вход
+            print(f"⚠️ Предварительное подключение к базе не удалось: {e}")
+        return None
+    
+    def show_schema_error(self, message):
+        if message:
+            messagebox.showerror("База данных устарела", message)
         
     def setup_ui(self):
         # Основной фрейм с градиентом
@@ -430,7 +2606,15 @@ class LoginWindow(ctk.CTk):
         self.puzzle_frame = CardFrame(right_panel, height=250)
         self.puzzle_frame.pack(fill="x", padx=40, pady=10)
         
-        self.generate_new_captcha()
+        # Заглушка до готовности пазла; её убирает build_puzzle_grid
+        self.captcha_placeholder = ctk.CTkLabel(
+            self.puzzle_frame,
+            text="⏳ Пазл загружается...",
+            font=FONTS['body'],
+            text_color=COLORS['gray'],
+            height=CAPTCHA_CONFIG['display_size']
+        )
+        self.captcha_placeholder.pack(expand=True, pady=20)
         
         # Кнопки
         buttons_frame = ctk.CTkFrame(right_panel, fg_color="transparent")
@@ -485,30 +2669,42 @@ class LoginWindow(ctk.CTk):
             text_color=COLORS['gray']
         ).pack(side="right")
     
-    def generate_new_captcha(self):
+    def generate_new_captcha(self, puzzle=None):
+        pieces, order = self.captcha.create_puzzle(puzzle or self.captcha_pool.next())
+        self.selected_piece = None
+        
+        # Картинка каждого кусочка создаётся один раз на пазл; обмен лишь переставляет готовые
+        size = self.captcha.piece_display_size
+        self.piece_images = [
+            ctk.CTkImage(light_image=piece, dark_image=piece, size=(size, size))
+            for piece in pieces
+        ]
+        
+        # Кнопки переживают новые пазлы: сетка пересоздаётся, только если меняется число кусочков
+        if len(self.puzzle_buttons) != len(order):
+            self.build_puzzle_grid(len(order))
+        
+        for button in self.puzzle_buttons:
+            button.configure(border_color=COLORS['border'])
+        self.update_puzzle_display()
+    
+    def build_puzzle_grid(self, count):
         for widget in self.puzzle_frame.winfo_children():
             widget.destroy()
-        
-        pieces, order = self.captcha.create_puzzle()
         self.puzzle_buttons = []
-        self.piece_images = []
-        self.selected_piece = None
         
         # Сетка для пазла
         grid_frame = ctk.CTkFrame(self.puzzle_frame, fg_color="transparent")
         grid_frame.pack(expand=True)
         
-        for i, piece_idx in enumerate(order):
-            piece = pieces[piece_idx]
-            piece_img = ctk.CTkImage(light_image=piece, dark_image=piece, size=(100, 100))
-            self.piece_images.append(piece_img)
-            
+        n = self.captcha.grid_size
+        size = self.captcha.piece_display_size
+        for i in range(count):
             piece_btn = ctk.CTkButton(
                 grid_frame,
-                image=piece_img,
                 text="",
-                width=110,
-                height=110,
+                width=size + 10,
+                height=size + 10,
                 command=lambda idx=i: self.select_piece(idx),
                 fg_color="transparent",
                 border_width=3,
@@ -516,9 +2712,9 @@ class LoginWindow(ctk.CTk):
                 corner_radius=8,
                 hover_color=COLORS['hover']
             )
-            row = i // 2
-            col = i % 2
-            piece_btn.grid(row=row, column=col, padx=10, pady=10)
+            row = i // n
+            col = i % n
+            piece_btn.grid(row=row, column=col, padx=max(2, 20 // n), pady=max(2, 20 // n))
             self.puzzle_buttons.append(piece_btn)
     
     def select_piece(self, idx):
@@ -529,7 +2725,7 @@ class LoginWindow(ctk.CTk):
             if idx != self.selected_piece:
                 self.captcha.current_order[self.selected_piece], self.captcha.current_order[idx] = \
                     self.captcha.current_order[idx], self.captcha.current_order[self.selected_piece]
-                self.update_puzzle_display()
+                self.update_puzzle_display(self.selected_piece, idx)
                 self.puzzle_buttons[self.selected_piece].configure(border_color=COLORS['border'])
                 self.selected_piece = None
             else:
@@ -537,18 +2733,21 @@ class LoginWindow(ctk.CTk):
                 self.selected_piece = None
     
     def shuffle_puzzle(self):
+        if self.captcha is None:
+            return
+        
         if self.selected_piece is not None:
             self.puzzle_buttons[self.selected_piece].configure(border_color=COLORS['border'])
             self.selected_piece = None
         
-        random.shuffle(self.captcha.current_order)
+        self.captcha.current_order = self.captcha.shuffled_order(len(self.captcha.current_order))
         self.update_puzzle_display()
     
-    def update_puzzle_display(self):
-        for i, piece_idx in enumerate(self.captcha.current_order):
-            piece = self.captcha.pieces[piece_idx]
-            piece_img = ctk.CTkImage(light_image=piece, dark_image=piece, size=(100, 100))
-            self.puzzle_buttons[i].configure(image=piece_img)
+    def update_puzzle_display(self, *positions):
+        """Показывает текущий порядок; positions - только изменившиеся места (по умолчанию все)"""
+        order = self.captcha.current_order
+        for i in positions or range(len(order)):
+            self.puzzle_buttons[i].configure(image=self.piece_images[order[i]])
     
     def login(self):
         username = self.username_entry.get().strip()
@@ -558,6 +2757,10 @@ class LoginWindow(ctk.CTk):
             messagebox.showwarning("Ошибка", "Заполните все поля")
             return
         
+        if self.captcha is None:
+            messagebox.showwarning("Подождите", "Пазл ещё загружается")
+            return
+        
         if not self.captcha.check_solution(self.captcha.current_order):
             self.failed_attempts += 1
             messagebox.showerror("Ошибка", "Пазл собран неправильно!")
@@ -568,69 +2771,103 @@ class LoginWindow(ctk.CTk):
                 return
             return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
+        # Проверка пароля намеренно дорогая, поэтому идёт в фоне, а кнопка ждёт результата
+        self.login_btn.configure(state="disabled")
+        def work():
+            # Окна программы не открываются на базе без нужных таблиц
+            Database.check_schema()
+            return self.authenticate(username, password)
+        
+        self.tasks.submit(work, self.finish_login, self.login_error)
+    
+    LOGIN_SQL = """
+        SELECT u.user_id, u.username, u.password, u.full_name, u.role,
+               u.class_id, c.class_name, u.is_blocked, u.failed_attempts
+        FROM users u
+        LEFT JOIN classes c ON u.class_id = c.class_id
+        WHERE u.username = ?
+    """
+    
+    @staticmethod
+    def authenticate(username, password):
+        """Проверяет логин и пароль в фоновом потоке; возвращает (результат, пользователь).
+        
+        Результат: 'ok', 'failed' (неверный пароль), 'blocked' или 'unknown' (нет такого логина).
+        """
+        with Database.connection() as connection:
             cursor = connection.cursor()
-            cursor.execute(
-                "SELECT * FROM users WHERE username = ?",
-                (username,)
-            )
+            # Только нужные окнам столбцы - их целиком отдаёт индекс ix_users_login
+            cursor.execute(LoginWindow.LOGIN_SQL, (username,))
             user = Database.dict_fetchone(cursor)
             
-            if user:
-                if user['is_blocked']:
-                    messagebox.showerror("Блокировка", "Аккаунт заблокирован")
-                    return
-                
-                if password == user['password']:
-                    cursor.execute(
-                        "UPDATE users SET failed_attempts = 0 WHERE user_id = ?",
-                        (user['user_id'],)
-                    )
-                    connection.commit()
-                    
-                    self.current_user = user
-                    self.open_main_app()
-                else:
-                    self.handle_failed_attempt(user, connection)
-            else:
-                messagebox.showerror("Ошибка", "Неверный логин или пароль")
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка: {str(e)}")
-        finally:
-            connection.close()
-    
-    def handle_failed_attempt(self, user, connection):
-        try:
-            cursor = connection.cursor()
-            new_attempts = user['failed_attempts'] + 1
-            cursor.execute(
-                "UPDATE users SET failed_attempts = ? WHERE user_id = ?",
-                (new_attempts, user['user_id'])
-            )
+            if not user:
+                return 'unknown', None
+            
+            if user['is_blocked']:
+                return 'blocked', user
+            
+            if not PasswordHasher.verify(password, user['password']):
+                user['failed_attempts'] = Database.record_failed_login(cursor, user['user_id'])
+                connection.commit()
+                return 'failed', user
             
-            if new_attempts >= 3:
+            # Обычный вход ничего не пишет; счётчик сбрасывается и пароль перехэшируется одной командой
+            new_hash = PasswordHasher.hash(password) if PasswordHasher.needs_rehash(user['password']) else None
+            if new_hash is not None:
+                cursor.execute(
+                    "UPDATE users SET failed_attempts = 0, password = ? WHERE user_id = ?",
+                    (new_hash, user['user_id'])
+                )
+                connection.commit()
+            elif user['failed_attempts']:
                 cursor.execute(
-                    "UPDATE users SET is_blocked = 1 WHERE user_id = ?",
+                    "UPDATE users SET failed_attempts = 0 WHERE user_id = ?",
                     (user['user_id'],)
                 )
-                messagebox.showerror("Блокировка", "3 неудачные попытки. Аккаунт заблокирован.")
-            else:
-                messagebox.showerror("Ошибка", f"Неверный пароль. Осталось попыток: {3 - new_attempts}")
+                connection.commit()
             
-            connection.commit()
-            self.generate_new_captcha()
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка базы данных: {str(e)}")
+            del user['password']
+            return 'ok', user
+    
+    def finish_login(self, result):
+        self.login_btn.configure(state="normal")
+        status, user = result
+        
+        if status == 'ok':
+            self.current_user = user
+            self.open_main_app()
+        elif status == 'failed':
+            self.handle_failed_attempt(user)
+        elif status == 'blocked':
+            messagebox.showerror("Блокировка", "Аккаунт заблокирован")
+        else:
+            messagebox.showerror("Ошибка", "Неверный логин или пароль")
+    
+    def login_error(self, error):
+        self.login_btn.configure(state="normal")
+        if isinstance(error, SchemaOutdatedError):
+            messagebox.showerror("База данных устарела", str(error))
+        elif isinstance(error, Database.backend().error_types + (PoolTimeoutError,)):
+            Database.show_connection_error(error)
+        else:
+            messagebox.showerror("Ошибка", f"Ошибка: {str(error)}")
+    
+    def handle_failed_attempt(self, user):
+        if user['failed_attempts'] >= MAX_LOGIN_ATTEMPTS:
+            messagebox.showerror("Блокировка", f"{MAX_LOGIN_ATTEMPTS} неудачные попытки. Аккаунт заблокирован.")
+        else:
+            messagebox.showerror("Ошибка", f"Неверный пароль. Осталось попыток: {MAX_LOGIN_ATTEMPTS - user['failed_attempts']}")
+        
+        self.generate_new_captcha()
     
     def open_registration(self):
         RegistrationWindow(self)
     
+    def destroy(self):
+        if self.captcha_pool is not None:
+            self.captcha_pool.stop()
+        super().destroy()
+    
     def open_main_app(self):
         self.withdraw()
         if self.current_user['role'] == 'admin':
@@ -646,6 +2883,8 @@ class RegistrationWindow(ctk.CTkToplevel):
         self.title("📝 Регистрация в системе")
         self.geometry("600x700")
         self.resizable(False, False)
+        self.tasks = BackgroundTasks(self)
+        self.registering = False
         
         self.setup_ui()
         
@@ -981,30 +3220,46 @@ class RegistrationWindow(ctk.CTkToplevel):
                 messagebox.showwarning("Ошибка", "Слишком длинный номер телефона")
                 return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        def save(cursor):
+            cursor.execute("SELECT user_id FROM users WHERE username = ?", (username,))
             if Database.dict_fetchone(cursor):
-                messagebox.showwarning("Ошибка", "Логин уже занят")
-                return
+                return False
             
+            # Хеширование пароля тоже выполняется в фоне, вместе с запросом
             cursor.execute("""
                 INSERT INTO users (username, password, full_name, phone, email, role)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (username, password, fullname, phone or None, email or None, role))
-            
-            connection.commit()
+            """, (username, PasswordHasher.hash(password), fullname, phone or None, email or None, role))
+            return True
+        
+        def done(registered):
+            self.registering = False
+            if not registered:
+                messagebox.showwarning("Ошибка", "Логин уже занят")
+                return
+            ReferenceCache.invalidate('users')
+            AdminApp.invalidate_stats()
             messagebox.showinfo("Успех", "Регистрация успешна! ✅")
             self.destroy()
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка регистрации: {str(e)}")
-        finally:
-            connection.close()
+        
+        def failed(e):
+            self.registering = False
+            show_db_error("Ошибка регистрации", e)
+        
+        # Повторное нажатие, пока идёт регистрация, создало бы вторую попытку с тем же логином
+        if self.registering:
+            return
+        self.registering = True
+        self.tasks.submit(lambda: Database.run(save, commit=True), done, failed)
+
+def show_db_error(message, error):
+    """Сообщение об ошибке фоновой работы с базой; недоступная база - с подсказкой по подключению"""
+    if isinstance(error, DatabaseUnavailableError):
+        Database.show_connection_error(error)
+    elif isinstance(error, ScheduleConflictError):
+        messagebox.showwarning("Конфликт расписания", str(error))
+    else:
+        messagebox.showerror("Ошибка", f"{message}: {str(error)}")
 
 # Стили для Treeview
 def configure_treeview_style():
@@ -1042,13 +3297,148 @@ class MainApp(ctk.CTkToplevel):
     def __init__(self, parent, user):
         super().__init__(parent)
         self.user = user
+        self.tasks = BackgroundTasks(self)
+        self.tab_loaders = {}    # вкладка -> функция загрузки её данных
+        self.tab_loaded_at = {}  # вкладка -> когда данные загружались последний раз
+        self.saving = False      # идёт запись в базу: повторные нажатия "Сохранить" игнорируются
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
+    
+    def select_tab(self, tab_name):
+        # CTkTabview.set() не вызывает command, поэтому уведомляем о переключении сами
+        self.tabview.set(tab_name)
+        self.on_tab_changed()
+    
+    def on_tab_changed(self, tab_name=None):
+        self.ensure_tab_loaded(tab_name or self.tabview.get())
+    
+    def ensure_tab_loaded(self, tab_name):
+        """Загружает данные вкладки при первом открытии или если они устарели"""
+        loader = self.tab_loaders.get(tab_name)
+        if loader is None:
+            return
+        
+        loaded_at = self.tab_loaded_at.get(tab_name)
+        is_stale = (
+            loaded_at is not None
+            and TAB_STALE_AFTER is not None
+            and time.monotonic() - loaded_at > TAB_STALE_AFTER
+        )
+        if loaded_at is None or is_stale:
+            self.tab_loaded_at[tab_name] = time.monotonic()
+            loader()
+        
+    def run_db(self, work, on_done, error_message, commit=False):
+        """Выполняет work(cursor) в фоне и передаёт результат в on_done в потоке Tk.
+        
+        Ошибки показываются как "error_message: текст"; с commit=True изменения фиксируются.
+        Пока запись не завершилась, следующие записи окна не запускаются и возвращается None:
+        двойной щелчок по кнопке не должен добавлять строку дважды.
+        """
+        if not commit:
+            return self.tasks.submit(
+                lambda: Database.run(work),
+                on_done,
+                lambda e: show_db_error(error_message, e)
+            )
+        
+        if self.saving:
+            return None
+        self.saving = True
+        
+        def done(result):
+            self.saving = False
+            on_done(result)
+        
+        def failed(e):
+            self.saving = False
+            show_db_error(error_message, e)
         
+        return self.tasks.submit(lambda: Database.run(work, commit=True), done, failed)
+    
+    def load_combo(self, combo, index_attr, error_message, name, *params):
+        """Заполняет combo справочником name из ReferenceCache и сохраняет его NameIndex в self.<index_attr>"""
+        def show(index):
+            setattr(self, index_attr, index)
+            combo['values'] = index.labels
+        
+        self.tasks.submit(
+            lambda: ReferenceCache.index(name, *params),
+            show,
+            lambda e: show_db_error(error_message, e)
+        )
+    
     def on_closing(self):
+        # Ответы на ещё идущие запросы больше некому показывать
+        self.tasks.cancel_all()
         self.master.deiconify()
         self.destroy()
 
 class StudentApp(MainApp):
+    SCHEDULE_SQL = """
+        SELECT s.schedule_id, s.day_of_week, s.lesson_number, 
+               sub.subject_name, u.full_name, s.room
+        FROM schedule s
+        JOIN subjects sub ON s.subject_id = sub.subject_id
+        JOIN users u ON s.teacher_id = u.user_id
+        WHERE s.class_id IN (
+            SELECT class_id FROM users WHERE user_id = ?
+        )
+        ORDER BY 
+            CASE s.day_of_week
+                WHEN 'Понедельник' THEN 1
+                WHEN 'Вторник' THEN 2
+                WHEN 'Среда' THEN 3
+                WHEN 'Четверг' THEN 4
+                WHEN 'Пятница' THEN 5
+                WHEN 'Суббота' THEN 6
+                ELSE 7
+            END,
+            s.lesson_number
+    """
+    
+    GRADES_SQL = """
+        SELECT g.grade_id, g.grade_date, sub.subject_name, g.grade, 
+               g.lesson_type, u.full_name, g.comment
+        FROM grades g
+        JOIN subjects sub ON g.subject_id = sub.subject_id
+        JOIN users u ON g.teacher_id = u.user_id
+        WHERE g.student_id = ?
+        ORDER BY g.grade_date DESC
+    """
+    
+    HOMEWORK_SQL = """
+        SELECT h.homework_id, h.homework_date, h.due_date, h.description,
+               sub.subject_name, u.full_name
+        FROM homework h
+        JOIN subjects sub ON h.subject_id = sub.subject_id
+        JOIN users u ON h.teacher_id = u.user_id
+        WHERE h.class_id IN (
+            SELECT class_id FROM users WHERE user_id = ?
+        ) AND h.due_date >= GETDATE()
+        ORDER BY h.due_date
+    """
+    
+    ATTENDANCE_SQL = """
+        SELECT attendance_id, attendance_date, status, reason
+        FROM attendance
+        WHERE student_id = ?
+        ORDER BY attendance_date DESC
+    """
+    
+    # Счётчики из сводных таблиц: по строке на предмет и одна строка посещаемости
+    STATS_SQL = """
+        SELECT g.total_grades, g.avg_grade, g.subjects_count,
+               a.present_count, a.total_count as attendance_total
+        FROM (
+            SELECT COALESCE(SUM(grade_count), 0) as total_grades,
+                   SUM(CAST(grade_sum AS FLOAT)) / NULLIF(SUM(grade_count), 0) as avg_grade,
+                   COUNT(*) as subjects_count
+            FROM student_subject_summary
+            WHERE student_id = ? AND grade_count > 0
+        ) g
+        LEFT JOIN student_attendance_summary a ON a.student_id = ?
+    """
+    
     def __init__(self, parent, user):
         super().__init__(parent, user)
         self.title(f"🎒 Ученик: {user['full_name']}")
@@ -1092,7 +3482,7 @@ class StudentApp(MainApp):
             btn = ModernButton(
                 sidebar,
                 text=icon_text,
-                command=lambda tn=tab_name: self.tabview.set(tn),
+                command=lambda tn=tab_name: self.select_tab(tn),
                 fg_color="transparent",
                 hover_color=COLORS['hover'],
                 anchor="w"
@@ -1169,18 +3559,64 @@ class StudentApp(MainApp):
         self.setup_homework_tab()
         self.setup_attendance_tab()
         
-        # Связываем переключение вкладок с обновлением заголовка
+        # Связываем переключение вкладок с обновлением заголовка и загрузкой данных
         self.tabview.configure(command=self.on_tab_changed)
         
-        # Загрузка данных
-        self.load_schedule()
-        self.load_grades()
-        self.load_homework()
-        self.load_attendance()
-        self.load_stats()
+        # Кнопки "Обновить" и устаревшие вкладки перезагружаются по одной
+        self.tab_loaders = {
+            "Расписание": self.load_schedule,
+            "Оценки": self.load_grades,
+            "Домашние задания": self.load_homework,
+            "Посещаемость": self.load_attendance
+        }
+        
+        # Все вкладки и статистика заполняются одним обращением к серверу
+        self.load_dashboard()
+        self.on_tab_changed()
+    
+    def load_dashboard(self):
+        for tree in (self.schedule_tree, self.grades_tree, self.homework_tree, self.attendance_tree):
+            show_loading(tree)
+        self.stats_label.configure(text="Загрузка...")
+        
+        now = time.monotonic()
+        for tab_name in self.tab_loaders:
+            self.tab_loaded_at[tab_name] = now
+        
+        user_id = self.user['user_id']
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_dashboard(cursor, user_id)),
+            self.show_dashboard,
+            self.show_dashboard_error
+        )
+    
+    @staticmethod
+    def fetch_dashboard(cursor, user_id):
+        """Расписание, оценки, задания, посещаемость и статистика ученика за один пакет"""
+        return Database.fetch_result_sets(cursor, [
+            (StudentApp.SCHEDULE_SQL, (user_id,)),
+            (StudentApp.GRADES_SQL, (user_id,)),
+            (StudentApp.HOMEWORK_SQL, (user_id,)),
+            (StudentApp.ATTENDANCE_SQL, (user_id,)),
+            (StudentApp.STATS_SQL, (user_id, user_id))
+        ])
+    
+    def show_dashboard(self, result_sets):
+        schedule, grades, homework, attendance, stats = result_sets
+        self.show_schedule(schedule)
+        self.show_grades(grades)
+        self.show_homework(homework)
+        self.show_attendance(attendance)
+        self.show_stats(stats[0] if stats else None)
     
-    def on_tab_changed(self, tab_name):
+    def show_dashboard_error(self, error):
+        self.stats_label.configure(text="Ошибка загрузки\nстатистики")
+        messagebox.showerror("Ошибка", f"Не удалось загрузить данные ученика: {str(error)}")
+    
+    def on_tab_changed(self, tab_name=None):
+        tab_name = tab_name or self.tabview.get()
         self.current_tab_label.configure(text=tab_name)
+        super().on_tab_changed(tab_name)
     
     def setup_schedule_tab(self):
         tab = self.tabview.tab("Расписание")
@@ -1188,6 +3624,13 @@ class StudentApp(MainApp):
         # Таблица расписания
         columns = ("День недели", "Урок", "Предмет", "Учитель", "Кабинет")
         self.schedule_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview")
+        self.schedule_binding = TreeBinding(self.schedule_tree, 'schedule_id', lambda item: (
+            item['day_of_week'],
+            item['lesson_number'],
+            item['subject_name'],
+            item['full_name'],
+            item['room'] or "---"
+        ))
         
         for col in columns:
             self.schedule_tree.heading(col, text=col)
@@ -1209,57 +3652,35 @@ class StudentApp(MainApp):
         ).pack(pady=10)
     
     def load_schedule(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT s.day_of_week, s.lesson_number, 
-                       sub.subject_name, u.full_name, s.room
-                FROM schedule s
-                JOIN subjects sub ON s.subject_id = sub.subject_id
-                JOIN users u ON s.teacher_id = u.user_id
-                WHERE s.class_id IN (
-                    SELECT class_id FROM users WHERE user_id = ?
-                )
-                ORDER BY 
-                    CASE s.day_of_week
-                        WHEN 'Понедельник' THEN 1
-                        WHEN 'Вторник' THEN 2
-                        WHEN 'Среда' THEN 3
-                        WHEN 'Четверг' THEN 4
-                        WHEN 'Пятница' THEN 5
-                        WHEN 'Суббота' THEN 6
-                        ELSE 7
-                    END,
-                    s.lesson_number
-            """, (self.user['user_id'],))
-            
-            schedule = Database.dict_fetchall(cursor)
-            
-            for item in self.schedule_tree.get_children():
-                self.schedule_tree.delete(item)
-            
-            for item in schedule:
-                self.schedule_tree.insert("", "end", values=(
-                    item['day_of_week'],
-                    item['lesson_number'],
-                    item['subject_name'],
-                    item['full_name'],
-                    item['room'] or "---"
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить расписание: {str(e)}")
-        finally:
-            connection.close()
+        show_loading(self.schedule_tree)
+        user_id = self.user['user_id']
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_schedule(cursor, user_id)),
+            self.show_schedule,
+            lambda e: messagebox.showerror("Ошибка", f"Не удалось загрузить расписание: {str(e)}")
+        )
+    
+    @staticmethod
+    def fetch_schedule(cursor, user_id):
+        cursor.execute(StudentApp.SCHEDULE_SQL, (user_id,))
+        return Database.dict_fetchall(cursor)
+    
+    def show_schedule(self, schedule):
+        self.schedule_binding.sync(schedule)
     
     def setup_grades_tab(self):
         tab = self.tabview.tab("Оценки")
         
         columns = ("Дата", "Предмет", "Оценка", "Тип урока", "Учитель", "Комментарий")
         self.grades_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview")
+        self.grades_binding = TreeBinding(self.grades_tree, 'grade_id', lambda grade: (
+            grade['grade_date'].strftime("%d.%m.%Y"),
+            grade['subject_name'],
+            grade['grade'],
+            grade['lesson_type'] or "урок",
+            grade['full_name'],
+            grade['comment'] or "---"
+        ))
         
         for col in columns:
             self.grades_tree.heading(col, text=col)
@@ -1280,49 +3701,35 @@ class StudentApp(MainApp):
             hover_color=COLORS['secondary']
         ).pack(pady=10)
     
-    def load_grades(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT g.grade_date, sub.subject_name, g.grade, 
-                       g.lesson_type, u.full_name, g.comment
-                FROM grades g
-                JOIN subjects sub ON g.subject_id = sub.subject_id
-                JOIN users u ON g.teacher_id = u.user_id
-                WHERE g.student_id = ?
-                ORDER BY g.grade_date DESC
-            """, (self.user['user_id'],))
-            
-            grades = Database.dict_fetchall(cursor)
-            
-            for item in self.grades_tree.get_children():
-                self.grades_tree.delete(item)
-            
-            for grade in grades:
-                comment = grade['comment'] or "---"
-                lesson_type = grade['lesson_type'] or "урок"
-                self.grades_tree.insert("", "end", values=(
-                    grade['grade_date'].strftime("%d.%m.%Y"),
-                    grade['subject_name'],
-                    grade['grade'],
-                    lesson_type,
-                    grade['full_name'],
-                    comment
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить оценки: {str(e)}")
-        finally:
-            connection.close()
+    def load_grades(self):
+        show_loading(self.grades_tree)
+        user_id = self.user['user_id']
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_grades(cursor, user_id)),
+            self.show_grades,
+            lambda e: messagebox.showerror("Ошибка", f"Не удалось загрузить оценки: {str(e)}")
+        )
+    
+    @staticmethod
+    def fetch_grades(cursor, user_id):
+        cursor.execute(StudentApp.GRADES_SQL, (user_id,))
+        return Database.dict_fetchall(cursor)
+    
+    def show_grades(self, grades):
+        self.grades_binding.sync(grades)
     
     def setup_homework_tab(self):
         tab = self.tabview.tab("Домашние задания")
         
         columns = ("Предмет", "Дата задания", "Срок сдачи", "Задание", "Учитель")
         self.homework_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview")
+        self.homework_binding = TreeBinding(self.homework_tree, 'homework_id', lambda hw: (
+            hw['subject_name'],
+            hw['homework_date'].strftime("%d.%m.%Y"),
+            hw['due_date'].strftime("%d.%m.%Y"),
+            hw['description'][:50] + "..." if len(hw['description']) > 50 else hw['description'],
+            hw['full_name']
+        ))
         
         for col in columns:
             self.homework_tree.heading(col, text=col)
@@ -1344,48 +3751,32 @@ class StudentApp(MainApp):
         ).pack(pady=10)
     
     def load_homework(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT h.homework_date, h.due_date, h.description,
-                       sub.subject_name, u.full_name
-                FROM homework h
-                JOIN subjects sub ON h.subject_id = sub.subject_id
-                JOIN users u ON h.teacher_id = u.user_id
-                WHERE h.class_id IN (
-                    SELECT class_id FROM users WHERE user_id = ?
-                ) AND h.due_date >= GETDATE()
-                ORDER BY h.due_date
-            """, (self.user['user_id'],))
-            
-            homework = Database.dict_fetchall(cursor)
-            
-            for item in self.homework_tree.get_children():
-                self.homework_tree.delete(item)
-            
-            for hw in homework:
-                desc = hw['description'][:50] + "..." if len(hw['description']) > 50 else hw['description']
-                self.homework_tree.insert("", "end", values=(
-                    hw['subject_name'],
-                    hw['homework_date'].strftime("%d.%m.%Y"),
-                    hw['due_date'].strftime("%d.%m.%Y"),
-                    desc,
-                    hw['full_name']
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить задания: {str(e)}")
-        finally:
-            connection.close()
+        show_loading(self.homework_tree)
+        user_id = self.user['user_id']
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_homework(cursor, user_id)),
+            self.show_homework,
+            lambda e: messagebox.showerror("Ошибка", f"Не удалось загрузить задания: {str(e)}")
+        )
+    
+    @staticmethod
+    def fetch_homework(cursor, user_id):
+        cursor.execute(StudentApp.HOMEWORK_SQL, (user_id,))
+        return Database.dict_fetchall(cursor)
+    
+    def show_homework(self, homework):
+        self.homework_binding.sync(homework)
     
     def setup_attendance_tab(self):
         tab = self.tabview.tab("Посещаемость")
         
         columns = ("Дата", "Статус", "Причина")
         self.attendance_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview")
+        self.attendance_binding = TreeBinding(self.attendance_tree, 'attendance_id', lambda att: (
+            att['attendance_date'].strftime("%d.%m.%Y"),
+            att['status'],
+            att['reason'] or "---"
+        ))
         
         for col in columns:
             self.attendance_tree.heading(col, text=col)
@@ -1407,73 +3798,77 @@ class StudentApp(MainApp):
         ).pack(pady=10)
     
     def load_attendance(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT attendance_date, status, reason
-                FROM attendance
-                WHERE student_id = ?
-                ORDER BY attendance_date DESC
-            """, (self.user['user_id'],))
-            
-            attendance = Database.dict_fetchall(cursor)
-            
-            for item in self.attendance_tree.get_children():
-                self.attendance_tree.delete(item)
-            
-            for att in attendance:
-                reason = att['reason'] or "---"
-                self.attendance_tree.insert("", "end", values=(
-                    att['attendance_date'].strftime("%d.%m.%Y"),
-                    att['status'],
-                    reason
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить посещаемость: {str(e)}")
-        finally:
-            connection.close()
+        show_loading(self.attendance_tree)
+        user_id = self.user['user_id']
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_attendance(cursor, user_id)),
+            self.show_attendance,
+            lambda e: messagebox.showerror("Ошибка", f"Не удалось загрузить посещаемость: {str(e)}")
+        )
     
-    def load_stats(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_grades,
-                    AVG(CAST(grade AS FLOAT)) as avg_grade,
-                    COUNT(DISTINCT subject_id) as subjects_count
-                FROM grades 
-                WHERE student_id = ?
-            """, (self.user['user_id'],))
-            
-            stats = Database.dict_fetchone(cursor)
-            
-            if stats and stats['total_grades'] > 0:
-                text = f"📊 Оценок: {stats['total_grades']}\n"
-                text += f"⭐ Средний балл: {stats['avg_grade']:.1f}\n"
-                text += f"📚 Предметов: {stats['subjects_count']}"
-                self.stats_label.configure(text=text)
-            else:
-                self.stats_label.configure(text="📊 Нет оценок\n⭐ Средний балл: -\n📚 Предметов: 0")
-                    
-        except Exception:
-            self.stats_label.configure(text="Ошибка загрузки\nстатистики")
-        finally:
-            connection.close()
+    @staticmethod
+    def fetch_attendance(cursor, user_id):
+        cursor.execute(StudentApp.ATTENDANCE_SQL, (user_id,))
+        return Database.dict_fetchall(cursor)
+    
+    def show_attendance(self, attendance):
+        self.attendance_binding.sync(attendance)
+    
+    @staticmethod
+    def fetch_stats(cursor, user_id):
+        cursor.execute(StudentApp.STATS_SQL, (user_id, user_id))
+        return Database.dict_fetchone(cursor)
+    
+    def show_stats(self, stats):
+        if stats and stats['total_grades'] > 0:
+            text = f"📊 Оценок: {stats['total_grades']}\n"
+            text += f"⭐ Средний балл: {stats['avg_grade']:.1f}\n"
+            text += f"📚 Предметов: {stats['subjects_count']}"
+        else:
+            text = "📊 Нет оценок\n⭐ Средний балл: -\n📚 Предметов: 0"
+        if stats and stats['attendance_total']:
+            text += f"\n✅ Посещаемость: {stats['present_count'] * 100 / stats['attendance_total']:.0f}%"
+        self.stats_label.configure(text=text)
 
 class TeacherApp(MainApp):
+    CLASSES_SQL = """
+        SELECT c.class_id, c.class_name, c.academic_year, 
+               COUNT(u.user_id) as student_count
+        FROM classes c
+        LEFT JOIN users u ON c.class_id = u.class_id AND u.role = 'student'
+        WHERE c.class_teacher_id = ?
+        GROUP BY c.class_id, c.class_name, c.academic_year
+    """
+    
+    CLASS_STUDENTS_SQL = """
+        SELECT user_id, full_name
+        FROM users
+        WHERE class_id = ? AND role = 'student'
+        ORDER BY full_name
+    """
+    
+    STATS_SQL = """
+        SELECT 
+            COUNT(DISTINCT c.class_id) as classes_count,
+            COUNT(DISTINCT s.subject_id) as subjects_count
+        FROM schedule s
+        JOIN classes c ON s.class_id = c.class_id
+        JOIN subjects sub ON s.subject_id = sub.subject_id
+        WHERE s.teacher_id = ?
+    """
+    
     def __init__(self, parent, user):
         super().__init__(parent, user)
         self.title(f"👨‍🏫 Учитель: {user['full_name']}")
         self.geometry("1300x800")
         
+        # Подписи выпадающих списков и их id; заполняются при загрузке вкладок
+        self.class_index = NameIndex()
+        self.subject_index = NameIndex()
+        self.hw_class_index = NameIndex()
+        self.hw_subject_index = NameIndex()
+        self.att_class_index = NameIndex()
+        
         configure_treeview_style()
         self.setup_ui()
         
@@ -1508,7 +3903,7 @@ class TeacherApp(MainApp):
             ModernButton(
                 sidebar,
                 text=icon_text,
-                command=lambda tn=tab_name: self.tabview.set(tn),
+                command=lambda tn=tab_name: self.select_tab(tn),
                 fg_color="transparent",
                 hover_color=COLORS['hover'],
                 anchor="w"
@@ -1568,8 +3963,18 @@ class TeacherApp(MainApp):
         self.setup_teacher_homework_tab()
         self.setup_teacher_attendance_tab()
         
+        # Данные вкладки грузятся при её первом открытии
+        self.tab_loaders = {
+            "Мои классы": self.load_classes,
+            "Выставить оценку": lambda: (self.load_classes_for_teacher(), self.load_subjects()),
+            "Домашние задания": lambda: (self.load_hw_classes(), self.load_hw_subjects()),
+            "Посещаемость": self.load_att_classes
+        }
+        self.tabview.configure(command=self.on_tab_changed)
+        
         # Загрузка статистики
         self.load_teacher_stats()
+        self.on_tab_changed()
     
     def setup_classes_tab(self):
         tab = self.tabview.tab("Мои классы")
@@ -1577,6 +3982,11 @@ class TeacherApp(MainApp):
         # Таблица классов
         columns = ("Класс", "Учебный год", "Количество учеников")
         self.classes_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview")
+        self.classes_binding = TreeBinding(self.classes_tree, 'class_id', lambda cls: (
+            cls['class_name'],
+            cls['academic_year'] or "---",
+            cls['student_count']
+        ))
         
         for col in columns:
             self.classes_tree.heading(col, text=col)
@@ -1596,40 +4006,20 @@ class TeacherApp(MainApp):
             fg_color=COLORS['primary'],
             hover_color=COLORS['secondary']
         ).pack(pady=10)
-        
-        self.load_classes()
     
     def load_classes(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT c.class_name, c.academic_year, 
-                       COUNT(u.user_id) as student_count
-                FROM classes c
-                LEFT JOIN users u ON c.class_id = u.class_id AND u.role = 'student'
-                WHERE c.class_teacher_id = ?
-                GROUP BY c.class_id, c.class_name, c.academic_year
-            """, (self.user['user_id'],))
-            
-            classes = Database.dict_fetchall(cursor)
-            
-            for item in self.classes_tree.get_children():
-                self.classes_tree.delete(item)
-            
-            for cls in classes:
-                self.classes_tree.insert("", "end", values=(
-                    cls['class_name'],
-                    cls['academic_year'] or "---",
-                    cls['student_count']
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить классы: {str(e)}")
-        finally:
-            connection.close()
+        show_loading(self.classes_tree)
+        user_id = self.user['user_id']
+        self.run_db(
+            lambda cursor: self.fetch_classes(cursor, user_id),
+            self.classes_binding.sync,
+            "Не удалось загрузить классы"
+        )
+    
+    @staticmethod
+    def fetch_classes(cursor, teacher_id):
+        cursor.execute(TeacherApp.CLASSES_SQL, (teacher_id,))
+        return Database.dict_fetchall(cursor)
     
     def setup_give_grade_tab(self):
         tab = self.tabview.tab("Выставить оценку")
@@ -1738,92 +4128,41 @@ class TeacherApp(MainApp):
             fg_color=COLORS['success'],
             hover_color=COLORS['info']
         ).pack()
-        
-        self.load_classes_for_teacher()
-        self.load_subjects()
     
     def load_classes_for_teacher(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT DISTINCT c.class_name
-                FROM schedule s
-                JOIN classes c ON s.class_id = c.class_id
-                WHERE s.teacher_id = ?
-            """, (self.user['user_id'],))
-            
-            classes = Database.dict_fetchall(cursor)
-            class_names = [cls['class_name'] for cls in classes]
-            self.class_combo['values'] = class_names
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки классов: {str(e)}")
-        finally:
-            connection.close()
+        self.load_combo(self.class_combo, 'class_index', "Ошибка загрузки классов", 'teacher_classes', self.user['user_id'])
     
     def load_subjects(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT DISTINCT s.subject_name
-                FROM schedule sch
-                JOIN subjects s ON sch.subject_id = s.subject_id
-                WHERE sch.teacher_id = ?
-            """, (self.user['user_id'],))
-            
-            subjects = Database.dict_fetchall(cursor)
-            subject_names = [sub['subject_name'] for sub in subjects]
-            self.subject_combo['values'] = subject_names
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки предметов: {str(e)}")
-        finally:
-            connection.close()
+        self.load_combo(self.subject_combo, 'subject_index', "Ошибка загрузки предметов", 'teacher_subjects', self.user['user_id'])
     
     def on_class_selected(self, event):
-        class_name = self.class_combo.get()
-        if not class_name:
+        class_id = self.class_index.id_of(self.class_combo.get())
+        if class_id is None:
             return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT u.user_id, u.full_name
-                FROM users u
-                JOIN classes c ON u.class_id = c.class_id
-                WHERE c.class_name = ? AND u.role = 'student'
-                ORDER BY u.full_name
-            """, (class_name,))
-            
-            students = Database.dict_fetchall(cursor)
-            student_names = [f"{stud['full_name']} (ID: {stud['user_id']})" for stud in students]
-            self.student_combo['values'] = student_names
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки учеников: {str(e)}")
-        finally:
-            connection.close()
+        self.run_db(
+            lambda cursor: self.fetch_class_students(cursor, class_id),
+            self.show_grade_students,
+            "Ошибка загрузки учеников"
+        )
+    
+    @staticmethod
+    def fetch_class_students(cursor, class_id):
+        cursor.execute(TeacherApp.CLASS_STUDENTS_SQL, (class_id,))
+        return Database.dict_fetchall(cursor)
+    
+    def show_grade_students(self, students):
+        student_names = [f"{stud['full_name']} (ID: {stud['user_id']})" for stud in students]
+        self.student_combo['values'] = student_names
     
     def add_grade(self):
         student_text = self.student_combo.get()
-        subject_name = self.subject_combo.get()
+        subject_id = self.subject_index.id_of(self.subject_combo.get())
         grade = self.grade_var.get()
         lesson_type = self.lesson_type_combo.get()
         comment = self.comment_text.get("1.0", "end-1c").strip()
         
-        if not student_text or not subject_name:
+        if not student_text or subject_id is None:
             messagebox.showwarning("Ошибка", "Выберите ученика и предмет")
             return
         
@@ -1833,36 +4172,17 @@ class TeacherApp(MainApp):
             messagebox.showerror("Ошибка", "Некорректный формат ученика")
             return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT subject_id FROM subjects WHERE subject_name = ?", (subject_name,))
-            subject = Database.dict_fetchone(cursor)
-            
-            if not subject:
-                messagebox.showerror("Ошибка", "Предмет не найден")
-                return
-            
-            cursor.execute("""
-                INSERT INTO grades (student_id, subject_id, teacher_id, grade, 
-                                   grade_date, lesson_type, comment)
-                VALUES (?, ?, ?, ?, GETDATE(), ?, ?)
-            """, (student_id, subject['subject_id'], self.user['user_id'], 
-                  grade, lesson_type, comment or None))
-            
-            connection.commit()
+        params = (student_id, subject_id, self.user['user_id'], grade, date.today(), lesson_type, comment or None)
+        
+        def done(_):
+            AdminApp.invalidate_stats()
             messagebox.showinfo("Успех", f"✅ Оценка {grade} выставлена ученику!")
             
             self.comment_text.delete("1.0", "end")
             self.grade_var.set(5)
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при выставлении оценки: {str(e)}")
-        finally:
-            connection.close()
+        
+        self.run_db(lambda cursor: Summaries.add_grade(cursor, *params),
+                    done, "Ошибка при выставлении оценки", commit=True)
     
     def setup_teacher_homework_tab(self):
         tab = self.tabview.tab("Домашние задания")
@@ -1932,49 +4252,12 @@ class TeacherApp(MainApp):
             fg_color=COLORS['success'],
             hover_color=COLORS['info']
         ).pack()
-        
-        self.load_hw_classes()
-        self.load_hw_subjects()
     
     def load_hw_classes(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT DISTINCT c.class_name
-                FROM schedule s
-                JOIN classes c ON s.class_id = c.class_id
-                WHERE s.teacher_id = ?
-            """, (self.user['user_id'],))
-            
-            classes = Database.dict_fetchall(cursor)
-            class_names = [cls['class_name'] for cls in classes]
-            self.hw_class_combo['values'] = class_names
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки классов: {str(e)}")
-        finally:
-            connection.close()
+        self.load_combo(self.hw_class_combo, 'hw_class_index', "Ошибка загрузки классов", 'teacher_classes', self.user['user_id'])
     
     def load_hw_subjects(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT subject_name FROM subjects")
-            subjects = Database.dict_fetchall(cursor)
-            subject_names = [sub['subject_name'] for sub in subjects]
-            self.hw_subject_combo['values'] = subject_names
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки предметов: {str(e)}")
-        finally:
-            connection.close()
+        self.load_combo(self.hw_subject_combo, 'hw_subject_index', "Ошибка загрузки предметов", 'subjects')
     
     def add_homework(self):
         class_name = self.hw_class_combo.get()
@@ -1986,45 +4269,32 @@ class TeacherApp(MainApp):
             messagebox.showwarning("Ошибка", "Заполните все поля")
             return
         
+        class_id = self.hw_class_index.id_of(class_name)
+        subject_id = self.hw_subject_index.id_of(subject_name)
+        if class_id is None or subject_id is None:
+            messagebox.showerror("Ошибка", "Класс или предмет не найдены")
+            return
+        
         try:
             datetime.strptime(due_date, "%Y-%m-%d")
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректный формат даты. Используйте ГГГГ-ММ-ДД")
             return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT class_id FROM classes WHERE class_name = ?", (class_name,))
-            class_data = Database.dict_fetchone(cursor)
-            
-            cursor.execute("SELECT subject_id FROM subjects WHERE subject_name = ?", (subject_name,))
-            subject_data = Database.dict_fetchone(cursor)
-            
-            if not class_data or not subject_data:
-                messagebox.showerror("Ошибка", "Класс или предмет не найдены")
-                return
-            
-            cursor.execute("""
-                INSERT INTO homework (teacher_id, class_id, subject_id, 
-                                    homework_date, due_date, description)
-                VALUES (?, ?, ?, GETDATE(), ?, ?)
-            """, (self.user['user_id'], class_data['class_id'], 
-                  subject_data['subject_id'], due_date, description))
-            
-            connection.commit()
+        params = (self.user['user_id'], class_id, subject_id, due_date, description)
+        
+        def done(_):
+            AdminApp.invalidate_stats()
             messagebox.showinfo("Успех", "✅ Домашнее задание добавлено!")
             
             self.hw_description_text.delete("1.0", "end")
             self.hw_due_date_entry.delete(0, "end")
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при добавлении задания: {str(e)}")
-        finally:
-            connection.close()
+        
+        self.run_db(lambda cursor: cursor.execute("""
+            INSERT INTO homework (teacher_id, class_id, subject_id, 
+                                homework_date, due_date, description)
+            VALUES (?, ?, ?, GETDATE(), ?, ?)
+        """, params), done, "Ошибка при добавлении задания", commit=True)
     
     def setup_teacher_attendance_tab(self):
         tab = self.tabview.tab("Посещаемость")
@@ -2111,65 +4381,29 @@ class TeacherApp(MainApp):
         
         self.attendance_mark_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
-        
-        self.load_att_classes()
     
     def load_att_classes(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT DISTINCT c.class_name
-                FROM schedule s
-                JOIN classes c ON s.class_id = c.class_id
-                WHERE s.teacher_id = ?
-            """, (self.user['user_id'],))
-            
-            classes = Database.dict_fetchall(cursor)
-            class_names = [cls['class_name'] for cls in classes]
-            self.att_class_combo['values'] = class_names
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки классов: {str(e)}")
-        finally:
-            connection.close()
+        self.load_combo(self.att_class_combo, 'att_class_index', "Ошибка загрузки классов", 'teacher_classes', self.user['user_id'])
     
     def on_att_class_selected(self, event):
-        class_name = self.att_class_combo.get()
-        if not class_name:
+        class_id = self.att_class_index.id_of(self.att_class_combo.get())
+        if class_id is None:
             return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT u.user_id, u.full_name
-                FROM users u
-                JOIN classes c ON u.class_id = c.class_id
-                WHERE c.class_name = ? AND u.role = 'student'
-                ORDER BY u.full_name
-            """, (class_name,))
-            
-            students = Database.dict_fetchall(cursor)
-            
-            for item in self.attendance_mark_tree.get_children():
-                self.attendance_mark_tree.delete(item)
-            
-            for student in students:
-                self.attendance_mark_tree.insert("", "end", 
-                    values=(student['full_name'], "присутствовал", ""),
-                    tags=(student['user_id'],))
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки учеников: {str(e)}")
-        finally:
-            connection.close()
+        self.run_db(
+            lambda cursor: self.fetch_class_students(cursor, class_id),
+            self.show_attendance_students,
+            "Ошибка загрузки учеников"
+        )
+    
+    def show_attendance_students(self, students):
+        for item in self.attendance_mark_tree.get_children():
+            self.attendance_mark_tree.delete(item)
+        
+        for student in students:
+            self.attendance_mark_tree.insert("", "end", 
+                values=(student['full_name'], "присутствовал", ""),
+                tags=(student['user_id'],))
     
     def mark_all_attendance(self, status):
         for item in self.attendance_mark_tree.get_children():
@@ -2188,100 +4422,104 @@ class TeacherApp(MainApp):
             messagebox.showwarning("Ошибка", "Выберите класс и дату")
             return
         
+        class_id = self.att_class_index.id_of(class_name)
+        if class_id is None:
+            messagebox.showerror("Ошибка", "Класс не найден")
+            return
+        
         try:
             attendance_date = datetime.strptime(date_str, "%Y-%m-%d")
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректный формат даты. Используйте ГГГГ-ММ-ДД")
             return
         
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT class_id FROM classes WHERE class_name = ?", (class_name,))
-            class_data = Database.dict_fetchone(cursor)
-            
-            if not class_data:
-                messagebox.showerror("Ошибка", "Класс не найден")
-                return
-            
-            for item in self.attendance_mark_tree.get_children():
-                values = self.attendance_mark_tree.item(item)['values']
-                tags = self.attendance_mark_tree.item(item)['tags']
-                
-                if len(tags) > 0:
-                    student_id = tags[0]
-                    status = values[1]
-                    reason = values[2] or None
-                    
-                    cursor.execute("""
-                        SELECT * FROM attendance 
-                        WHERE student_id = ? AND attendance_date = ?
-                    """, (student_id, attendance_date.date()))
-                    
-                    existing = Database.dict_fetchone(cursor)
-                    
-                    if existing:
-                        cursor.execute("""
-                            UPDATE attendance 
-                            SET status = ?, reason = ?
-                            WHERE attendance_id = ?
-                        """, (status, reason, existing['attendance_id']))
-                    else:
-                        cursor.execute("""
-                            INSERT INTO attendance (student_id, class_id, 
-                                                  attendance_date, status, reason)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (student_id, class_data['class_id'], 
-                              attendance_date.date(), status, reason))
+        # Отметки читаются из таблицы здесь, в потоке Tk; в фон уходят только данные
+        rows = []
+        for item in self.attendance_mark_tree.get_children():
+            values = self.attendance_mark_tree.item(item)['values']
+            tags = self.attendance_mark_tree.item(item)['tags']
             
-            connection.commit()
+            if len(tags) > 0:
+                rows.append((int(tags[0]), values[1], values[2] or None))
+        
+        def save(cursor):
+            # Весь класс одним пакетом: число обращений к серверу не зависит от числа учеников
+            if rows:
+                Summaries.save_attendance(cursor, class_id, attendance_date.date(), rows)
+        
+        def done(_):
+            AdminApp.invalidate_stats()
             messagebox.showinfo("Успех", "✅ Посещаемость сохранена!")
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении посещаемости: {str(e)}")
-        finally:
-            connection.close()
+        
+        self.run_db(save, done, "Ошибка при сохранении посещаемости", commit=True)
     
     def load_teacher_stats(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT 
-                    COUNT(DISTINCT c.class_id) as classes_count,
-                    COUNT(DISTINCT s.subject_id) as subjects_count
-                FROM schedule s
-                JOIN classes c ON s.class_id = c.class_id
-                JOIN subjects sub ON s.subject_id = sub.subject_id
-                WHERE s.teacher_id = ?
-            """, (self.user['user_id'],))
-            
-            stats = Database.dict_fetchone(cursor)
-            
-            if stats:
-                text = f"🏫 Классов: {stats['classes_count']}\n"
-                text += f"📚 Предметов: {stats['subjects_count']}"
-                self.teacher_stats_label.configure(text=text)
-            else:
-                self.teacher_stats_label.configure(text="Нет данных")
-                    
-        except Exception:
-            self.teacher_stats_label.configure(text="Ошибка загрузки")
-        finally:
-            connection.close()
+        user_id = self.user['user_id']
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_teacher_stats(cursor, user_id)),
+            self.show_teacher_stats,
+            lambda e: self.teacher_stats_label.configure(text="Ошибка загрузки")
+        )
+    
+    @staticmethod
+    def fetch_teacher_stats(cursor, teacher_id):
+        cursor.execute(TeacherApp.STATS_SQL, (teacher_id,))
+        return Database.dict_fetchone(cursor)
+    
+    def show_teacher_stats(self, stats):
+        if stats:
+            text = f"🏫 Классов: {stats['classes_count']}\n"
+            text += f"📚 Предметов: {stats['subjects_count']}"
+            self.teacher_stats_label.configure(text=text)
+        else:
+            self.teacher_stats_label.configure(text="Нет данных")
 
 class AdminApp(MainApp):
+    # Все показатели вкладки «Статистика» за один запрос: каждая таблица читается один раз,
+    # посещаемость и задания - только за неделю по индексам на дату
+    STATS_SQL = """
+        SELECT u.admins, u.teachers, u.students, u.blocked_count,
+               c.classes_count, sub.subjects_count, g.avg_grade,
+               a.attendance_present, a.attendance_total, h.homework_count
+        FROM (
+            SELECT SUM(CASE WHEN role = 'admin' THEN 1 ELSE 0 END) as admins,
+                   SUM(CASE WHEN role = 'teacher' THEN 1 ELSE 0 END) as teachers,
+                   SUM(CASE WHEN role = 'student' THEN 1 ELSE 0 END) as students,
+                   SUM(CASE WHEN is_blocked = 1 THEN 1 ELSE 0 END) as blocked_count
+            FROM users
+        ) u
+        CROSS JOIN (SELECT COUNT(*) as classes_count FROM classes) c
+        CROSS JOIN (SELECT COUNT(*) as subjects_count FROM subjects) sub
+        CROSS JOIN (
+            SELECT SUM(grade_sum) * 1.0 / NULLIF(SUM(grade_count), 0) as avg_grade
+            FROM student_subject_summary
+        ) g
+        CROSS JOIN (
+            SELECT SUM(CASE WHEN status = 'присутствовал' THEN 1 ELSE 0 END) as attendance_present,
+                   COUNT(*) as attendance_total
+            FROM attendance
+            WHERE attendance_date >= DATEADD(DAY, -7, GETDATE())
+        ) a
+        CROSS JOIN (
+            SELECT COUNT(*) as homework_count
+            FROM homework
+            WHERE due_date >= GETDATE() 
+            AND due_date < DATEADD(DAY, 7, GETDATE())
+        ) h
+    """
+    
+    _stats_cache = None   # (время загрузки, показатели) - общий для всех окон администратора
+    _stats_version = 0    # растёт при сбросе: загрузка, начатая до сброса, не попадает в кэш
+    _stats_lock = threading.Lock()
+    
     def __init__(self, parent, user):
         super().__init__(parent, user)
         self.title(f"⚙️ Администратор: {user['full_name']}")
         self.geometry("1400x800")
         
+        # Номер последней загрузки каждого списка: ответ на устаревший поиск не затирает свежий
+        self.list_generations = {}
+        
         configure_treeview_style()
         self.setup_ui()
         
@@ -2317,7 +4555,7 @@ class AdminApp(MainApp):
             ModernButton(
                 sidebar,
                 text=icon_text,
-                command=lambda tn=tab_name: self.tabview.set(tn),
+                command=lambda tn=tab_name: self.select_tab(tn),
                 fg_color="transparent",
                 hover_color=COLORS['hover'],
                 anchor="w"
@@ -2376,6 +4614,17 @@ class AdminApp(MainApp):
         self.setup_subjects_tab()
         self.setup_schedule_tab()
         self.setup_stats_tab()
+        
+        # Данные вкладки грузятся при её первом открытии
+        self.tab_loaders = {
+            "Пользователи": self.load_users,
+            "Классы": self.load_classes_admin,
+            "Предметы": self.load_subjects_admin,
+            "Расписание": self.load_schedule_admin,
+            "Статистика": self.load_stats
+        }
+        self.tabview.configure(command=self.on_tab_changed)
+        self.on_tab_changed()
     
     def setup_users_tab(self):
         tab = self.tabview.tab("Пользователи")
@@ -2403,67 +4652,162 @@ class AdminApp(MainApp):
                 width=120
             ).pack(side="left", padx=2)
         
+        # Поиск и фильтры
+        self.users_search = SearchBar(tab, "🔍 Логин или ФИО", lambda: self.load_users(USERS_PAGE_SIZE), choices={
+            'role': [("Все роли", None), ("Админ", 'admin'), ("Учитель", 'teacher'), ("Ученик", 'student')],
+            'blocked': [("Любой статус", None), ("✅ Активные", 0), ("🔒 Заблокированные", 1)]
+        })
+        self.users_search.pack(pady=(0, 5))
+        
         # Таблица пользователей
         columns = ("ID", "Логин", "ФИО", "Роль", "Телефон", "Email", "Статус")
         self.users_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview", height=25)
+        self.users_binding = TreeBinding(self.users_tree, 'user_id', lambda user: (
+            user['user_id'],
+            user['username'],
+            user['full_name'],
+            {
+                'admin': 'Админ',
+                'teacher': 'Учитель',
+                'student': 'Ученик'
+            }.get(user['role'], user['role']),
+            user['phone'] or "---",
+            user['email'] or "---",
+            "🔒 Заблокирован" if user['is_blocked'] else "✅ Активен"
+        ))
         
         column_widths = [50, 100, 200, 80, 120, 150, 100]
         for i, col in enumerate(columns):
             self.users_tree.heading(col, text=col)
             self.users_tree.column(col, width=column_widths[i])
         
-        scrollbar = ttk.Scrollbar(tab, orient="vertical", command=self.users_tree.yview)
-        self.users_tree.configure(yscrollcommand=scrollbar.set)
+        self.users_scrollbar = scrollbar = ttk.Scrollbar(tab, orient="vertical", command=self.users_tree.yview)
+        self.users_tree.configure(yscrollcommand=self.on_users_scroll)
+        
+        # Состояние постраничной загрузки
+        self.users_last_key = None     # (role_rank, full_name, user_id) последней загруженной строки
+        self.users_has_more = False
+        self.users_loading = False
+        self.users_filters = self.users_search.filters()
+        self.users_generation = 0      # растёт при полной перезагрузке, старые ответы отбрасываются
         
         self.users_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
-        
-        self.load_users()
     
-    def load_users(self):
-        connection = Database.get_connection()
-        if connection is None:
+    # Порядок ролей в списке пользователей; остальные роли идут последними
+    USER_ROLE_ORDER = ['admin', 'teacher', 'student']
+    
+    def load_users(self, limit=None):
+        """Перезагружает список с начала; по умолчанию столько строк, сколько уже было подгружено"""
+        show_loading(self.users_tree)
+        if limit is None:
+            limit = max(USERS_PAGE_SIZE, len(self.users_binding.values))
+        self.users_generation += 1
+        self.users_filters = self.users_search.filters()
+        self.fetch_users_in_background(None, limit, reset=True)
+    
+    def load_more_users(self):
+        if self.users_loading or not self.users_has_more:
             return
+        self.fetch_users_in_background(self.users_last_key, USERS_PAGE_SIZE, reset=False)
+    
+    def fetch_users_in_background(self, after, limit, reset):
+        self.users_loading = True
+        generation = self.users_generation
+        filters = self.users_filters
+        self.tasks.submit(
+            lambda: Database.run(lambda cursor: self.fetch_users_page(cursor, after, limit, filters)),
+            lambda users: self.show_users(users, limit, reset, generation),
+            lambda e: self.show_users_error(e, generation)
+        )
+    
+    @staticmethod
+    def fetch_users_page(cursor, after, limit, filters=None):
+        """До limit пользователей, идущих после ключа after = (role_rank, full_name, user_id).
+        
+        Каждая роль читается отдельным запросом по индексу (role, full_name, user_id),
+        поэтому страница стоит одинаково и в начале, и в конце большого списка.
+        filters: {'text': начало логина или ФИО, 'role': роль, 'blocked': 0/1}, None - без фильтра.
+        """
+        filters = filters or {}
+        start_rank, last_name, last_id = after or (0, None, None)
+        roles = AdminApp.USER_ROLE_ORDER
+        columns = "user_id, username, full_name, role, phone, email, is_blocked"
+        users = []
+        
+        ranks = range(start_rank, len(roles) + 1)
+        if filters.get('role') is not None:
+            ranks = [rank for rank in ranks if rank < len(roles) and roles[rank] == filters['role']]
+        
+        # Поиск по началу ФИО или логина: два поиска по индексам вместо просмотра всей таблицы
+        source, source_params = "users", []
+        if filters.get('text'):
+            pattern = Database.like_prefix(filters['text'])
+            source = f"""(
+                SELECT {columns} FROM users WHERE full_name LIKE ? ESCAPE '\\'
+                UNION
+                SELECT {columns} FROM users WHERE username LIKE ? ESCAPE '\\'
+            ) AS found"""
+            source_params = [pattern, pattern]
+        
+        for role_rank in ranks:
+            if role_rank < len(roles):
+                conditions, params = ["role = ?"], [roles[role_rank]]
+            else:
+                conditions, params = [f"role NOT IN ({', '.join('?' * len(roles))})"], list(roles)
             
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT * FROM users 
-                ORDER BY 
-                    CASE role
-                        WHEN 'admin' THEN 1
-                        WHEN 'teacher' THEN 2
-                        WHEN 'student' THEN 3
-                        ELSE 4
-                    END,
-                    full_name
-            """)
-            users = Database.dict_fetchall(cursor)
-            
-            for item in self.users_tree.get_children():
-                self.users_tree.delete(item)
-            
-            for user in users:
-                status = "🔒 Заблокирован" if user['is_blocked'] else "✅ Активен"
-                role_rus = {
-                    'admin': 'Админ',
-                    'teacher': 'Учитель',
-                    'student': 'Ученик'
-                }.get(user['role'], user['role'])
-                
-                self.users_tree.insert("", "end", values=(
-                    user['user_id'],
-                    user['username'],
-                    user['full_name'],
-                    role_rus,
-                    user['phone'] or "---",
-                    user['email'] or "---",
-                    status
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки: {str(e)}")
-        finally:
-            connection.close()
+            if filters.get('blocked') is not None:
+                conditions.append("is_blocked = ?")
+                params.append(filters['blocked'])
+            
+            if role_rank == start_rank and last_name is not None:
+                conditions.append("(full_name > ? OR (full_name = ? AND user_id > ?))")
+                params += [last_name, last_name, last_id]
+            
+            cursor.execute(f"""
+                SELECT {columns}
+                FROM {source}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY full_name, user_id
+                OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
+            """, tuple(source_params + params) + (limit - len(users),))
+            
+            for user in Database.dict_fetchall(cursor):
+                user['role_rank'] = role_rank
+                users.append(user)
+            
+            if len(users) >= limit:
+                break
+        
+        return users
+    
+    def show_users(self, users, limit, reset, generation):
+        if generation != self.users_generation:
+            return
+        
+        self.users_loading = False
+        if reset:
+            self.users_binding.sync(users)
+        else:
+            self.users_binding.append(users)
+        
+        self.users_has_more = len(users) == limit
+        if users:
+            last = users[-1]
+            self.users_last_key = (last['role_rank'], last['full_name'], last['user_id'])
+        elif reset:
+            self.users_last_key = None
+    
+    def show_users_error(self, error, generation):
+        if generation == self.users_generation:
+            self.users_loading = False
+        messagebox.showerror("Ошибка", f"Ошибка загрузки: {str(error)}")
+    
+    def on_users_scroll(self, first, last):
+        self.users_scrollbar.set(first, last)
+        # Подгружаем следующую страницу, когда до конца списка осталось меньше десятой части
+        if float(last) > 0.9:
+            self.load_more_users()
     
     def add_user(self):
         RegistrationWindow(self)
@@ -2476,25 +4820,21 @@ class AdminApp(MainApp):
         
         user_data = self.users_tree.item(selected[0])['values']
         
-        # Получаем оригинальные данные из базы для правильного отображения роли
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
+        def fetch(cursor):
             cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_data[0],))
-            original_user = Database.dict_fetchone(cursor)
-            
-            if not original_user:
-                messagebox.showerror("Ошибка", "Пользователь не найден")
-                return
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки данных: {str(e)}")
+            return Database.dict_fetchone(cursor)
+        
+        # Получаем оригинальные данные из базы для правильного отображения роли
+        self.run_db(
+            fetch,
+            lambda original_user: self.show_edit_user_dialog(user_data, original_user),
+            "Ошибка загрузки данных"
+        )
+    
+    def show_edit_user_dialog(self, user_data, original_user):
+        if not original_user:
+            messagebox.showerror("Ошибка", "Пользователь не найден")
             return
-        finally:
-            connection.close()
         
         dialog = ctk.CTkToplevel(self)
         dialog.title("✏️ Редактирование пользователя")
@@ -2650,19 +4990,15 @@ class AdminApp(MainApp):
                 messagebox.showwarning("Ошибка", "Заполните обязательные поля")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
+                # Хеширование пароля тоже выполняется в фоне, вместе с запросом
                 if password:
                     cursor.execute("""
                         UPDATE users 
                         SET username = ?, password = ?, full_name = ?, 
                             role = ?, phone = ?, email = ?
                         WHERE user_id = ?
-                    """, (username, password, fullname, role, phone or None, email or None, user_data[0]))
+                    """, (username, PasswordHasher.hash(password), fullname, role, phone or None, email or None, user_data[0]))
                 else:
                     cursor.execute("""
                         UPDATE users 
@@ -2670,16 +5006,15 @@ class AdminApp(MainApp):
                             role = ?, phone = ?, email = ?
                         WHERE user_id = ?
                     """, (username, fullname, role, phone or None, email or None, user_data[0]))
-                
-                connection.commit()
+            
+            def done(_):
+                ReferenceCache.invalidate('users')
+                AdminApp.invalidate_stats()
                 messagebox.showinfo("Успех", "✅ Данные пользователя обновлены!")
                 self.load_users()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка обновления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка обновления", commit=True)
         
         ModernButton(
             button_frame,
@@ -2712,26 +5047,21 @@ class AdminApp(MainApp):
             return
         
         if messagebox.askyesno("Подтверждение", f"Заблокировать пользователя {user_data[2]}?"):
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
-                cursor.execute("""
+            def done(_):
+                AdminApp.invalidate_stats()
+                messagebox.showinfo("Успех", "✅ Пользователь заблокирован!")
+                self.load_users()
+            
+            self.run_db(
+                lambda cursor: cursor.execute("""
                     UPDATE users 
                     SET is_blocked = 1 
                     WHERE user_id = ?
-                """, (user_data[0],))
-                
-                connection.commit()
-                messagebox.showinfo("Успех", "✅ Пользователь заблокирован!")
-                self.load_users()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка блокировки: {str(e)}")
-            finally:
-                connection.close()
+                """, (user_data[0],)),
+                done,
+                "Ошибка блокировки",
+                commit=True
+            )
     
     def unblock_user(self):
         selected = self.users_tree.selection()
@@ -2746,26 +5076,21 @@ class AdminApp(MainApp):
             return
         
         if messagebox.askyesno("Подтверждение", f"Разблокировать пользователя {user_data[2]}?"):
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
-                cursor.execute("""
+            def done(_):
+                AdminApp.invalidate_stats()
+                messagebox.showinfo("Успех", "✅ Пользователь разблокирован!")
+                self.load_users()
+            
+            self.run_db(
+                lambda cursor: cursor.execute("""
                     UPDATE users 
                     SET is_blocked = 0, failed_attempts = 0 
                     WHERE user_id = ?
-                """, (user_data[0],))
-                
-                connection.commit()
-                messagebox.showinfo("Успех", "✅ Пользователь разблокирован!")
-                self.load_users()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка: {str(e)}")
-            finally:
-                connection.close()
+                """, (user_data[0],)),
+                done,
+                "Ошибка",
+                commit=True
+            )
     
     def delete_user(self):
         selected = self.users_tree.selection()
@@ -2776,22 +5101,24 @@ class AdminApp(MainApp):
         user_data = self.users_tree.item(selected[0])['values']
         
         if messagebox.askyesno("Подтверждение", f"Удалить пользователя {user_data[2]}?"):
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
-                cursor.execute("DELETE FROM users WHERE user_id = ?", (user_data[0],))
-                
-                connection.commit()
+            def done(deleted):
+                if not deleted:
+                    messagebox.showwarning("Внимание", "У пользователя есть оценки или посещаемость.\n"
+                                                       "Чтобы закрыть доступ, заблокируйте его")
+                    return
+                ReferenceCache.invalidate('users')
+                AdminApp.invalidate_stats()
+                ScheduleOccupancy.reset()
                 messagebox.showinfo("Успех", "✅ Пользователь удален!")
                 self.load_users()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка удаления: {str(e)}")
-            finally:
-                connection.close()
+            
+            def save(cursor):
+                if Summaries.has_history(cursor, student_id=user_data[0]):
+                    return False
+                cursor.execute("DELETE FROM users WHERE user_id = ?", (user_data[0],))
+                return True
+            
+            self.run_db(save, done, "Ошибка удаления", commit=True)
     
     def setup_classes_tab(self):
         tab = self.tabview.tab("Классы")
@@ -2817,9 +5144,21 @@ class AdminApp(MainApp):
                 width=120
             ).pack(side="left", padx=2)
         
+        # Поиск
+        self.classes_search = SearchBar(tab, "🔍 Класс или классный руководитель", self.load_classes_admin)
+        self.classes_search.pack(pady=(0, 5))
+        
         # Таблица классов
         columns = ("ID", "Класс", "Год обучения", "Учебный год", "Классный руководитель", "Учеников")
         self.classes_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview", height=25)
+        self.classes_binding = TreeBinding(self.classes_tree, 'class_id', lambda cls: (
+            cls['class_id'],
+            cls['class_name'],
+            cls['grade'],
+            cls['academic_year'] or "---",
+            cls['teacher_name'] or "---",
+            cls['student_count']
+        ))
         
         column_widths = [50, 80, 100, 100, 200, 80]
         for i, col in enumerate(columns):
@@ -2831,44 +5170,45 @@ class AdminApp(MainApp):
         
         self.classes_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
+    
+    def load_latest(self, list_name, work, binding):
+        """Загружает список в фоне и показывает результат, только если новее загрузок не было.
+        
+        Запросы идут в нескольких потоках, и при быстром вводе в поиск ответ на
+        старый текст может прийти позже ответа на новый.
+        """
+        generation = self.list_generations.get(list_name, 0) + 1
+        self.list_generations[list_name] = generation
         
-        self.load_classes_admin()
+        def show(rows):
+            if self.list_generations[list_name] == generation:
+                binding.sync(rows)
+        
+        self.run_db(work, show, "Ошибка загрузки")
     
     def load_classes_admin(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT c.*, u.full_name as teacher_name,
-                       COUNT(st.user_id) as student_count
-                FROM classes c
-                LEFT JOIN users u ON c.class_teacher_id = u.user_id
-                LEFT JOIN users st ON c.class_id = st.class_id AND st.role = 'student'
-                GROUP BY c.class_id, c.class_name, c.grade, c.academic_year, 
-                         c.class_teacher_id, u.full_name
-                ORDER BY c.grade, c.class_name
-            """)
-            classes = Database.dict_fetchall(cursor)
-            
-            for item in self.classes_tree.get_children():
-                self.classes_tree.delete(item)
-            
-            for cls in classes:
-                self.classes_tree.insert("", "end", values=(
-                    cls['class_id'],
-                    cls['class_name'],
-                    cls['grade'],
-                    cls['academic_year'] or "---",
-                    cls['teacher_name'] or "---",
-                    cls['student_count']
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки: {str(e)}")
-        finally:
-            connection.close()
+        text = self.classes_search.filters()['text']
+        self.load_latest('classes', lambda cursor: self.fetch_classes_admin(cursor, text), self.classes_binding)
+    
+    @staticmethod
+    def fetch_classes_admin(cursor, text=""):
+        where, params = "", ()
+        if text:
+            where = "WHERE c.class_name LIKE ? ESCAPE '\\' OR u.full_name LIKE ? ESCAPE '\\'"
+            params = (Database.like_prefix(text),) * 2
+        
+        cursor.execute(f"""
+            SELECT c.*, u.full_name as teacher_name,
+                   COUNT(st.user_id) as student_count
+            FROM classes c
+            LEFT JOIN users u ON c.class_teacher_id = u.user_id
+            LEFT JOIN users st ON c.class_id = st.class_id AND st.role = 'student'
+            {where}
+            GROUP BY c.class_id, c.class_name, c.grade, c.academic_year, 
+                     c.class_teacher_id, u.full_name
+            ORDER BY c.grade, c.class_name
+        """, params)
+        return Database.dict_fetchall(cursor)
     
     def add_class(self):
         dialog = ctk.CTkToplevel(self)
@@ -2932,26 +5272,20 @@ class AdminApp(MainApp):
                 messagebox.showerror("Ошибка", "Год обучения должен быть числом от 1 до 11")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
                 cursor.execute("""
                     INSERT INTO classes (class_name, grade, academic_year)
                     VALUES (?, ?, ?)
                 """, (name, grade_int, year or None))
-                
-                connection.commit()
+            
+            def done(_):
+                ReferenceCache.invalidate('classes')
+                AdminApp.invalidate_stats()
                 messagebox.showinfo("Успех", "✅ Класс добавлен!")
                 self.load_classes_admin()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка добавления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка добавления", commit=True)
         
         # Кнопки
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
@@ -3045,27 +5379,21 @@ class AdminApp(MainApp):
                 messagebox.showerror("Ошибка", "Год обучения должен быть числом от 1 до 11")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
                 cursor.execute("""
                     UPDATE classes 
                     SET class_name = ?, grade = ?, academic_year = ?
                     WHERE class_id = ?
                 """, (name, grade_int, year or None, class_data[0]))
-                
-                connection.commit()
+            
+            def done(_):
+                ReferenceCache.invalidate('classes')
+                AdminApp.invalidate_stats()
                 messagebox.showinfo("Успех", "✅ Класс обновлен!")
                 self.load_classes_admin()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка обновления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка обновления", commit=True)
         
         # Кнопки
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
@@ -3095,23 +5423,24 @@ class AdminApp(MainApp):
         
         class_data = self.classes_tree.item(selected[0])['values']
         
-        if messagebox.askyesno("Подтверждение", f"Удалить класс {class_data[1]}?\nВсе связанные данные будут удалены!"):
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+        if messagebox.askyesno("Подтверждение", f"Удалить класс {class_data[1]}?"):
+            def save(cursor):
+                if Summaries.has_history(cursor, class_id=class_data[0]):
+                    return False
                 cursor.execute("DELETE FROM classes WHERE class_id = ?", (class_data[0],))
-                
-                connection.commit()
+                return True
+            
+            def done(deleted):
+                if not deleted:
+                    messagebox.showwarning("Внимание", "В классе есть ученики или отметки посещаемости")
+                    return
+                ReferenceCache.invalidate('classes')
+                AdminApp.invalidate_stats()
+                ScheduleOccupancy.reset()
                 messagebox.showinfo("Успех", "✅ Класс удален!")
                 self.load_classes_admin()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка удаления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка удаления", commit=True)
     
     def setup_subjects_tab(self):
         tab = self.tabview.tab("Предметы")
@@ -3137,9 +5466,18 @@ class AdminApp(MainApp):
                 width=120
             ).pack(side="left", padx=2)
         
+        # Поиск
+        self.subjects_search = SearchBar(tab, "🔍 Название предмета", self.load_subjects_admin)
+        self.subjects_search.pack(pady=(0, 5))
+        
         # Таблица предметов
         columns = ("ID", "Название", "Описание")
         self.subjects_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview", height=25)
+        self.subjects_binding = TreeBinding(self.subjects_tree, 'subject_id', lambda subject: (
+            subject['subject_id'],
+            subject['subject_name'],
+            subject['description'] or "---"
+        ))
         
         column_widths = [50, 150, 500]
         for i, col in enumerate(columns):
@@ -3151,33 +5489,21 @@ class AdminApp(MainApp):
         
         self.subjects_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
-        
-        self.load_subjects_admin()
     
     def load_subjects_admin(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
+        text = self.subjects_search.filters()['text']
+        self.load_latest('subjects', lambda cursor: self.fetch_subjects_admin(cursor, text), self.subjects_binding)
+    
+    @staticmethod
+    def fetch_subjects_admin(cursor, text=""):
+        if text:
+            cursor.execute(
+                "SELECT * FROM subjects WHERE subject_name LIKE ? ESCAPE '\\' ORDER BY subject_name",
+                (Database.like_prefix(text),)
+            )
+        else:
             cursor.execute("SELECT * FROM subjects ORDER BY subject_name")
-            subjects = Database.dict_fetchall(cursor)
-            
-            for item in self.subjects_tree.get_children():
-                self.subjects_tree.delete(item)
-            
-            for subject in subjects:
-                desc = subject['description'] or "---"
-                self.subjects_tree.insert("", "end", values=(
-                    subject['subject_id'],
-                    subject['subject_name'],
-                    desc
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки: {str(e)}")
-        finally:
-            connection.close()
+        return Database.dict_fetchall(cursor)
     
     def add_subject(self):
         dialog = ctk.CTkToplevel(self)
@@ -3222,26 +5548,20 @@ class AdminApp(MainApp):
                 messagebox.showwarning("Ошибка", "Введите название предмета")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
                 cursor.execute("""
                     INSERT INTO subjects (subject_name, description)
                     VALUES (?, ?)
                 """, (name, desc or None))
-                
-                connection.commit()
+            
+            def done(_):
+                ReferenceCache.invalidate('subjects')
+                AdminApp.invalidate_stats()
                 messagebox.showinfo("Успех", "✅ Предмет добавлен!")
                 self.load_subjects_admin()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка добавления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка добавления", commit=True)
         
         # Кнопки
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
@@ -3315,27 +5635,21 @@ class AdminApp(MainApp):
                 messagebox.showwarning("Ошибка", "Введите название предмета")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
                 cursor.execute("""
                     UPDATE subjects 
                     SET subject_name = ?, description = ?
                     WHERE subject_id = ?
                 """, (name, desc or None, subject_data[0]))
-                
-                connection.commit()
+            
+            def done(_):
+                ReferenceCache.invalidate('subjects')
+                AdminApp.invalidate_stats()
                 messagebox.showinfo("Успех", "✅ Предмет обновлен!")
                 self.load_subjects_admin()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка обновления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка обновления", commit=True)
         
         # Кнопки
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
@@ -3366,22 +5680,16 @@ class AdminApp(MainApp):
         subject_data = self.subjects_tree.item(selected[0])['values']
         
         if messagebox.askyesno("Подтверждение", f"Удалить предмет '{subject_data[1]}'?"):
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
                 cursor.execute("DELETE FROM subjects WHERE subject_id = ?", (subject_data[0],))
-                
-                connection.commit()
+            
+            def done(_):
+                ReferenceCache.invalidate('subjects')
+                AdminApp.invalidate_stats()
                 messagebox.showinfo("Успех", "✅ Предмет удален!")
                 self.load_subjects_admin()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка удаления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка удаления", commit=True)
     
     def setup_schedule_tab(self):
         tab = self.tabview.tab("Расписание")
@@ -3407,9 +5715,22 @@ class AdminApp(MainApp):
                 width=120
             ).pack(side="left", padx=2)
         
+        # Поиск
+        self.schedule_search = SearchBar(tab, "🔍 Класс или учитель", self.load_schedule_admin)
+        self.schedule_search.pack(pady=(0, 5))
+        
         # Таблица расписания
         columns = ("ID", "Класс", "День", "Урок", "Предмет", "Учитель", "Кабинет")
         self.schedule_tree = ttk.Treeview(tab, columns=columns, show="headings", style="Treeview", height=25)
+        self.schedule_binding = TreeBinding(self.schedule_tree, 'schedule_id', lambda item: (
+            item['schedule_id'],
+            item['class_name'],
+            item['day_of_week'],
+            item['lesson_number'],
+            item['subject_name'],
+            item['teacher_name'],
+            item['room'] or "---"
+        ))
         
         column_widths = [50, 80, 100, 50, 150, 150, 80]
         for i, col in enumerate(columns):
@@ -3421,53 +5742,44 @@ class AdminApp(MainApp):
         
         self.schedule_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
-        
-        self.load_schedule_admin()
     
     def load_schedule_admin(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT s.*, c.class_name, sub.subject_name, u.full_name as teacher_name
-                FROM schedule s
-                JOIN classes c ON s.class_id = c.class_id
-                JOIN subjects sub ON s.subject_id = sub.subject_id
-                JOIN users u ON s.teacher_id = u.user_id
-                ORDER BY 
-                    CASE s.day_of_week
-                        WHEN 'Понедельник' THEN 1
-                        WHEN 'Вторник' THEN 2
-                        WHEN 'Среда' THEN 3
-                        WHEN 'Четверг' THEN 4
-                        WHEN 'Пятница' THEN 5
-                        WHEN 'Суббота' THEN 6
-                        ELSE 7
-                    END,
-                    s.lesson_number
-            """)
-            schedule = Database.dict_fetchall(cursor)
-            
-            for item in self.schedule_tree.get_children():
-                self.schedule_tree.delete(item)
-            
-            for item in schedule:
-                self.schedule_tree.insert("", "end", values=(
-                    item['schedule_id'],
-                    item['class_name'],
-                    item['day_of_week'],
-                    item['lesson_number'],
-                    item['subject_name'],
-                    item['teacher_name'],
-                    item['room'] or "---"
-                ))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки: {str(e)}")
-        finally:
-            connection.close()
+        text = self.schedule_search.filters()['text']
+        
+        def fetch(cursor):
+            # Занятость нужна диалогам добавления и редактирования - загружаем её вместе со списком
+            ScheduleOccupancy.ensure(cursor)
+            return self.fetch_schedule_admin(cursor, text)
+        
+        self.load_latest('schedule', fetch, self.schedule_binding)
+    
+    @staticmethod
+    def fetch_schedule_admin(cursor, text=""):
+        where, params = "", ()
+        if text:
+            where = "WHERE c.class_name LIKE ? ESCAPE '\\' OR u.full_name LIKE ? ESCAPE '\\'"
+            params = (Database.like_prefix(text),) * 2
+        
+        cursor.execute(f"""
+            SELECT s.*, c.class_name, sub.subject_name, u.full_name as teacher_name
+            FROM schedule s
+            JOIN classes c ON s.class_id = c.class_id
+            JOIN subjects sub ON s.subject_id = sub.subject_id
+            JOIN users u ON s.teacher_id = u.user_id
+            {where}
+            ORDER BY 
+                CASE s.day_of_week
+                    WHEN 'Понедельник' THEN 1
+                    WHEN 'Вторник' THEN 2
+                    WHEN 'Среда' THEN 3
+                    WHEN 'Четверг' THEN 4
+                    WHEN 'Пятница' THEN 5
+                    WHEN 'Суббота' THEN 6
+                    ELSE 7
+                END,
+                s.lesson_number
+        """, params)
+        return Database.dict_fetchall(cursor)
     
     def add_schedule(self):
         dialog = ctk.CTkToplevel(self)
@@ -3549,7 +5861,7 @@ class AdminApp(MainApp):
         room_entry.pack(fill="x", padx=20, pady=(0, 15))
         
         # Загружаем данные для комбобоксов
-        self.load_schedule_combos(class_combo, subject_combo, teacher_combo)
+        indexes = self.load_schedule_combos(class_combo, subject_combo, teacher_combo)
         
         def save_schedule():
             class_name = class_combo.get()
@@ -3557,7 +5869,7 @@ class AdminApp(MainApp):
             lesson_num = lesson_entry.get().strip()
             subject_name = subject_combo.get()
             teacher_name = teacher_combo.get()
-            room = room_entry.get().strip()
+            room = ScheduleOccupancy.room(room_entry.get())
             
             if not all([class_name, day, lesson_num, subject_name, teacher_name]):
                 messagebox.showwarning("Ошибка", "Заполните все обязательные поля")
@@ -3571,41 +5883,40 @@ class AdminApp(MainApp):
                 messagebox.showerror("Ошибка", "Номер урока должен быть числом от 1 до 8")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
+            class_id = indexes['classes'].id_of(class_name)
+            subject_id = indexes['subjects'].id_of(subject_name)
+            teacher_id = indexes['teachers'].id_of(teacher_name)
+            if class_id is None or subject_id is None or teacher_id is None:
+                messagebox.showerror("Ошибка", "Не найдены данные для вставки")
                 return
-                
-            try:
-                cursor = connection.cursor()
-                cursor.execute("SELECT class_id FROM classes WHERE class_name = ?", (class_name,))
-                class_data = Database.dict_fetchone(cursor)
-                
-                cursor.execute("SELECT subject_id FROM subjects WHERE subject_name = ?", (subject_name,))
-                subject_data = Database.dict_fetchone(cursor)
-                
-                cursor.execute("SELECT user_id FROM users WHERE full_name = ? AND role = 'teacher'", (teacher_name,))
-                teacher_data = Database.dict_fetchone(cursor)
-                
-                if not class_data or not subject_data or not teacher_data:
-                    messagebox.showerror("Ошибка", "Не найдены данные для вставки")
-                    return
-                
-                cursor.execute("""
-                    INSERT INTO schedule (class_id, subject_id, teacher_id, 
-                                        day_of_week, lesson_number, room)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (class_data['class_id'], subject_data['subject_id'], 
-                      teacher_data['user_id'], day, lesson_int, room or None))
-                
-                connection.commit()
+            
+            lesson = {
+                'schedule_id': None, 'class_id': class_id, 'class_name': class_name,
+                'teacher_id': teacher_id, 'teacher_name': teacher_name,
+                'day_of_week': day, 'lesson_number': lesson_int, 'room': room
+            }
+            conflict = ScheduleOccupancy.conflict(lesson)
+            if conflict:
+                messagebox.showwarning("Конфликт расписания", conflict)
+                return
+            
+            def save(cursor):
+                with ScheduleOccupancy.guard(cursor, lesson):
+                    cursor.execute("""
+                        INSERT INTO schedule (class_id, subject_id, teacher_id, 
+                                            day_of_week, lesson_number, room)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (class_id, subject_id, teacher_id, day, lesson_int, room))
+                return ScheduleOccupancy.schedule_id(cursor, lesson)
+            
+            def done(schedule_id):
+                ScheduleOccupancy.put(dict(lesson, schedule_id=schedule_id))
+                ReferenceCache.invalidate('schedule')
                 messagebox.showinfo("Успех", "✅ Урок добавлен в расписание!")
                 self.load_schedule_admin()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка добавления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка добавления", commit=True)
         
         # Кнопки
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
@@ -3627,29 +5938,39 @@ class AdminApp(MainApp):
             hover_color=COLORS['warning']
         ).pack(side="left", padx=5)
     
-    def load_schedule_combos(self, class_combo, subject_combo, teacher_combo):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT class_name FROM classes ORDER BY class_name")
-            classes = Database.dict_fetchall(cursor)
-            class_combo['values'] = [cls['class_name'] for cls in classes]
-            
-            cursor.execute("SELECT subject_name FROM subjects ORDER BY subject_name")
-            subjects = Database.dict_fetchall(cursor)
-            subject_combo['values'] = [sub['subject_name'] for sub in subjects]
-            
-            cursor.execute("SELECT full_name FROM users WHERE role = 'teacher' ORDER BY full_name")
-            teachers = Database.dict_fetchall(cursor)
-            teacher_combo['values'] = [tch['full_name'] for tch in teachers]
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки данных: {str(e)}")
-        finally:
-            connection.close()
+    def load_schedule_combos(self, class_combo, subject_combo, teacher_combo, record=None):
+        """Заполняет списки в фоне и возвращает словарь их NameIndex.
+        
+        Словарь наполняется по мере загрузки, поэтому обработчики кнопок
+        берут индексы из него в момент нажатия. Если передана запись
+        расписания, её значения выставляются в списках после загрузки.
+        """
+        combos = {
+            'classes': (class_combo, 'class_id', 'class_name'),
+            'subjects': (subject_combo, 'subject_id', 'subject_name'),
+            'teachers': (teacher_combo, 'teacher_id', 'teacher_name')
+        }
+        indexes = {name: NameIndex() for name in combos}
+        
+        def show(loaded):
+            indexes.update(loaded)
+            for name, (combo, id_key, name_key) in combos.items():
+                if not combo.winfo_exists():
+                    return
+                combo['values'] = loaded[name].labels
+                if record is not None:
+                    combo.set(loaded[name].label_of(record[id_key]) or record[name_key])
+        
+        def load():
+            Database.run(ScheduleOccupancy.ensure)
+            return {name: ReferenceCache.index(name) for name in combos}
+        
+        self.tasks.submit(
+            load,
+            show,
+            lambda e: show_db_error("Ошибка загрузки данных", e)
+        )
+        return indexes
     
     def edit_schedule(self):
         selected = self.schedule_tree.selection()
@@ -3657,6 +5978,12 @@ class AdminApp(MainApp):
             messagebox.showwarning("Внимание", "Выберите урок для редактирования")
             return
         
+        record = self.schedule_binding.record(selected[0])
+        if record is None:
+            # Выбрана строка-заглушка "Загрузка...", а не урок
+            messagebox.showwarning("Внимание", "Выберите урок для редактирования")
+            return
+        
         schedule_data = self.schedule_tree.item(selected[0])['values']
         
         dialog = ctk.CTkToplevel(self)
@@ -3681,7 +6008,6 @@ class AdminApp(MainApp):
             text_color=COLORS['text_light']
         ).pack(anchor="w", pady=(10, 5), padx=20)
         class_combo = ttk.Combobox(main_frame, font=FONTS['body'])
-        class_combo.insert(0, schedule_data[1])
         class_combo.pack(fill="x", padx=20, pady=(0, 15))
         
         # День недели
@@ -3718,7 +6044,6 @@ class AdminApp(MainApp):
             text_color=COLORS['text_light']
         ).pack(anchor="w", pady=(10, 5), padx=20)
         subject_combo = ttk.Combobox(main_frame, font=FONTS['body'])
-        subject_combo.insert(0, schedule_data[4])
         subject_combo.pack(fill="x", padx=20, pady=(0, 15))
         
         # Учитель
@@ -3729,7 +6054,6 @@ class AdminApp(MainApp):
             text_color=COLORS['text_light']
         ).pack(anchor="w", pady=(10, 5), padx=20)
         teacher_combo = ttk.Combobox(main_frame, font=FONTS['body'])
-        teacher_combo.insert(0, schedule_data[5])
         teacher_combo.pack(fill="x", padx=20, pady=(0, 15))
         
         # Кабинет
@@ -3743,7 +6067,10 @@ class AdminApp(MainApp):
         room_entry.insert(0, schedule_data[6] if schedule_data[6] != "---" else "")
         room_entry.pack(fill="x", padx=20, pady=(0, 15))
         
-        self.load_schedule_combos(class_combo, subject_combo, teacher_combo)
+        class_combo.set(record['class_name'])
+        subject_combo.set(record['subject_name'])
+        teacher_combo.set(record['teacher_name'])
+        indexes = self.load_schedule_combos(class_combo, subject_combo, teacher_combo, record)
         
         def save_changes():
             class_name = class_combo.get()
@@ -3751,7 +6078,7 @@ class AdminApp(MainApp):
             lesson_num = lesson_entry.get().strip()
             subject_name = subject_combo.get()
             teacher_name = teacher_combo.get()
-            room = room_entry.get().strip()
+            room = ScheduleOccupancy.room(room_entry.get())
             
             if not all([class_name, day, lesson_num, subject_name, teacher_name]):
                 messagebox.showwarning("Ошибка", "Заполните все обязательные поля")
@@ -3765,42 +6092,40 @@ class AdminApp(MainApp):
                 messagebox.showerror("Ошибка", "Номер урока должен быть числом от 1 до 8")
                 return
             
-            connection = Database.get_connection()
-            if connection is None:
+            class_id = indexes['classes'].id_of(class_name)
+            subject_id = indexes['subjects'].id_of(subject_name)
+            teacher_id = indexes['teachers'].id_of(teacher_name)
+            if class_id is None or subject_id is None or teacher_id is None:
+                messagebox.showerror("Ошибка", "Не найдены данные для обновления")
                 return
-                
-            try:
-                cursor = connection.cursor()
-                cursor.execute("SELECT class_id FROM classes WHERE class_name = ?", (class_name,))
-                class_data = Database.dict_fetchone(cursor)
-                
-                cursor.execute("SELECT subject_id FROM subjects WHERE subject_name = ?", (subject_name,))
-                subject_data = Database.dict_fetchone(cursor)
-                
-                cursor.execute("SELECT user_id FROM users WHERE full_name = ? AND role = 'teacher'", (teacher_name,))
-                teacher_data = Database.dict_fetchone(cursor)
-                
-                if not class_data or not subject_data or not teacher_data:
-                    messagebox.showerror("Ошибка", "Не найдены данные для обновления")
-                    return
-                
-                cursor.execute("""
-                    UPDATE schedule 
-                    SET class_id = ?, subject_id = ?, teacher_id = ?,
-                        day_of_week = ?, lesson_number = ?, room = ?
-                    WHERE schedule_id = ?
-                """, (class_data['class_id'], subject_data['subject_id'], 
-                      teacher_data['user_id'], day, lesson_int, room or None, schedule_data[0]))
-                
-                connection.commit()
+            
+            lesson = {
+                'schedule_id': record['schedule_id'], 'class_id': class_id, 'class_name': class_name,
+                'teacher_id': teacher_id, 'teacher_name': teacher_name,
+                'day_of_week': day, 'lesson_number': lesson_int, 'room': room
+            }
+            conflict = ScheduleOccupancy.conflict(lesson)
+            if conflict:
+                messagebox.showwarning("Конфликт расписания", conflict)
+                return
+            
+            def save(cursor):
+                with ScheduleOccupancy.guard(cursor, lesson):
+                    cursor.execute("""
+                        UPDATE schedule 
+                        SET class_id = ?, subject_id = ?, teacher_id = ?,
+                            day_of_week = ?, lesson_number = ?, room = ?
+                        WHERE schedule_id = ?
+                    """, (class_id, subject_id, teacher_id, day, lesson_int, room, record['schedule_id']))
+            
+            def done(_):
+                ScheduleOccupancy.put(lesson)
+                ReferenceCache.invalidate('schedule')
                 messagebox.showinfo("Успех", "✅ Урок обновлен!")
                 self.load_schedule_admin()
                 dialog.destroy()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка обновления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка обновления", commit=True)
         
         # Кнопки
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
@@ -3831,22 +6156,16 @@ class AdminApp(MainApp):
         schedule_data = self.schedule_tree.item(selected[0])['values']
         
         if messagebox.askyesno("Подтверждение", f"Удалить урок {schedule_data[4]} для {schedule_data[1]}?"):
-            connection = Database.get_connection()
-            if connection is None:
-                return
-                
-            try:
-                cursor = connection.cursor()
+            def save(cursor):
                 cursor.execute("DELETE FROM schedule WHERE schedule_id = ?", (schedule_data[0],))
-                
-                connection.commit()
+            
+            def done(_):
+                ScheduleOccupancy.remove(schedule_data[0])
+                ReferenceCache.invalidate('schedule')
                 messagebox.showinfo("Успех", "✅ Урок удален из расписания!")
                 self.load_schedule_admin()
-                    
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка удаления: {str(e)}")
-            finally:
-                connection.close()
+            
+            self.run_db(save, done, "Ошибка удаления", commit=True)
     
     def setup_stats_tab(self):
         tab = self.tabview.tab("Статистика")
@@ -3862,25 +6181,69 @@ class AdminApp(MainApp):
         ).pack(pady=(20, 20))
         
         # Таблица статистики
+        stats_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        stats_frame.pack(fill="both", expand=True)
+        
         columns = ("Показатель", "Значение")
         self.stats_tree = ttk.Treeview(
-            main_frame, 
+            stats_frame, 
             columns=columns, 
             show="headings", 
             style="Treeview",
-            height=15
+            height=10
         )
+        self.stats_binding = TreeBinding(self.stats_tree, lambda stat: stat[0], lambda stat: stat)
         
         for col in columns:
             self.stats_tree.heading(col, text=col)
             self.stats_tree.column(col, width=350)
         
-        scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=self.stats_tree.yview)
+        scrollbar = ttk.Scrollbar(stats_frame, orient="vertical", command=self.stats_tree.yview)
         self.stats_tree.configure(yscrollcommand=scrollbar.set)
         
         self.stats_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
         
+        # Производительность: самые затратные запросы этой программы
+        ctk.CTkLabel(
+            main_frame,
+            text="⏱ Производительность",
+            font=FONTS['subtitle'],
+            text_color=COLORS['text_light']
+        ).pack(pady=(10, 0))
+        
+        perf_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        perf_frame.pack(fill="both", expand=True)
+        
+        columns = ("Запрос", "Вызовов", "Всего, мс", "Среднее, мс", "p95, мс", "Макс, мс", "Строк")
+        self.perf_tree = ttk.Treeview(
+            perf_frame, 
+            columns=columns, 
+            show="headings", 
+            style="Treeview",
+            height=8
+        )
+        self.perf_binding = TreeBinding(self.perf_tree, 'fingerprint', lambda entry: (
+            entry['fingerprint'],
+            entry['calls'],
+            f"{entry['execute_ms'] + entry['fetch_ms']:.1f}",
+            f"{(entry['execute_ms'] + entry['fetch_ms']) / entry['calls']:.1f}",
+            f"≤ {QueryStats.percentile(entry['histogram'], 0.95):g}",
+            f"{entry['max_ms']:.1f}",
+            entry['rows']
+        ))
+        
+        column_widths = [420, 70, 90, 100, 80, 80, 70]
+        for i, col in enumerate(columns):
+            self.perf_tree.heading(col, text=col)
+            self.perf_tree.column(col, width=column_widths[i])
+        
+        scrollbar = ttk.Scrollbar(perf_frame, orient="vertical", command=self.perf_tree.yview)
+        self.perf_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.perf_tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+        scrollbar.pack(side="right", fill="y", pady=10)
+        
         # Кнопка обновить
         button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
         button_frame.pack(pady=10)
@@ -3888,97 +6251,448 @@ class AdminApp(MainApp):
         ModernButton(
             button_frame,
             text="🔄 Обновить статистику",
-            command=self.load_stats,
+            command=lambda: self.load_stats(force=True),
             fg_color=COLORS['primary'],
             hover_color=COLORS['secondary']
         ).pack()
+    
+    def load_stats(self, force=False):
+        # Открытие вкладки берёт показатели из кэша, кнопка «Обновить» - всегда из базы
+        self.tasks.submit(
+            lambda: self.cached_stats(force),
+            self.show_stats,
+            lambda e: show_db_error("Ошибка загрузки статистики", e)
+        )
+    
+    def show_stats(self, stats):
+        # Обновляем только изменившиеся показатели
+        self.stats_binding.sync(stats)
+        # Замеры берутся из памяти, после запроса статистики - чтобы он тоже в них попал
+        self.perf_binding.sync(QueryStats.top())
+    
+    @staticmethod
+    def invalidate_stats():
+        """Сбрасывает кэш показателей: свои изменения видны на вкладке статистики сразу"""
+        with AdminApp._stats_lock:
+            AdminApp._stats_cache = None
+            AdminApp._stats_version += 1
+    
+    @staticmethod
+    def cached_stats(force=False):
+        """Показатели школы из общего кэша; старше ADMIN_STATS_TTL или с force=True - из базы"""
+        with AdminApp._stats_lock:
+            cached, version = AdminApp._stats_cache, AdminApp._stats_version
+        if not force and cached is not None and time.monotonic() - cached[0] < ADMIN_STATS_TTL:
+            return cached[1]
+        
+        stats = Database.run(AdminApp.fetch_stats)
+        with AdminApp._stats_lock:
+            if AdminApp._stats_version == version:
+                AdminApp._stats_cache = (time.monotonic(), stats)
+        return stats
+    
+    @staticmethod
+    def fetch_stats(cursor):
+        cursor.execute(AdminApp.STATS_SQL)
+        row = Database.dict_fetchone(cursor)
+        
+        stats = [
+            ("Количество Администраторы", row['admins']),
+            ("Количество Ученики", row['students']),
+            ("Количество Учителя", row['teachers']),
+            ("Количество классов", row['classes_count']),
+            ("Количество предметов", row['subjects_count']),
+            ("Средний балл по школе", f"{row['avg_grade']:.2f}" if row['avg_grade'] else "Нет данных")
+        ]
+        
+        if row['attendance_total']:
+            percentage = round(row['attendance_present'] * 100.0 / row['attendance_total'], 2)
+            stats.append(("Посещаемость за неделю", f"{percentage}%"))
+        else:
+            stats.append(("Посещаемость за неделю", "Нет данных"))
         
-        self.load_stats()
+        stats.append(("Домашних заданий на этой неделе", row['homework_count']))
+        stats.append(("Заблокированных пользователей", row['blocked_count']))
+        return stats
+
+class SchoolDataGenerator:
+    """Детерминированная синтетическая школа для проверки запросов на объёме.
     
-    def load_stats(self):
-        connection = Database.get_connection()
-        if connection is None:
-            return
-            
-        try:
+    Одинаковые параметры и seed дают одинаковые данные. Учебные дни - с понедельника
+    по субботу без летних каникул; расписание составлено так, что в один урок
+    учитель и кабинет заняты не более чем одним классом.
+    """
+    
+    SUBJECT_NAMES = [
+        'Математика', 'Русский язык', 'Литература', 'Английский язык', 'История',
+        'Обществознание', 'География', 'Биология', 'Физика', 'Химия', 'Информатика',
+        'Музыка', 'Изобразительное искусство', 'Технология', 'Физическая культура',
+        'ОБЖ', 'Алгебра', 'Геометрия', 'Астрономия', 'Немецкий язык'
+    ]
+    CLASS_LETTERS = 'АБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЭЮЯ'
+    DAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
+    LESSON_TYPES = (['урок', 'контрольная', 'самостоятельная', 'проект'], [80, 8, 10, 2])
+    GRADE_VALUES = ([2, 3, 4, 5], [5, 25, 40, 30])
+    
+    def __init__(self, **overrides):
+        self.config = dict(BENCHMARK_CONFIG, **overrides)
+        self.random = random.Random(self.config['seed'])
+    
+    def class_name(self, n):
+        """1А, 2А, ..., 11А, 1Б, ...; когда буквы кончаются, к ним добавляется номер"""
+        letter, repeat = divmod(n // 11, len(self.CLASS_LETTERS))[::-1]
+        return f"{n % 11 + 1}{self.CLASS_LETTERS[letter]}{repeat + 1 if repeat else ''}"
+    
+    def school_days(self):
+        """Учебные дни за config['years'] лет, заканчивая сегодняшним"""
+        day = date.today() - timedelta(days=365 * self.config['years'])
+        while day <= date.today():
+            if day.weekday() < len(self.DAYS) and day.month not in (6, 7, 8):
+                yield day
+            day += timedelta(days=1)
+    
+    def generate(self, progress=print):
+        """Заполняет пустую базу и возвращает {таблица: число строк}"""
+        config = self.config
+        rnd = self.random
+        counts = {}
+        
+        with Database.connection() as connection:
             cursor = connection.cursor()
-            stats = []
+            cursor.execute("SELECT COUNT(*) FROM classes")
+            if cursor.fetchone()[0]:
+                raise RuntimeError("В базе уже есть классы: синтетические данные загружаются только в пустую базу")
+            if config['teachers'] < config['classes']:
+                raise ValueError("Учителей меньше, чем классов: в один урок у кого-то из учителей было бы два класса")
             
-            # Количество пользователей по ролям
-            cursor.execute("""
-                SELECT role, COUNT(*) as count 
-                FROM users 
-                GROUP BY role
-            """)
-            role_stats = Database.dict_fetchall(cursor)
-            for stat in role_stats:
-                role_rus = {
-                    'admin': 'Администраторы',
-                    'teacher': 'Учителя',
-                    'student': 'Ученики'
-                }.get(stat['role'], stat['role'])
-                stats.append((f"Количество {role_rus}", stat['count']))
-            
-            # Количество классов
-            cursor.execute("SELECT COUNT(*) as count FROM classes")
-            class_count = Database.dict_fetchone(cursor)['count']
-            stats.append(("Количество классов", class_count))
-            
-            # Количество предметов
-            cursor.execute("SELECT COUNT(*) as count FROM subjects")
-            subject_count = Database.dict_fetchone(cursor)['count']
-            stats.append(("Количество предметов", subject_count))
-            
-            # Средняя оценка
-            cursor.execute("SELECT AVG(CAST(grade AS FLOAT)) as avg_grade FROM grades")
-            avg_grade = Database.dict_fetchone(cursor)['avg_grade']
-            stats.append(("Средний балл по школе", f"{avg_grade:.2f}" if avg_grade else "Нет данных"))
-            
-            # Посещаемость за последнюю неделю
-            cursor.execute("""
-                SELECT 
-                    SUM(CASE WHEN status = 'присутствовал' THEN 1 ELSE 0 END) as present,
-                    COUNT(*) as total,
-                    ROUND(SUM(CASE WHEN status = 'присутствовал' THEN 1 ELSE 0 END) * 100.0 / NULLIF(COUNT(*), 0), 2) as percentage
-                FROM attendance 
-                WHERE attendance_date >= DATEADD(DAY, -7, GETDATE())
-            """)
-            attendance = Database.dict_fetchone(cursor)
-            if attendance and attendance['total'] > 0:
-                stats.append(("Посещаемость за неделю", f"{attendance['percentage']}%"))
-            else:
-                stats.append(("Посещаемость за неделю", "Нет данных"))
+            def load(table, columns, rows):
+                started = time.perf_counter()
+                count = Database.bulk_insert(cursor, table, columns, rows, config['batch_size'])
+                counts[table] = counts.get(table, 0) + count
+                progress(f"{table}: {count} строк за {time.perf_counter() - started:.1f} с")
+            
+            def ids(sql):
+                cursor.execute(sql)
+                return [row[0] for row in cursor.fetchall()]
+            
+            # Один хэш на всех: scrypt для тысяч пользователей занял бы минуты
+            password = PasswordHasher.hash('password')
+            
+            load('users', ('username', 'password', 'full_name', 'role'), (
+                (f"teacher{n}", password, f"Учитель {n:04d}", 'teacher')
+                for n in range(1, config['teachers'] + 1)
+            ))
+            teachers = ids("SELECT user_id FROM users WHERE role = 'teacher' ORDER BY user_id")
+            
+            year = date.today().year
+            load('classes', ('class_name', 'grade', 'academic_year', 'class_teacher_id'), (
+                (self.class_name(n), n % 11 + 1, f"{year}-{year + 1}", teachers[n % len(teachers)])
+                for n in range(config['classes'])
+            ))
+            classes = ids("SELECT class_id FROM classes ORDER BY class_id")
+            
+            subject_names = [self.SUBJECT_NAMES[n % len(self.SUBJECT_NAMES)] +
+                             (f" {n // len(self.SUBJECT_NAMES) + 1}" if n >= len(self.SUBJECT_NAMES) else "")
+                             for n in range(config['subjects'])]
+            load('subjects', ('subject_name',), ((name,) for name in subject_names))
+            subjects = ids("SELECT subject_id FROM subjects ORDER BY subject_id")
+            
+            load('users', ('username', 'password', 'full_name', 'role', 'class_id'), (
+                (f"student{n}", password, f"Ученик {n:05d}", 'student', classes[n % len(classes)])
+                for n in range(1, config['students'] + 1)
+            ))
+            class_students = {class_id: [] for class_id in classes}
+            cursor.execute("SELECT user_id, class_id FROM users WHERE role = 'student' ORDER BY user_id")
+            for user_id, class_id in cursor.fetchall():
+                class_students[class_id].append(user_id)
+            
+            # Расписание: в каждый урок учителя раздаются классам без повторов, кабинет у класса свой
+            lessons = {}   # (класс, день недели) -> [(предмет, учитель), ...]
+            schedule_rows = []
+            for weekday, day_name in enumerate(self.DAYS):
+                for lesson in range(1, config['lessons_per_day'] + 1):
+                    free_teachers = rnd.sample(teachers, len(teachers))
+                    for n, class_id in enumerate(classes):
+                        subject_id = rnd.choice(subjects)
+                        teacher_id = free_teachers[n % len(free_teachers)]
+                        lessons.setdefault((class_id, weekday), []).append((subject_id, teacher_id))
+                        schedule_rows.append((class_id, subject_id, teacher_id, day_name, lesson, str(100 + n)))
+            load('schedule', ('class_id', 'subject_id', 'teacher_id', 'day_of_week', 'lesson_number', 'room'),
+                 schedule_rows)
+            
+            days = list(self.school_days())
+            
+            def grades():
+                for day in days:
+                    for class_id in classes:
+                        students = class_students[class_id]
+                        for subject_id, teacher_id in lessons[(class_id, day.weekday())]:
+                            for student_id in rnd.sample(students, min(config['grades_per_lesson'], len(students))):
+                                yield (student_id, subject_id, teacher_id,
+                                       rnd.choices(*self.GRADE_VALUES)[0], day,
+                                       rnd.choices(*self.LESSON_TYPES)[0])
+            load('grades', ('student_id', 'subject_id', 'teacher_id', 'grade', 'grade_date', 'lesson_type'),
+                 grades())
+            
+            def homework():
+                for day in days:
+                    for class_id in classes:
+                        subject_id, teacher_id = lessons[(class_id, day.weekday())][0]
+                        yield (teacher_id, class_id, subject_id, day, day + timedelta(days=7),
+                               f"Задание по теме урока {day.isoformat()}")
+            load('homework', ('teacher_id', 'class_id', 'subject_id', 'homework_date', 'due_date', 'description'),
+                 homework())
+            
+            def attendance():
+                for day in days:
+                    for class_id in classes:
+                        for student_id in class_students[class_id]:
+                            if rnd.random() < 0.93:
+                                yield (student_id, class_id, day, 'присутствовал', None)
+                            else:
+                                yield (student_id, class_id, day, 'отсутствовал', rnd.choice([None, 'болезнь']))
+            load('attendance', ('student_id', 'class_id', 'attendance_date', 'status', 'reason'), attendance())
+            
+            started = time.perf_counter()
+            Summaries.rebuild(cursor)
+            progress(f"сводные таблицы: {time.perf_counter() - started:.1f} с")
+            
+            connection.commit()
+        
+        ReferenceCache.invalidate('users', 'classes', 'subjects', 'schedule')
+        AdminApp.invalidate_stats()
+        ScheduleOccupancy.reset()
+        return counts
+
+
+class QueryBenchmark:
+    """Прогоняет запросы окон программы без интерфейса и считает задержки.
+    
+    Каждый сценарий выполняется config['iterations'] раз через Database.run - как
+    в окнах, вместе с получением соединения из пула. Ученики, учителя и классы
+    для запросов выбираются случайно, но воспроизводимо.
+    """
+    
+    PERCENTILES = (0.50, 0.95, 0.99)
+    
+    def __init__(self, **overrides):
+        self.config = dict(BENCHMARK_CONFIG, **overrides)
+        self.random = random.Random(self.config['seed'])
+    
+    def scenarios(self):
+        """[(название, функция выбора аргумента, work(cursor, аргумент)), ...]"""
+        def ids(sql):
+            return Database.run(lambda cursor: [row[0] for row in cursor.execute(sql).fetchall()])
+        
+        students = ids("SELECT user_id FROM users WHERE role = 'student'")
+        teachers = ids("SELECT user_id FROM users WHERE role = 'teacher'")
+        classes = ids("SELECT class_id FROM classes")
+        usernames = ids("SELECT username FROM users")
+        if not students or not teachers or not classes:
+            raise RuntimeError("В базе нет учеников, учителей или классов: сначала запустите --generate-data")
+        
+        student = lambda: self.random.choice(students)
+        teacher = lambda: self.random.choice(teachers)
+        school_class = lambda: self.random.choice(classes)
+        username = lambda: self.random.choice(usernames)
+        nothing = lambda: None
+        search = lambda: str(self.random.randint(1, 11))
+        
+        return [
+            ("Вход", username, lambda cursor, name: cursor.execute(LoginWindow.LOGIN_SQL, (name,)).fetchall()),
+            ("Ученик: всё сразу", student, StudentApp.fetch_dashboard),
+            ("Ученик: расписание", student, StudentApp.fetch_schedule),
+            ("Ученик: оценки", student, StudentApp.fetch_grades),
+            ("Ученик: задания", student, StudentApp.fetch_homework),
+            ("Ученик: посещаемость", student, StudentApp.fetch_attendance),
+            ("Ученик: статистика", student, StudentApp.fetch_stats),
+            ("Учитель: классы", teacher, TeacherApp.fetch_classes),
+            ("Учитель: ученики класса", school_class, TeacherApp.fetch_class_students),
+            ("Учитель: статистика", teacher, TeacherApp.fetch_teacher_stats),
+            ("Админ: пользователи", nothing,
+             lambda cursor, _: AdminApp.fetch_users_page(cursor, None, USERS_PAGE_SIZE)),
+            ("Админ: поиск пользователей", nothing,
+             lambda cursor, _: AdminApp.fetch_users_page(cursor, None, USERS_PAGE_SIZE, {'text': "Уче"})),
+            ("Админ: классы", nothing, lambda cursor, _: AdminApp.fetch_classes_admin(cursor)),
+            ("Админ: предметы", nothing, lambda cursor, _: AdminApp.fetch_subjects_admin(cursor)),
+            ("Админ: расписание", nothing, lambda cursor, _: AdminApp.fetch_schedule_admin(cursor)),
+            ("Админ: поиск в расписании", search, AdminApp.fetch_schedule_admin),
+            ("Админ: статистика", nothing, lambda cursor, _: AdminApp.fetch_stats(cursor)),
+        ]
+    
+    @staticmethod
+    def count_rows(result):
+        """Число строк в результате запроса: список, набор списков или одна запись"""
+        if result is None:
+            return 0
+        if isinstance(result, (list, tuple)):
+            return sum(QueryBenchmark.count_rows(item) if isinstance(item, list) else 1 for item in result)
+        return 1
+    
+    @staticmethod
+    def percentile(samples, fraction):
+        """Перцентиль по рангу из отсортированного списка"""
+        return samples[min(len(samples) - 1, max(0, int(len(samples) * fraction + 0.5) - 1))]
+    
+    def run(self, progress=print):
+        """Выполняет все сценарии и возвращает [(название, {'p50': мс, ..., 'rows_per_s': ...}), ...]"""
+        results = []
+        iterations = self.config['iterations']
+        progress(f"{'Запрос':<30}" + "".join(f"{f'p{p * 100:g}, мс':>12}" for p in self.PERCENTILES)
+                 + f"{'строк/с':>12}")
+        
+        for name, argument, work in self.scenarios():
+            # Первый прогон прогревает кэши СУБД и план запроса и в замер не входит
+            first = argument()
+            Database.run(lambda cursor: work(cursor, first))
+            
+            timings = []
+            rows = 0
+            for _ in range(iterations):
+                value = argument()
+                started = time.perf_counter()
+                result = Database.run(lambda cursor: work(cursor, value))
+                timings.append(time.perf_counter() - started)
+                rows += self.count_rows(result)
             
-            # Количество домашних заданий на этой неделе
+            timings.sort()
+            summary = {f"p{p * 100:g}": self.percentile(timings, p) * 1000 for p in self.PERCENTILES}
+            summary['rows_per_s'] = rows / sum(timings) if sum(timings) else 0
+            results.append((name, summary))
+            progress(f"{name:<30}" + "".join(f"{summary[f'p{p * 100:g}']:>12.2f}" for p in self.PERCENTILES)
+                     + f"{summary['rows_per_s']:>12.0f}")
+        return results
+
+
+def create_first_admin(progress=print):
+    """Создаёт администратора со случайным паролем, если его ещё нет; пароль показывается один раз.
+    
+    Регистрация создаёт только учеников и учителей, поэтому без этого шага в новую базу не войти.
+    Администратор с паролем admin из прежних версий схемы получает новый пароль так же.
+    """
+    def work(cursor):
+        cursor.execute("SELECT user_id, username, password FROM users WHERE role = 'admin'")
+        admins = cursor.fetchall()
+        known = [(user_id, username) for user_id, username, password in admins
+                 if PasswordHasher.verify('admin', password)]
+        if admins and not known:
+            return None
+        
+        password = secrets.token_urlsafe(12)
+        if known:
+            user_id, username = known[0]
+            cursor.executemany("UPDATE users SET password = ?, failed_attempts = 0 WHERE user_id = ?",
+                               [(PasswordHasher.hash(password), user_id) for user_id, _ in known])
+        else:
+            username = 'admin'
             cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM homework 
-                WHERE due_date >= GETDATE() 
-                AND due_date < DATEADD(DAY, 7, GETDATE())
-            """)
-            hw_count = Database.dict_fetchone(cursor)['count']
-            stats.append(("Домашних заданий на этой неделе", hw_count))
-            
-            # Количество заблокированных пользователей
-            cursor.execute("SELECT COUNT(*) as count FROM users WHERE is_blocked = 1")
-            blocked_count = Database.dict_fetchone(cursor)['count']
-            stats.append(("Заблокированных пользователей", blocked_count))
-            
-            # Очищаем и заполняем таблицу
-            for item in self.stats_tree.get_children():
-                self.stats_tree.delete(item)
-            
-            for stat_name, stat_value in stats:
-                self.stats_tree.insert("", "end", values=(stat_name, stat_value))
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки статистики: {str(e)}")
-        finally:
-            connection.close()
+                INSERT INTO users (username, password, full_name, role)
+                VALUES (?, ?, 'Администратор', 'admin')
+            """, (username, PasswordHasher.hash(password)))
+        return username, password
+    
+    created = Database.run(work, commit=True)
+    if created is None:
+        progress("Администратор уже есть")
+    else:
+        progress(f"Администратор: логин {created[0]}, пароль {created[1]}")
+        progress("Пароль больше нигде не сохранён - запишите его или смените после входа")
+    return created
+
+
+def verify_indexes(progress=print):
+    """Проверяет, что основные запросы окон используют свои индексы; возвращает число промахов"""
+    def first(sql):
+        return Database.run(lambda cursor: (cursor.execute(sql).fetchone() or (0,))[0])
+    
+    student = first("SELECT MIN(user_id) FROM users WHERE role = 'student'")
+    teacher = first("SELECT MIN(user_id) FROM users WHERE role = 'teacher'")
+    school_class = first("SELECT MIN(class_id) FROM classes")
+    
+    checks = [
+        ('ix_grades_student_date', "Ученик: оценки", StudentApp.GRADES_SQL, (student,)),
+        ('ix_attendance_student_date', "Ученик: посещаемость", StudentApp.ATTENDANCE_SQL, (student,)),
+        ('ix_homework_class_due', "Ученик: задания", StudentApp.HOMEWORK_SQL, (student,)),
+        ('ix_schedule_class_slot', "Ученик: расписание", StudentApp.SCHEDULE_SQL, (student,)),
+        ('ix_users_class_name', "Учитель: ученики класса", TeacherApp.CLASS_STUDENTS_SQL, (school_class,)),
+        ('ix_users_class_name', "Учитель: классы", TeacherApp.CLASSES_SQL, (teacher,)),
+        ('ix_schedule_teacher_slot', "Учитель: статистика", TeacherApp.STATS_SQL, (teacher,)),
+        ('ix_attendance_date', "Админ: статистика", AdminApp.STATS_SQL, ()),
+        ('ix_homework_due', "Админ: статистика", AdminApp.STATS_SQL, ()),
+    ]
+    
+    misses = 0
+    backend = Database.backend()
+    for index_name, title, sql, params in checks:
+        used = Database.run(lambda cursor: backend.index_used(cursor, index_name, sql, params))
+        misses += not used
+        progress(f"{'✅' if used else '❌'} {index_name:<28} {title}")
+    return misses
+
+
+def benchmark_overrides():
+    """Аргументы вида ключ=число после --generate-data / --benchmark"""
+    overrides = {}
+    for argument in sys.argv[1:]:
+        key, separator, value = argument.partition('=')
+        if separator and key in BENCHMARK_CONFIG:
+            overrides[key] = int(value)
+    return overrides
+
 
 def main():
+    if "--migrate" in sys.argv or "--init-db" in sys.argv:
+        for version, description in Database.migrate():
+            print(f"Применена версия {version}: {description}")
+        print(f"Схема базы данных ({Database.backend().name}) версии {Database.schema_version()}")
+        if "--init-db" in sys.argv:
+            create_first_admin()
+        Database.close_pool()
+        return
+    
+    if "--rebuild-summaries" in sys.argv:
+        # Пересчёт сводных таблиц после ручной правки оценок или посещаемости в базе
+        started = time.perf_counter()
+        Database.run(Summaries.rebuild, commit=True)
+        print(f"Сводные таблицы пересчитаны за {time.perf_counter() - started:.1f} с")
+        Database.close_pool()
+        return
+    
+    if "--verify-indexes" in sys.argv:
+        misses = verify_indexes()
+        Database.close_pool()
+        sys.exit(1 if misses else 0)
+    
+    if "--generate-data" in sys.argv:
+        # --generate-data [classes=200 students=6000 ...]: синтетическая школа в пустой базе
+        Database.migrate()
+        started = time.perf_counter()
+        counts = SchoolDataGenerator(**benchmark_overrides()).generate()
+        print(f"Загружено {sum(counts.values())} строк за {time.perf_counter() - started:.1f} с")
+        Database.close_pool()
+        return
+    
+    if "--benchmark" in sys.argv:
+        # --benchmark [iterations=50 seed=42]: задержки запросов окон на текущих данных
+        QueryBenchmark(**benchmark_overrides()).run()
+        Database.close_pool()
+        return
+    
+    if "--calibrate-password" in sys.argv:
+        # --calibrate-password [мс]: подобрать стоимость хэширования под желаемое время проверки
+        position = sys.argv.index("--calibrate-password") + 1
+        target_ms = float(sys.argv[position]) if position < len(sys.argv) else 250
+        setting, value, elapsed = PasswordHasher.calibrate(target_ms)
+        print(f"Алгоритм: {PasswordHasher.algorithm()}, цель: {target_ms:.0f} мс")
+        print(f"PASSWORD_CONFIG['{setting}'] = {value}  # проверка пароля ~{elapsed:.0f} мс")
+        print(f"или переменная окружения SCHOOL_{setting.upper()}={value}")
+        return
+    
     app = LoginWindow()
-    app.mainloop()
+    try:
+        app.mainloop()
+    finally:
+        Database.close_pool()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file